@@ -3,46 +3,132 @@
 """Vertices and indices for a variety of simple shapes"""
 
 import math
+import numpy as np
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
 
+
+def _vertexArray(vertices, stride):
+    # One row per vertex, when the stride is known
+    vertices = np.array(vertices, dtype=np.float32)
+    if vertices.ndim == 2:
+        assert stride is None or vertices.shape[1] == stride, "The vertices do not match the stride"
+        return vertices
+
+    # It is not guessed from the indices, as vertices not indexed would give a wrong stride
+    if stride is None:
+        return vertices
+
+    assert len(vertices) % stride == 0, "The number of floats is not a multiple of the stride"
+    return vertices.reshape(-1, stride)
+
+
 # A simple class container to store vertices and indices that define a shape
 class Shape:
-    def __init__(self, vertices, indices, textureFileName=None):
-        self.vertices = vertices
-        self.indices = indices
+    """
+    Vertices are stored as a (N,stride) float32 array, one row per vertex,
+    and indices as a uint32 array. Flat lists of vertices are also accepted,
+    with the stride (floats per vertex) given by the shape builder. Without it,
+    vertices are kept as a flat array.
+    """
+    def __init__(self, vertices, indices, textureFileName=None, stride=None):
+        self.indices = np.array(indices, dtype=np.uint32).reshape(-1)
+        self.vertices = _vertexArray(vertices, stride)
         self.textureFileName = textureFileName
 
 
+def _vertexRows(shape, stride):
+    # Vertices of the shape with one row per vertex, even if they were given as a list
+    return np.reshape(np.asarray(shape.vertices, dtype=np.float32), (-1, stride))
+
+
 def merge(destinationShape, strideSize, sourceShape):
 
     # current vertices are an offset for indices refering to vertices of the new shape
-    offset = len(destinationShape.vertices)
-    destinationShape.vertices += sourceShape.vertices
-    destinationShape.indices += [(offset/strideSize) + index for index in sourceShape.indices]
+    destination = _vertexRows(destinationShape, strideSize)
+    offset = len(destination)
+    destinationShape.vertices = np.concatenate([destination, _vertexRows(sourceShape, strideSize)])
+    destinationShape.indices = np.concatenate([
+        np.asarray(destinationShape.indices, dtype=np.uint32).reshape(-1),
+        np.asarray(sourceShape.indices, dtype=np.uint32).reshape(-1) + np.uint32(offset)])
 
 
-def applyOffset(shape, stride, offset):
+def mergeShapes(shapes, strideSize):
+    """A new shape with the vertices and indices of every shape, with a single concatenation"""
 
-    numberOfVertices = len(shape.vertices)//stride
+    vertices = [_vertexRows(shape, strideSize) for shape in shapes]
+    indices = [np.asarray(shape.indices, dtype=np.uint32).reshape(-1) for shape in shapes]
 
-    for i in range(numberOfVertices):
-        index = i * stride
-        shape.vertices[index]     += offset[0]
-        shape.vertices[index + 1] += offset[1]
-        shape.vertices[index + 2] += offset[2]
+    # Indices of each shape are shifted by the vertices of the previous ones
+    offsets = np.cumsum([0] + [len(shapeVertices) for shapeVertices in vertices[:-1]], dtype=np.uint32)
 
+    return Shape(
+        np.concatenate(vertices) if len(shapes) > 0 else np.zeros((0, strideSize), dtype=np.float32),
+        np.concatenate([shapeIndices + offset for shapeIndices, offset in zip(indices, offsets)]) if len(shapes) > 0 else [],
+        stride=strideSize)
 
-def scaleVertices(shape, stride, scaleFactor):
 
-    numberOfVertices = len(shape.vertices) // stride
+def applyOffset(shape, stride, offset):
+
+    vertices = _vertexRows(shape, stride)
+    vertices[:, 0:3] += np.asarray(offset, dtype=np.float32)
+    shape.vertices = vertices
+
+
+def scaleVertices(shape, stride, scaleFactor):
 
-    for i in range(numberOfVertices):
-        index = i * stride
-        shape.vertices[index]     *= scaleFactor[0]
-        shape.vertices[index + 1] *= scaleFactor[1]
-        shape.vertices[index + 2] *= scaleFactor[2]
+    vertices = _vertexRows(shape, stride)
+    vertices[:, 0:3] *= np.asarray(scaleFactor, dtype=np.float32)
+    shape.vertices = vertices
+
+
+def parametricSurface(f, normal_f, uv_range, nu, nv, attributes):
+    """
+    Shape of the surface f(u, v), sampled on a grid of nu x nv quads.
+    f and normal_f receive arrays with every (u, v) of the grid, returning (x, y, z) arrays.
+    uv_range is ((uMin, uMax), (vMin, vMax)).
+    attributes gives the floats of each vertex, in order:
+    - "position" and "normal": the values of f and normal_f
+    - "uv": texture coordinates, u and v mapped to [0, 1]
+    - a function of (u, v) returning a tuple of arrays, e.g. other texture coordinates
+    - a tuple of numbers, e.g. a color, equal for every vertex
+    Neighbouring quads share their vertices. Vertices along the borders of the grid are not
+    merged, as they may have different texture coordinates. Triangles collapsed to a line,
+    e.g. at the poles of a sphere, are not included.
+    """
+    (uMin, uMax), (vMin, vMax) = uv_range
+    u, v = np.meshgrid(np.linspace(uMin, uMax, nu + 1), np.linspace(vMin, vMax, nv + 1))
+
+    columns = []
+    positions = None
+    for attribute in attributes:
+        if isinstance(attribute, str) and attribute == "position":
+            values = f(u, v)
+            positions = np.stack(np.broadcast_arrays(*values), axis=-1).reshape(-1, 3)
+        elif isinstance(attribute, str) and attribute == "normal":
+            values = normal_f(u, v)
+        elif isinstance(attribute, str) and attribute == "uv":
+            values = ((u - uMin) / (uMax - uMin), (v - vMin) / (vMax - vMin))
+        elif callable(attribute):
+            values = attribute(u, v)
+        else:
+            values = attribute
+        columns += [np.broadcast_to(value, u.shape) for value in values]
+
+    vertices = np.stack(columns, axis=-1).reshape(-1, len(columns)).astype(np.float32)
+
+    # Each quad (i, j) has the corners v0 = (i, j), v1 = (i+1, j), v2 = (i+1, j+1), v3 = (i, j+1)
+    grid = np.arange((nv + 1) * (nu + 1), dtype=np.uint32).reshape(nv + 1, nu + 1)
+    v0, v1, v2, v3 = grid[:-1, :-1], grid[1:, :-1], grid[1:, 1:], grid[:-1, 1:]
+    triangles = np.stack([v0, v1, v2, v2, v3, v0], axis=-1).reshape(-1, 3)
+
+    if positions is not None:
+        corners = positions[triangles]
+        areas = np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1)
+        triangles = triangles[areas > 1e-6 * np.max(areas)]
+
+    return Shape(vertices, triangles.reshape(-1), stride=len(columns))
 
 
 def createAxis(length=1.0):
@@ -66,7 +152,7 @@ def createAxis(length=1.0):
          2, 3,
          4, 5]
 
-    return Shape(vertices, indices)
+    return Shape(vertices, indices, stride=6)
 
 
 def createRainbowTriangle():
@@ -82,7 +168,7 @@ def createRainbowTriangle():
     # We have a triangle every 3 indices specified
     indices = [0, 1, 2]
 
-    return Shape(vertices, indices)
+    return Shape(vertices, indices, stride=6)
 
 
 def createRainbowQuad():
@@ -101,7 +187,7 @@ def createRainbowQuad():
         0, 1, 2,
         2, 3, 0]
 
-    return Shape(vertices, indices)
+    return Shape(vertices, indices, stride=6)
 
 
 def createColorQuad(r, g, b):
@@ -120,7 +206,7 @@ def createColorQuad(r, g, b):
          0, 1, 2,
          2, 3, 0]
 
-    return Shape(vertices, indices)
+    return Shape(vertices, indices, stride=6)
 
 
 def createTextureQuad(nx, ny):
@@ -139,7 +225,7 @@ def createTextureQuad(nx, ny):
          0, 1, 2,
          2, 3, 0]
 
-    return Shape(vertices, indices)
+    return Shape(vertices, indices, stride=5)
 
 
 def createRainbowCircle(N):
@@ -166,7 +252,7 @@ def createRainbowCircle(N):
     # The final triangle connects back to the second vertex
     indices += [0, N, 1]
 
-    return Shape(vertices, indices)
+    return Shape(vertices, indices, stride=6)
 
 
 def createRainbowCube():
@@ -194,7 +280,7 @@ def createRainbowCube():
          5, 6, 2, 2, 1, 5,
          7, 4, 0, 0, 3, 7]
 
-    return Shape(vertices, indices)
+    return Shape(vertices, indices, stride=6)
 
 
 def createColorCube(r, g, b):
@@ -222,7 +308,7 @@ def createColorCube(r, g, b):
          5, 6, 2, 2, 1, 5,
          7, 4, 0, 0, 3, 7]
 
-    return Shape(vertices, indices)
+    return Shape(vertices, indices, stride=6)
 
 
 def createTextureCube(image_filename):
@@ -278,7 +364,7 @@ def createTextureCube(image_filename):
          19,18,17,17,16,19, # Y+
          20,21,22,22,23,20] # Y-
 
-    return Shape(vertices, indices, image_filename)
+    return Shape(vertices, indices, image_filename, stride=5)
 
 
 def createRainbowNormalsCube():
@@ -307,7 +393,7 @@ def createRainbowNormalsCube():
                5, 6, 2, 2, 1, 5,
                7, 4, 0, 0, 3, 7]
 
-    return Shape(vertices, indices)
+    return Shape(vertices, indices, stride=9)
 
 
 def createColorNormalsCube(r, g, b):
@@ -362,7 +448,7 @@ def createColorNormalsCube(r, g, b):
          19,18,17,17,16,19, # Y+
          20,21,22,22,23,20] # Y-
 
-    return Shape(vertices, indices)
+    return Shape(vertices, indices, stride=9)
 
 
 def createTextureNormalsCube(image_filename):
@@ -413,4 +499,4 @@ def createTextureNormalsCube(image_filename):
          19,18,17,17,16,19, # Y+
          20,21,22,22,23,20] # Y-
 
-    return Shape(vertices, indices, image_filename)
\ No newline at end of file
+    return Shape(vertices, indices, image_filename, stride=8)
\ No newline at end of file
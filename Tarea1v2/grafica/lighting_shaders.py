@@ -4,13 +4,14 @@
 from OpenGL.GL import *
 import OpenGL.GL.shaders
 from grafica.gpu_shape import GPUShape
+from grafica.easy_shaders import ShaderProgram
 
-class SimpleFlatShaderProgram():
+class SimpleFlatShaderProgram(ShaderProgram):
 
     def __init__(self):
 
         vertex_shader = """
-            #version 130
+            #version 330 core
 
             in vec3 position;
             in vec3 color;
@@ -19,21 +20,29 @@ class SimpleFlatShaderProgram():
             flat out vec4 vertexColor;
 
             uniform mat4 model;
-            uniform mat4 view;
-            uniform mat4 projection;
-
-            uniform vec3 lightPosition;
-            uniform vec3 viewPosition;
-            uniform vec3 La;
-            uniform vec3 Ld;
-            uniform vec3 Ls;
+
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
+
+            layout (std140, row_major) uniform Lights
+            {
+                vec3 lightPosition;
+                vec3 La;
+                vec3 Ld;
+                vec3 Ls;
+                float constantAttenuation;
+                float linearAttenuation;
+                float quadraticAttenuation;
+            };
+
             uniform vec3 Ka;
             uniform vec3 Kd;
             uniform vec3 Ks;
             uniform uint shininess;
-            uniform float constantAttenuation;
-            uniform float linearAttenuation;
-            uniform float quadraticAttenuation;
             
             void main()
             {
@@ -68,7 +77,7 @@ class SimpleFlatShaderProgram():
             """
 
         fragment_shader = """
-            #version 130
+            #version 330 core
 
             flat in vec4 vertexColor;
             out vec4 fragColor;
@@ -82,10 +91,14 @@ class SimpleFlatShaderProgram():
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -113,18 +126,18 @@ class SimpleFlatShaderProgram():
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
-class SimpleTextureFlatShaderProgram():
+class SimpleTextureFlatShaderProgram(ShaderProgram):
 
     def __init__(self):
 
         vertex_shader = """
-            #version 130
+            #version 330 core
 
             in vec3 position;
             in vec2 texCoords;
@@ -134,21 +147,29 @@ class SimpleTextureFlatShaderProgram():
             flat out vec3 vertexLightColor;
 
             uniform mat4 model;
-            uniform mat4 view;
-            uniform mat4 projection;
-
-            uniform vec3 lightPosition; 
-            uniform vec3 viewPosition; 
-            uniform vec3 La;
-            uniform vec3 Ld;
-            uniform vec3 Ls;
+
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
+
+            layout (std140, row_major) uniform Lights
+            {
+                vec3 lightPosition;
+                vec3 La;
+                vec3 Ld;
+                vec3 Ls;
+                float constantAttenuation;
+                float linearAttenuation;
+                float quadraticAttenuation;
+            };
+
             uniform vec3 Ka;
             uniform vec3 Kd;
             uniform vec3 Ks;
             uniform uint shininess;
-            uniform float constantAttenuation;
-            uniform float linearAttenuation;
-            uniform float quadraticAttenuation;
             
             void main()
             {
@@ -184,7 +205,7 @@ class SimpleTextureFlatShaderProgram():
             """
 
         fragment_shader = """
-            #version 130
+            #version 330 core
 
             flat in vec3 vertexLightColor;
             in vec2 fragTexCoords;
@@ -203,10 +224,14 @@ class SimpleTextureFlatShaderProgram():
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -236,18 +261,18 @@ class SimpleTextureFlatShaderProgram():
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
-class SimpleGouraudShaderProgram():
+class SimpleGouraudShaderProgram(ShaderProgram):
 
     def __init__(self):
 
         vertex_shader = """
-            #version 130
+            #version 330 core
 
             in vec3 position;
             in vec3 color;
@@ -256,21 +281,29 @@ class SimpleGouraudShaderProgram():
             out vec4 vertexColor;
 
             uniform mat4 model;
-            uniform mat4 view;
-            uniform mat4 projection;
-
-            uniform vec3 lightPosition;
-            uniform vec3 viewPosition;
-            uniform vec3 La;
-            uniform vec3 Ld;
-            uniform vec3 Ls;
+
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
+
+            layout (std140, row_major) uniform Lights
+            {
+                vec3 lightPosition;
+                vec3 La;
+                vec3 Ld;
+                vec3 Ls;
+                float constantAttenuation;
+                float linearAttenuation;
+                float quadraticAttenuation;
+            };
+
             uniform vec3 Ka;
             uniform vec3 Kd;
             uniform vec3 Ks;
             uniform uint shininess;
-            uniform float constantAttenuation;
-            uniform float linearAttenuation;
-            uniform float quadraticAttenuation;
             
             void main()
             {
@@ -305,7 +338,7 @@ class SimpleGouraudShaderProgram():
             """
 
         fragment_shader = """
-            #version 130
+            #version 330 core
 
             in vec4 vertexColor;
             out vec4 fragColor;
@@ -319,10 +352,14 @@ class SimpleGouraudShaderProgram():
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -350,18 +387,18 @@ class SimpleGouraudShaderProgram():
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
-class SimpleTextureGouraudShaderProgram():
+class SimpleTextureGouraudShaderProgram(ShaderProgram):
 
     def __init__(self):
 
         vertex_shader = """
-            #version 130
+            #version 330 core
 
             in vec3 position;
             in vec2 texCoords;
@@ -371,21 +408,29 @@ class SimpleTextureGouraudShaderProgram():
             out vec3 vertexLightColor;
 
             uniform mat4 model;
-            uniform mat4 view;
-            uniform mat4 projection;
-
-            uniform vec3 lightPosition; 
-            uniform vec3 viewPosition; 
-            uniform vec3 La;
-            uniform vec3 Ld;
-            uniform vec3 Ls;
+
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
+
+            layout (std140, row_major) uniform Lights
+            {
+                vec3 lightPosition;
+                vec3 La;
+                vec3 Ld;
+                vec3 Ls;
+                float constantAttenuation;
+                float linearAttenuation;
+                float quadraticAttenuation;
+            };
+
             uniform vec3 Ka;
             uniform vec3 Kd;
             uniform vec3 Ks;
             uniform uint shininess;
-            uniform float constantAttenuation;
-            uniform float linearAttenuation;
-            uniform float quadraticAttenuation;
             
             void main()
             {
@@ -421,7 +466,7 @@ class SimpleTextureGouraudShaderProgram():
             """
 
         fragment_shader = """
-            #version 130
+            #version 330 core
 
             in vec3 vertexLightColor;
             in vec2 fragTexCoords;
@@ -440,10 +485,14 @@ class SimpleTextureGouraudShaderProgram():
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -473,13 +522,13 @@ class SimpleTextureGouraudShaderProgram():
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
-class SimplePhongShaderProgram:
+class SimplePhongShaderProgram(ShaderProgram):
 
     def __init__(self):
         vertex_shader = """
@@ -494,14 +543,20 @@ class SimplePhongShaderProgram:
             out vec3 fragNormal;
 
             uniform mat4 model;
-            uniform mat4 view;
-            uniform mat4 projection;
+            uniform mat3 normalMatrix;
+
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
 
             void main()
             {
                 fragPosition = vec3(model * vec4(position, 1.0));
                 fragOriginalColor = color;
-                fragNormal = mat3(transpose(inverse(model))) * normal;  
+                fragNormal = normalMatrix * normal;
                 
                 gl_Position = projection * view * vec4(fragPosition, 1.0);
             }
@@ -516,18 +571,28 @@ class SimplePhongShaderProgram:
             in vec3 fragPosition;
             in vec3 fragOriginalColor;
             
-            uniform vec3 lightPosition; 
-            uniform vec3 viewPosition;
-            uniform vec3 La;
-            uniform vec3 Ld;
-            uniform vec3 Ls;
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
+
+            layout (std140, row_major) uniform Lights
+            {
+                vec3 lightPosition;
+                vec3 La;
+                vec3 Ld;
+                vec3 Ls;
+                float constantAttenuation;
+                float linearAttenuation;
+                float quadraticAttenuation;
+            };
+
             uniform vec3 Ka;
             uniform vec3 Kd;
             uniform vec3 Ks;
             uniform uint shininess;
-            uniform float constantAttenuation;
-            uniform float linearAttenuation;
-            uniform float quadraticAttenuation;
 
             void main()
             {
@@ -562,10 +627,14 @@ class SimplePhongShaderProgram:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -593,13 +662,13 @@ class SimplePhongShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
-class SimpleTexturePhongShaderProgram:
+class SimpleTexturePhongShaderProgram(ShaderProgram):
 
     def __init__(self):
         vertex_shader = """
@@ -614,14 +683,20 @@ class SimpleTexturePhongShaderProgram:
             out vec3 fragNormal;
 
             uniform mat4 model;
-            uniform mat4 view;
-            uniform mat4 projection;
+            uniform mat3 normalMatrix;
+
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
 
             void main()
             {
                 fragPosition = vec3(model * vec4(position, 1.0));
                 fragTexCoords = texCoords;
-                fragNormal = mat3(transpose(inverse(model))) * normal;  
+                fragNormal = normalMatrix * normal;
                 
                 gl_Position = projection * view * vec4(fragPosition, 1.0);
             }
@@ -636,18 +711,28 @@ class SimpleTexturePhongShaderProgram:
 
             out vec4 fragColor;
             
-            uniform vec3 lightPosition; 
-            uniform vec3 viewPosition; 
-            uniform vec3 La;
-            uniform vec3 Ld;
-            uniform vec3 Ls;
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
+
+            layout (std140, row_major) uniform Lights
+            {
+                vec3 lightPosition;
+                vec3 La;
+                vec3 Ld;
+                vec3 Ls;
+                float constantAttenuation;
+                float linearAttenuation;
+                float quadraticAttenuation;
+            };
+
             uniform vec3 Ka;
             uniform vec3 Kd;
             uniform vec3 Ks;
             uniform uint shininess;
-            uniform float constantAttenuation;
-            uniform float linearAttenuation;
-            uniform float quadraticAttenuation;
 
             uniform sampler2D samplerTex;
 
@@ -686,10 +771,14 @@ class SimpleTexturePhongShaderProgram:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -719,7 +808,7 @@ class SimpleTexturePhongShaderProgram:
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
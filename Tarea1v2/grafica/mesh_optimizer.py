@@ -0,0 +1,285 @@
+# coding=utf-8
+"""
+Optimization of indexed triangle meshes before they are uploaded to GPU memory.
+
+- weldVertices merges vertices with the same attributes, within a tolerance.
+- optimizeVertexCache orders the triangles so vertices already transformed by
+  the GPU are reused (Tom Forsyth, "Linear-Speed Vertex Cache Optimisation").
+- optimizeVertexFetch orders the vertices as they are first used by the triangles.
+- simplifyShape and lodChain build coarser levels of detail, see sg.LODNode.
+
+The average cache miss ratio (ACMR) is the number of vertices transformed per triangle.
+It is 3 without any reuse, and it gets close to 0.5 for regular grids.
+"""
+
+import numpy as np
+import grafica.basic_shapes as bs
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+# Vertices kept by the post-transform cache of most GPUs
+CACHE_SIZE = 32
+
+# Constants of the scores by Forsyth
+_CACHE_DECAY_POWER = 1.5
+_LAST_TRIANGLE_SCORE = 0.75
+_VALENCE_BOOST_SCALE = 2.0
+_VALENCE_BOOST_POWER = 0.5
+
+
+def acmr(indices, cacheSize=CACHE_SIZE):
+    """Vertices transformed per triangle, with a FIFO cache of cacheSize vertices"""
+
+    indices = np.asarray(indices).reshape(-1)
+    if len(indices) == 0:
+        return 0.0
+
+    cache = [-1] * cacheSize
+    inCache = set()
+    position = 0
+    misses = 0
+
+    for index in indices.tolist():
+        if index in inCache:
+            continue
+
+        misses += 1
+        inCache.discard(cache[position])
+        cache[position] = index
+        inCache.add(index)
+        position = (position + 1) % cacheSize
+
+    return misses / (len(indices) // 3)
+
+
+def weldVertices(vertices, indices, stride, tolerance=1e-6):
+    """
+    Vertices with every attribute equal within tolerance are merged into one.
+    It returns the new (N,stride) vertices, in order of first appearance, and the remapped indices.
+    """
+    vertices = np.reshape(np.asarray(vertices, dtype=np.float32), (-1, stride))
+    indices = np.asarray(indices, dtype=np.uint32).reshape(-1)
+
+    # Attributes are snapped to a grid of the size of the tolerance
+    keys = np.round(vertices / tolerance).astype(np.int64)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # Unique vertices are sorted by their first appearance, keeping the original order
+    order = np.argsort(first)
+    remap = np.empty(len(order), dtype=np.uint32)
+    remap[order] = np.arange(len(order), dtype=np.uint32)
+
+    return vertices[first[order]], remap[inverse][indices]
+
+
+def _scoreTables(cacheSize, maxValence):
+    cacheScores = np.empty(cacheSize + 3)
+    cacheScores[0:3] = _LAST_TRIANGLE_SCORE
+    scaler = 1.0 / (cacheSize - 3)
+    cacheScores[3:] = (1.0 - (np.arange(3, cacheSize + 3) - 3) * scaler).clip(0) ** _CACHE_DECAY_POWER
+    cacheScores[cacheSize:] = 0
+
+    valenceScores = np.zeros(maxValence + 1)
+    valenceScores[1:] = _VALENCE_BOOST_SCALE * np.arange(1, maxValence + 1, dtype=np.float64) ** -_VALENCE_BOOST_POWER
+    return cacheScores.tolist(), valenceScores.tolist()
+
+
+def optimizeVertexCache(indices, vertexCount, cacheSize=CACHE_SIZE):
+    """Triangles of indices reordered to reuse the vertices in the post-transform cache"""
+
+    triangles = np.asarray(indices, dtype=np.uint32).reshape(-1, 3)
+    triangleCount = len(triangles)
+    if triangleCount == 0:
+        return triangles.reshape(-1)
+
+    # Triangles using each vertex, as slices of a single array
+    corners = triangles.reshape(-1)
+    valence = np.bincount(corners, minlength=vertexCount)
+    starts = np.concatenate([[0], np.cumsum(valence)])
+    adjacency = (np.argsort(corners, kind="stable") // 3).tolist()
+    starts = starts.tolist()
+
+    cacheScores, valenceScores = _scoreTables(cacheSize, int(valence.max()))
+    remaining = valence.tolist()
+    triangleList = triangles.tolist()
+
+    # Triangles still to be emitted by each vertex are the first remaining[v] of its slice
+    def vertexScore(vertex, position):
+        if remaining[vertex] == 0:
+            return -1.0
+        score = valenceScores[remaining[vertex]]
+        if position >= 0:
+            score += cacheScores[position]
+        return score
+
+    cachePosition = [-1] * vertexCount
+    vertexScores = [vertexScore(vertex, -1) for vertex in range(vertexCount)]
+    triangleScores = [sum(vertexScores[vertex] for vertex in triangle) for triangle in triangleList]
+    emitted = [False] * triangleCount
+
+    cache = []
+    output = []
+    bestTriangle = max(range(triangleCount), key=triangleScores.__getitem__)
+    nextUnemitted = 0
+
+    for _ in range(triangleCount):
+        if bestTriangle < 0:
+            # No triangle uses a cached vertex, the next one in the original order is taken
+            while emitted[nextUnemitted]:
+                nextUnemitted += 1
+            bestTriangle = nextUnemitted
+
+        triangle = triangleList[bestTriangle]
+        emitted[bestTriangle] = True
+        output += [triangle]
+
+        for vertex in triangle:
+            # The emitted triangle is moved past the remaining ones of the vertex
+            start = starts[vertex]
+            count = remaining[vertex]
+            for k in range(start, start + count):
+                if adjacency[k] == bestTriangle:
+                    adjacency[k], adjacency[start + count - 1] = adjacency[start + count - 1], adjacency[k]
+                    break
+            remaining[vertex] = count - 1
+
+        # Vertices of the triangle go to the front of the LRU cache
+        cache = triangle + [vertex for vertex in cache if vertex not in triangle]
+        for position in range(len(cache)):
+            cachePosition[cache[position]] = position if position < cacheSize else -1
+
+        # Scores change for the vertices in the cache and the ones just evicted
+        bestTriangle = -1
+        bestScore = -1.0
+        for vertex in cache:
+            newScore = vertexScore(vertex, cachePosition[vertex])
+            delta = newScore - vertexScores[vertex]
+            vertexScores[vertex] = newScore
+
+            start = starts[vertex]
+            for k in range(start, start + remaining[vertex]):
+                other = adjacency[k]
+                triangleScores[other] += delta
+                if triangleScores[other] > bestScore:
+                    bestScore = triangleScores[other]
+                    bestTriangle = other
+
+        cache = cache[0:cacheSize]
+
+    return np.array(output, dtype=np.uint32).reshape(-1)
+
+
+def optimizeVertexFetch(vertices, indices, stride):
+    """Vertices reordered as they are first used by indices, unused vertices are dropped"""
+
+    vertices = np.reshape(np.asarray(vertices, dtype=np.float32), (-1, stride))
+    indices = np.asarray(indices, dtype=np.uint32).reshape(-1)
+
+    used, first = np.unique(indices, return_index=True)
+    order = used[np.argsort(first)]
+    remap = np.zeros(len(vertices), dtype=np.uint32)
+    remap[order] = np.arange(len(order), dtype=np.uint32)
+
+    return vertices[order], remap[indices]
+
+
+class OptimizationReport:
+    """Vertices and ACMR of a mesh before and after optimizeShape"""
+
+    def __init__(self, verticesBefore, verticesAfter, acmrBefore, acmrAfter):
+        self.verticesBefore = verticesBefore
+        self.verticesAfter = verticesAfter
+        self.acmrBefore = acmrBefore
+        self.acmrAfter = acmrAfter
+
+    def __str__(self):
+        return f"vertices {self.verticesBefore} -> {self.verticesAfter}, ACMR {self.acmrBefore:.3f} -> {self.acmrAfter:.3f}"
+
+
+def optimizeShape(shape, stride=None, tolerance=1e-6, cacheSize=CACHE_SIZE):
+    """
+    A new bs.Shape with welded vertices, and triangles and vertices reordered for the GPU caches.
+    It returns the shape and an OptimizationReport.
+    """
+    vertices, indices, stride = _shapeArrays(shape, stride)
+    verticesBefore = len(vertices)
+    acmrBefore = acmr(indices, cacheSize)
+
+    vertices, indices = weldVertices(vertices, indices, stride, tolerance)
+    indices = optimizeVertexCache(indices, len(vertices), cacheSize)
+    vertices, indices = optimizeVertexFetch(vertices, indices, stride)
+
+    report = OptimizationReport(verticesBefore, len(vertices), acmrBefore, acmr(indices, cacheSize))
+    return bs.Shape(vertices, indices, shape.textureFileName, stride=stride), report
+
+
+def simplifyShape(shape, gridSize, stride=None, normalOffset=None):
+    """
+    A coarser version of the shape, by vertex clustering: its bounding box is divided in cells,
+    gridSize along its longest side, and the vertices of each cell are merged into their average.
+    Triangles left with less than 3 different vertices, or repeated, are removed.
+    If normalOffset is given, merged normals are normalized again.
+    Every attribute is averaged, so texture seams get blurred: generated shapes should
+    rather be built again with a lower resolution.
+    """
+    vertices, indices, stride = _shapeArrays(shape, stride)
+    if len(vertices) == 0:
+        return bs.Shape(vertices, indices, shape.textureFileName, stride=stride)
+
+    positions = vertices[:, 0:3]
+    low = np.min(positions, axis=0)
+    extent = np.max(np.max(positions, axis=0) - low)
+    cellSize = extent / gridSize if extent > 0 else 1.0
+
+    cells = np.floor((positions - low) / cellSize).astype(np.int64)
+    _, clusters = np.unique(cells, axis=0, return_inverse=True)
+    clusters = clusters.reshape(-1)
+
+    # Average of the vertices of each cell
+    clusterCount = int(np.max(clusters)) + 1
+    sums = np.zeros((clusterCount, stride), dtype=np.float64)
+    np.add.at(sums, clusters, vertices)
+    merged = (sums / np.bincount(clusters, minlength=clusterCount)[:, np.newaxis]).astype(np.float32)
+
+    if normalOffset is not None:
+        normals = merged[:, normalOffset:normalOffset + 3]
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        lengths[lengths == 0] = 1
+        merged[:, normalOffset:normalOffset + 3] = normals / lengths
+
+    triangles = clusters[indices].reshape(-1, 3)
+    collapsed = (triangles[:, 0] == triangles[:, 1]) | (triangles[:, 1] == triangles[:, 2]) | (triangles[:, 2] == triangles[:, 0])
+    triangles = triangles[~collapsed]
+
+    # Triangles merged into the same corners are kept once, in their original order
+    _, unique = np.unique(np.sort(triangles, axis=1), axis=0, return_index=True)
+    triangles = triangles[np.sort(unique)]
+
+    vertices, indices = optimizeVertexFetch(merged, triangles, stride)
+    return bs.Shape(vertices, indices, shape.textureFileName, stride=stride)
+
+
+def lodChain(shape, gridSizes=(32, 16, 8), stride=None, normalOffset=None):
+    """
+    Levels of detail of a shape, from the shape itself to the coarsest one,
+    simplified with each of the gridSizes. Levels not reducing the triangles are skipped.
+    """
+    levels = [shape]
+    for gridSize in gridSizes:
+        level = simplifyShape(shape, gridSize, stride, normalOffset)
+        if len(level.indices) < len(np.reshape(levels[-1].indices, -1)):
+            levels += [level]
+    return levels
+
+
+def _shapeArrays(shape, stride):
+    # (N,stride) vertices, indices and stride of a bs.Shape, even if it holds lists
+    if stride is None:
+        stride = np.shape(shape.vertices)[1] if np.ndim(shape.vertices) == 2 else None
+    assert stride is not None, "The stride of the shape is unknown"
+
+    vertices = np.reshape(np.asarray(shape.vertices, dtype=np.float32), (-1, stride))
+    indices = np.asarray(shape.indices, dtype=np.uint32).reshape(-1)
+    return vertices, indices, stride
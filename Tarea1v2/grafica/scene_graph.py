@@ -3,53 +3,519 @@
 
 from OpenGL.GL import *
 import OpenGL.GL.shaders
+import itertools
 import numpy as np
 import grafica.transformations as tr
 import grafica.gpu_shape as gs
+import grafica.easy_shaders as es
+import grafica.gpu_registry as gr
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
 
 
+# Any change in the childs of any node increases this counter,
+# so compiled draw lists know when they must be compiled again
+_structureStamp = 0
+
+
+def _structureChanged():
+    global _structureStamp
+    _structureStamp += 1
+
+
+# When a profiler is set (see grafica.scene_profiler), every node visited
+# by drawSceneGraphNode and findNode is measured
+_profiler = None
+
+
+def setProfiler(profiler):
+    """Enables profiling with the given profiler, or disables it with None"""
+    global _profiler
+    _profiler = profiler
+
+
+class _ChildList(list):
+    """A list of childs which reports every modification of the scene graph structure"""
+
+    def __setitem__(self, key, value):
+        list.__setitem__(self, key, value)
+        _structureChanged()
+
+    def __delitem__(self, key):
+        list.__delitem__(self, key)
+        _structureChanged()
+
+    def __iadd__(self, other):
+        result = list.__iadd__(self, other)
+        _structureChanged()
+        return result
+
+    def append(self, child):
+        list.append(self, child)
+        _structureChanged()
+
+    def extend(self, childs):
+        list.extend(self, childs)
+        _structureChanged()
+
+    def insert(self, index, child):
+        list.insert(self, index, child)
+        _structureChanged()
+
+    def remove(self, child):
+        list.remove(self, child)
+        _structureChanged()
+
+    def pop(self, index=-1):
+        child = list.pop(self, index)
+        _structureChanged()
+        return child
+
+    def clear(self):
+        list.clear(self)
+        _structureChanged()
+
+
 class SceneGraphNode:
     """
     A simple class to handle a scene graph
     Each node represents a group of objects
     Each leaf represents a basic figure (GPUShape)
     To identify each node properly, it MUST have a unique name
+    Names below a node are indexed the first time they are searched,
+    and the index is built again only when the structure changes.
+
+    World transforms are cached per node, so a subtree is only recomputed
+    when one of the transforms along its path is assigned again.
+    If a transform is modified in place, markDirty() must be called.
+    The parentTransform given to drawSceneGraphNode and the find functions is kept
+    as the single parent of the node: alternating different parentTransforms on the
+    same node recomputes its whole subtree on every call. Each parentTransform should
+    then have its own root node, with the shared node as its child.
+
+    Bounds of each subtree are merged from the bounds of its GPUShapes,
+    so whole subtrees outside the view frustum can be skipped when drawing.
     """
     def __init__(self, name):
         self.name = name
+        self._version = 0
+        self._worldCache = {}
+        self._rootParent = None
+        self._nameIndex = None
+        self._nameIndexStamp = -1
+        self._bounds = None
+        self._boundsKey = None
+        self._boundsStamp = 0
+        self._boundsPass = 0
         self.transform = tr.identity()
         self.childs = []
 
+    @property
+    def childs(self):
+        return self._childs
+
+    @childs.setter
+    def childs(self, childs):
+        # Assigning the same childs again does not change the structure,
+        # so the name indices and draw lists are kept
+        current = getattr(self, "_childs", None)
+        if current is not None and len(current) == len(childs) and all(a is b for a, b in zip(current, childs)):
+            return
+
+        self._childs = _ChildList(childs)
+        _structureChanged()
+
+    @property
+    def transform(self):
+        return self._transform
+
+    @transform.setter
+    def transform(self, transform):
+        self._transform = transform
+        self._version += 1
+
+    def markDirty(self):
+        """Invalidates the cached world transforms of this node and its subtree"""
+        self._version += 1
+
     def clear(self):
-        """Freeing GPU memory"""
+        """
+        Freeing GPU memory.
+        Nodes and GPUShapes with several parents in the subtree are cleared once.
+        """
+        self._clear(set())
 
+    def _clear(self, visited):
         for child in self.childs:
-            child.clear()
+            if id(child) in visited:
+                continue
+            visited.add(id(child))
+
+            if isinstance(child, SceneGraphNode):
+                child._clear(visited)
+            else:
+                child.clear()
+
+
+class InstancedNode(SceneGraphNode):
+    """
+    A node drawing several copies of a GPUShape with a single instanced draw call.
+    Each copy is placed by its own model matrix, relative to this node, and has its own color.
+    Instance data is given with self.instances.update(models, colors).
+    The pipeline must support instancing, e.g. es.SimpleInstancedModelViewProjectionShaderProgram
+    """
+    def __init__(self, name, gpuShape, pipeline, count):
+        super().__init__(name)
+        self.instances = gs.InstanceBuffer(count)
+        self.instances.update()
+
+        # A VAO of its own, sharing the vertices and indices of gpuShape
+        self.gpuShape = gs.ShapeView(gpuShape)
+        pipeline.setupVAO(self.gpuShape, self.instances)
+
+    def _clear(self, visited):
+        # The shared GPUShape must be cleared by its owner
+        self.gpuShape.clear()
+        self.instances.clear()
+
+
+class LODNode(SceneGraphNode):
+    """
+    A node drawing one of several levels of detail of a shape, from the finest to the coarsest.
+    The level is chosen from the size of the shape on the screen, as a fraction of the screen height:
+    levels[i] is drawn while that size is between sizes[i] and sizes[i-1].
+    A level only changes when the size goes past a limit by more than hysteresis (a fraction
+    of the limit), so shapes close to a limit do not switch levels on every frame.
+    Levels are chosen when a viewProjection is given to the draw functions,
+    otherwise the finest level is drawn.
+    """
+    def __init__(self, name, levels, sizes, hysteresis=0.2):
+        super().__init__(name)
+        assert len(sizes) == len(levels) - 1, "A size limit is needed between each pair of levels"
+        self.levels = list(levels)
+        self.sizes = list(sizes)
+        self.hysteresis = hysteresis
+
+        # Current level through each path, as a shared node is drawn at several places
+        self._selected = {}
+
+    def selectLevel(self, path, clipMatrix):
+        """
+        GPUShape to draw through path (any key of the place where the node is drawn),
+        clipMatrix being viewProjection times the world transform of the node.
+        """
+        level = self._selected.get(path, 0)
+        size = _projectedSize(_shapeBounds(self.levels[0]), clipMatrix)
+
+        while level < len(self.sizes) and size < self.sizes[level] * (1 - self.hysteresis):
+            level += 1
+        while level > 0 and size > self.sizes[level - 1] * (1 + self.hysteresis):
+            level -= 1
+
+        self._selected[path] = level
+        lodCounters.drawn[level] = lodCounters.drawn.get(level, 0) + 1
+        return self.levels[level]
+
+    def _clear(self, visited):
+        for level in self.levels:
+            if id(level) not in visited:
+                visited.add(id(level))
+                level.clear()
+
+
+# Every recomputed world transform receives a new stamp,
+# so children can check whether their parent changed since the last frame
+_stamps = itertools.count(1)
+
+
+class _WorldTransform:
+    """Cached world transform of a node reached through a given parent"""
+    __slots__ = ("matrix", "stamp", "parentStamp", "localVersion", "normal", "normalStamp")
+
+    def __init__(self):
+        self.matrix = None
+        self.stamp = 0
+        self.parentStamp = -1
+        self.localVersion = -1
+        self.normal = None
+        self.normalStamp = -1
+
+
+def _setParentTransform(parent, parentTransform):
+    # The stamp of a transform given by the caller only changes when its value changes
+    if parent.matrix is None or not np.array_equal(parent.matrix, parentTransform):
+        parent.matrix = np.array(parentTransform, dtype=np.float32)
+        parent.stamp = next(_stamps)
+
+
+def _rootTransform(node, parentTransform):
+    # The transform given by the caller acts as the parent of the root node.
+    # There is one per node, see the SceneGraphNode docstring
+    if node._rootParent is None:
+        node._rootParent = _WorldTransform()
+
+    _setParentTransform(node._rootParent, parentTransform)
+    return node._rootParent
+
+
+def _refreshWorldTransform(node, parent, world):
+    if world.parentStamp != parent.stamp or world.localVersion != node._version:
+        world.matrix = np.matmul(parent.matrix, node.transform, dtype=np.float32)
+        world.parentStamp = parent.stamp
+        world.localVersion = node._version
+        world.stamp = next(_stamps)
+
+
+def _updateWorldTransform(node, parent):
+    # Nodes with several parents (shared nodes) keep one cached transform per parent path
+    world = node._worldCache.get(parent)
+    if world is None:
+        world = _WorldTransform()
+        node._worldCache[parent] = world
+
+    _refreshWorldTransform(node, parent, world)
+    return world
+
+
+class CullingCounters:
+    """Subtrees culled and shapes drawn since the last reset"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.culled = 0
+        self.drawn = 0
+
+    def __str__(self):
+        return f" [{self.drawn} drawn - {self.culled} culled]"
+
+
+cullingCounters = CullingCounters()
+
+
+class LODCounters:
+    """Shapes drawn at each level of detail since the last reset"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.drawn = {}
+
+    def __str__(self):
+        return " [LOD " + " ".join(f"{level}:{self.drawn[level]}" for level in sorted(self.drawn)) + "]"
+
+
+lodCounters = LODCounters()
+
+# Bounds of a subtree containing GPUShapes whose size is not known
+_UNBOUNDED = (np.full(3, -np.inf, dtype=np.float32), np.full(3, np.inf, dtype=np.float32))
+
+
+def _transformBounds(matrix, bounds):
+    # Box containing the given box after the transform (Arvo's method)
+    if bounds is None or not np.all(np.isfinite(bounds[0])) or not np.all(np.isfinite(bounds[1])):
+        return bounds
+
+    center = (bounds[0] + bounds[1]) / 2
+    extent = (bounds[1] - bounds[0]) / 2
+    rotation = np.asarray(matrix)[..., 0:3, 0:3]
+
+    newCenter = np.matmul(rotation, center) + np.asarray(matrix)[..., 0:3, 3]
+    newExtent = np.matmul(np.abs(rotation), extent)
+    return newCenter - newExtent, newCenter + newExtent
+
+
+def _mergeBounds(boundsList):
+    boundsList = [bounds for bounds in boundsList if bounds is not None]
+    if len(boundsList) == 0:
+        return None
+
+    minimums = np.reshape([bounds[0] for bounds in boundsList], (-1, 3))
+    maximums = np.reshape([bounds[1] for bounds in boundsList], (-1, 3))
+    return np.min(minimums, axis=0), np.max(maximums, axis=0)
+
+
+def _shapeBounds(gpuShape):
+    if gpuShape.bounds is None:
+        return _UNBOUNDED
+    return gpuShape.bounds
+
+
+def _updateBounds(node, boundsPass):
+    # Bounds of the subtree in the frame where the childs of node are drawn.
+    # Each node is checked once per pass, even if it is shared,
+    # and its bounds are merged again only if a child changed.
+    if node._boundsPass == boundsPass:
+        return
+    node._boundsPass = boundsPass
+
+    if isinstance(node, InstancedNode):
+        node._bounds = _mergeBounds([_transformBounds(node.instances.models, _shapeBounds(node.gpuShape))])
+        node._boundsStamp = next(_stamps)
+        return
+
+    # Every level has about the same bounds as the finest one
+    if isinstance(node, LODNode):
+        if node._bounds is not _shapeBounds(node.levels[0]):
+            node._bounds = _shapeBounds(node.levels[0])
+            node._boundsStamp = next(_stamps)
+        return
+
+    key = []
+    for child in node.childs:
+        if isinstance(child, gs.GPUShape):
+            key += [id(child), id(child.bounds)]
+        else:
+            _updateBounds(child, boundsPass)
+            key += [id(child), child._version, child._boundsStamp]
+
+    key = tuple(key)
+    if key == node._boundsKey:
+        return
+
+    childBounds = []
+    for child in node.childs:
+        if isinstance(child, gs.GPUShape):
+            childBounds += [_shapeBounds(child)]
+        else:
+            childBounds += [_transformBounds(child.transform, child._bounds)]
+
+    node._bounds = _mergeBounds(childBounds)
+    node._boundsKey = key
+    node._boundsStamp = next(_stamps)
+
+
+def _projectedSize(bounds, clipMatrix):
+    # Diameter of the bounding sphere on the screen, as a fraction of the screen height
+    if bounds is None:
+        return 0.0
+    if not np.all(np.isfinite(bounds[0])) or not np.all(np.isfinite(bounds[1])):
+        return np.inf
+
+    center = (bounds[0] + bounds[1]) / 2
+    radius = np.linalg.norm(bounds[1] - bounds[0]) / 2
+    w = np.dot(clipMatrix[3, 0:3], center) + clipMatrix[3, 3]
+
+    # The camera is inside the sphere, or the sphere is behind it
+    if w <= 0:
+        return np.inf
+
+    # Largest change of the clip y coordinate per unit of length of the frame of the bounds
+    scale = np.linalg.norm(clipMatrix[1, 0:3])
+    return float(radius * scale / w)
+
+
+def _isOutside(bounds, clipMatrix):
+    # Empty subtrees are never drawn, unbounded ones are always drawn
+    if bounds is None:
+        return True
+    if not np.all(np.isfinite(bounds[0])) or not np.all(np.isfinite(bounds[1])):
+        return False
+
+    # Planes of the view frustum, in the frame of the bounds (Gribb and Hartmann)
+    m = clipMatrix
+    planes = np.array([m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3] + m[2], m[3] - m[2]])
+
+    # The box is outside if it is completely behind any of the planes
+    center = (bounds[0] + bounds[1]) / 2
+    extent = (bounds[1] - bounds[0]) / 2
+    distances = np.matmul(planes[:, 0:3], center) + planes[:, 3]
+    radius = np.matmul(np.abs(planes[:, 0:3]), extent)
+    return bool(np.any(distances + radius < 0))
+
+
+def _indexNode(node, path, index):
+
+    # GPUShapes are not indexed
+    if isinstance(node, gs.GPUShape):
+        return
+
+    # As in a depth first search, the first node found with a name is kept
+    path += [node]
+    if node.name not in index:
+        index[node.name] = tuple(path)
+
+    for child in node.childs:
+        _indexNode(child, path, index)
+
+    path.pop()
+
+
+def _findPath(node, name):
+    # Path from node to the first node named name, or None.
+    # The index of names is only built again if the structure changed.
+    if node._nameIndexStamp != _structureStamp:
+        node._nameIndex = {}
+        _indexNode(node, [], node._nameIndex)
+        node._nameIndexStamp = _structureStamp
+
+    return node._nameIndex.get(name)
+
+
+def _findWorldTransform(node, name, parentTransform):
+    path = _findPath(node, name)
+    if path is None:
+        return None
+
+    # Only the transforms that changed along this path are composed again
+    world = _rootTransform(node, parentTransform)
+    for pathNode in path:
+        world = _updateWorldTransform(pathNode, world)
+
+    return world.matrix
+
+
+def _uniformLocation(pipeline, name):
+    # Pipelines based on es.ShaderProgram already know the locations of their uniforms
+    if isinstance(pipeline, es.ShaderProgram):
+        return pipeline.getUniformLocation(name)
+
+    return glGetUniformLocation(pipeline.shaderProgram, name)
+
+
+def _normalMatrixLocation(pipeline):
+    # Only pipelines based on es.ShaderProgram declare a normalMatrix uniform
+    if isinstance(pipeline, es.ShaderProgram):
+        return pipeline.getUniformLocation("normalMatrix")
+
+    return -1
+
+
+def _uploadNormalMatrix(pipeline, world):
+    # The normal matrix is computed again only when the world transform changes.
+    # It returns the number of uniforms uploaded
+    location = _normalMatrixLocation(pipeline)
+    if location == -1:
+        return 0
+
+    if world.normalStamp != world.stamp:
+        world.normal = tr.normalMatrix(world.matrix)
+        world.normalStamp = world.stamp
+
+    es.uploadMatrix3(location, world.normal)
+    return 1
+
 
-            
 
-    
 def findNode(node, name):
 
     # The name was not found in this path
     if isinstance(node, gs.GPUShape):
         return None
 
-    # This is the requested node
-    if node.name == name:
-        return node
-    
-    # All childs are checked for the requested name
-    for child in node.childs:
-        foundNode = findNode(child, name)
-        if foundNode != None:
-            return foundNode
+    if _profiler is not None:
+        _profiler.beginNode(name, "findNode")
+        path = _findPath(node, name)
+        _profiler.endNode()
+    else:
+        path = _findPath(node, name)
+    if path is None:
+        return None
 
-    # No child of this node had the requested name
-    return None
+    return path[-1]
 
 
 def findTransform(node, name, parentTransform=tr.identity()):
@@ -58,49 +524,395 @@ def findTransform(node, name, parentTransform=tr.identity()):
     if isinstance(node, gs.GPUShape):
         return None
 
-    newTransform = np.matmul(parentTransform, node.transform)
-
-    # This is the requested node
-    if node.name == name:
-        return newTransform
-    
-    # All childs are checked for the requested name
-    for child in node.childs:
-        foundTransform = findTransform(child, name, newTransform)
-        if isinstance(foundTransform, (np.ndarray, np.generic) ):
-            return foundTransform
+    foundTransform = _findWorldTransform(node, name, parentTransform)
+    if foundTransform is None:
+        return None
 
-    # No child of this node had the requested name
-    return None
+    # A copy is returned, so the cached transform can not be modified
+    return np.array(foundTransform)
 
 
 def findPosition(node, name, parentTransform=tr.identity()):
     foundTransform = findTransform(node, name, parentTransform)
 
     if isinstance(foundTransform, (np.ndarray, np.generic) ):
-        zero = np.array([[0,0,0,1]], dtype=np.float32).T
-        foundPosition = np.matmul(foundTransform, zero)
+        # Transforming the origin is the same as taking the translation column
+        foundPosition = foundTransform[:, 3:4]
         return foundPosition
 
     return None
 
 
-def drawSceneGraphNode(node, pipeline, transformName, parentTransform=tr.identity()):
+def findPositions(node, names, parentTransform=tr.identity()):
+    """
+    Positions of several nodes as an array of shape (len(names), 4, 1).
+    Positions of names that are not found are filled with NaN.
+    Each name is still found and composed one by one, through the cached
+    world transforms, so transforms shared by several paths are computed once.
+    Only the origins are taken from all the transforms at once.
+    """
+    transforms = np.full((len(names), 4, 4), np.nan, dtype=np.float32)
+
+    for i in range(len(names)):
+        foundTransform = _findWorldTransform(node, names[i], parentTransform)
+        if foundTransform is not None:
+            transforms[i] = foundTransform
+
+    # All origins are transformed at once
+    return transforms[:, :, 3:4].copy()
+
+
+def drawSceneGraphNode(node, pipeline, transformName, parentTransform=tr.identity(), viewProjection=None):
+    """
+    If viewProjection (projection times view) is given, subtrees outside the
+    view frustum are not drawn, and cullingCounters are updated.
+    """
     assert(isinstance(node, SceneGraphNode))
 
-    # Composing the transformations through this path
-    newTransform = np.matmul(parentTransform, node.transform)
+    if viewProjection is not None:
+        _updateBounds(node, next(_stamps))
+        viewProjection = np.asarray(viewProjection, dtype=np.float32)
+
+    _drawSceneGraphNode(node, pipeline, transformName, _rootTransform(node, parentTransform), viewProjection)
+
+
+def _drawSceneGraphNode(node, pipeline, transformName, parent, viewProjection=None):
+
+    if _profiler is not None:
+        _profiler.beginNode(node.name)
+        _drawNode(node, pipeline, transformName, parent, viewProjection)
+        _profiler.endNode()
+    else:
+        _drawNode(node, pipeline, transformName, parent, viewProjection)
+
+
+def _drawNode(node, pipeline, transformName, parent, viewProjection):
+
+    # Composing the transformations through this path, only if something changed
+    world = _updateWorldTransform(node, parent)
+
+    # The whole subtree is skipped if it is outside the view frustum
+    if viewProjection is not None:
+        clipMatrix = np.matmul(viewProjection, world.matrix)
+        if _isOutside(node._bounds, clipMatrix):
+            cullingCounters.culled += 1
+            return
+
+    # All the copies of an instanced node are drawn at once
+    if isinstance(node, InstancedNode):
+        es.uploadMatrix4(_uniformLocation(pipeline, transformName), world.matrix)
+        normalUploads = _uploadNormalMatrix(pipeline, world)
+        pipeline.drawCall(node.gpuShape, node.instances.count)
+        cullingCounters.drawn += 1
+
+        if _profiler is not None:
+            _profiler.countDraw(node.instances.count * node.gpuShape.size // 3, 1 + normalUploads)
 
     # If the child node is a leaf, it should be a GPUShape.
     # Hence, it can be drawn with drawCall
-    if len(node.childs) == 1 and isinstance(node.childs[0], gs.GPUShape):
-        leaf = node.childs[0]
-        glUniformMatrix4fv(glGetUniformLocation(pipeline.shaderProgram, transformName), 1, GL_TRUE, newTransform)
+    elif isinstance(node, LODNode) or (len(node.childs) == 1 and isinstance(node.childs[0], gs.GPUShape)):
+        if not isinstance(node, LODNode):
+            leaf = node.childs[0]
+        elif viewProjection is not None:
+            leaf = node.selectLevel(world, clipMatrix)
+        else:
+            leaf = node.levels[0]
+
+        es.uploadMatrix4(_uniformLocation(pipeline, transformName), world.matrix)
+        normalUploads = _uploadNormalMatrix(pipeline, world)
         pipeline.drawCall(leaf)
+        cullingCounters.drawn += 1
+
+        if _profiler is not None:
+            _profiler.countDraw(leaf.size // 3, 1 + normalUploads)
 
     # If the child node is not a leaf, it MUST be a SceneGraphNode,
     # so this draw function is called recursively
     else:
         for child in node.childs:
-            drawSceneGraphNode(child, pipeline, transformName, newTransform)
+            _drawSceneGraphNode(child, pipeline, transformName, world, viewProjection)
+
+
+
+class DrawList:
+    """
+    One or more scene graphs compiled into a flat list of draws.
+    Each draw keeps its world transform, pipeline, GPUShape and texture.
+    Instanced nodes are a single draw, with all their copies.
+    Draws are sorted by shader program, texture and VAO, so only the
+    state that differs between consecutive draws is changed.
+    The list is compiled again only when the structure of the scene graphs changes,
+    i.e. when the childs of any node are modified.
+    """
+
+    def __init__(self, roots=[], transformName="model"):
+        self.transformName = transformName
+        self.roots = []
+        self._rootParents = []
+        self._structureStamp = -1
+        self._transforms = []
+        self._draws = []
+        self._normalWorlds = []
+
+        for node, pipeline in roots:
+            self.add(node, pipeline)
+
+    def add(self, node, pipeline, parentTransform=tr.identity()):
+        """Adds a scene graph to be drawn with the given pipeline. It returns itself"""
+        assert(isinstance(node, SceneGraphNode))
+
+        self.roots += [(node, pipeline, parentTransform)]
+
+        # Each root gets its own parent, so the cached transforms do not depend on
+        # other calls drawing the same node. It is kept between compilations,
+        # as the caches of the nodes and the levels of LODNodes are found by it.
+        parent = _WorldTransform()
+        _setParentTransform(parent, parentTransform)
+        self._rootParents += [parent]
+
+        self._structureStamp = -1
+        return self
+
+    def __len__(self):
+        if self._structureStamp != _structureStamp:
+            self._compile()
+        return len(self._draws)
+
+    def _compile(self):
+        self._transforms = []
+        self._draws = []
+        locations = {}
+
+        for (node, pipeline, parentTransform), parent in zip(self.roots, self._rootParents):
+            self._compileNode(node, pipeline, parent, locations)
+
+        # Sorting by program, then texture, then VAO
+        self._draws.sort(key=lambda draw: (draw[0], draw[1] or 0, draw[2]))
+        self._normalWorlds = [draw[6] for draw in self._draws if draw[8] != -1]
+        self._structureStamp = _structureStamp
+
+    def _compileNode(self, node, pipeline, parent, locations):
+        world = _updateWorldTransform(node, parent)
+        self._transforms += [(node, parent, world)]
+
+        if isinstance(node, InstancedNode):
+            leaf = node.gpuShape
+            instances = node.instances
+        elif isinstance(node, LODNode):
+            # The level is chosen on each draw, draws are sorted by the finest one
+            leaf = node.levels[0]
+            instances = None
+        elif len(node.childs) == 1 and isinstance(node.childs[0], gs.GPUShape):
+            leaf = node.childs[0]
+            instances = None
+        else:
+            leaf = None
+
+        if leaf is not None:
+            program = pipeline.shaderProgram
+
+            if program not in locations:
+                locations[program] = (_uniformLocation(pipeline, self.transformName), _normalMatrixLocation(pipeline))
+
+            location, normalLocation = locations[program]
+            self._draws += [(program, leaf.texture, leaf.vao, leaf, instances, node, world, location, normalLocation)]
+
+        else:
+            for child in node.childs:
+                self._compileNode(child, pipeline, world, locations)
+
+    def draw(self, mode=GL_TRIANGLES, viewProjection=None):
+        """
+        Draws every compiled GPUShape. Uniforms other than the transform must be already set.
+        If viewProjection is given, shapes outside the view frustum are not drawn.
+        """
+
+        if self._structureStamp != _structureStamp:
+            self._compile()
+
+        if viewProjection is not None:
+            boundsPass = next(_stamps)
+            for node, pipeline, parentTransform in self.roots:
+                _updateBounds(node, boundsPass)
+            viewProjection = np.asarray(viewProjection, dtype=np.float32)
+
+        # Parents are always listed before their childs
+        for node, parent, world in self._transforms:
+            _refreshWorldTransform(node, parent, world)
+
+        # Normal matrices of every draw using them, with a single batched call
+        if len(self._normalWorlds) > 0:
+            normals = tr.normalMatrix(np.array([world.matrix for world in self._normalWorlds]))
+        normalIndex = 0
+
+        currentProgram = None
+        currentTexture = None
+        currentVao = None
+
+        for program, texture, vao, gpuShape, instances, node, world, location, normalLocation in self._draws:
+            if normalLocation != -1:
+                normal = normals[normalIndex]
+                normalIndex += 1
+
+            if viewProjection is not None:
+                clipMatrix = np.matmul(viewProjection, world.matrix)
+                if _isOutside(node._bounds, clipMatrix):
+                    cullingCounters.culled += 1
+                    continue
+
+                if isinstance(node, LODNode):
+                    gpuShape = node.selectLevel(world, clipMatrix)
+                    texture = gpuShape.texture
+                    vao = gpuShape.vao
+
+            if program != currentProgram:
+                glUseProgram(program)
+                currentProgram = program
+
+            if texture is not None and texture != currentTexture:
+                glBindTexture(GL_TEXTURE_2D, texture)
+                currentTexture = texture
+
+            if vao != currentVao:
+                glBindVertexArray(vao)
+                currentVao = vao
+
+            es.uploadMatrix4(location, world.matrix)
+            if normalLocation != -1:
+                es.uploadMatrix3(normalLocation, normal)
+
+            if instances is None:
+                glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
+            else:
+                glDrawElementsInstancedBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, instances.count, gpuShape.baseVertex)
+            cullingCounters.drawn += 1
+
+        # Unbind the current VAO
+        glBindVertexArray(0)
+
+
+def _collectShapes(node, transform, groups):
+    # GPUShapes of the subtree grouped by texture, with their transform below the root
+    for child in node.childs:
+        if isinstance(child, gs.GPUShape):
+            groups.setdefault(child.texture, []).append((child, transform))
+
+        elif isinstance(child, LODNode):
+            # The finest level is baked
+            groups.setdefault(child.levels[0].texture, []).append((child.levels[0], np.matmul(transform, child.transform)))
+
+        elif isinstance(child, InstancedNode):
+            childTransform = np.matmul(transform, child.transform)
+            for model in child.instances.models:
+                groups.setdefault(child.gpuShape.texture, []).append((child.gpuShape, np.matmul(childTransform, model)))
+
+        else:
+            _collectShapes(child, np.matmul(transform, child.transform), groups)
+
+
+def _bakeShapes(shapes, pipeline, normalOffset, stride, usage):
+    vertexList = []
+    indexList = []
+    vertexCount = 0
+
+    for gpuShape, transform in shapes:
+        vertexData, indices = gpuShape.readBuffers()
+        shapeStride = gpuShape.stride if stride is None else stride
+        assert shapeStride is not None and shapeStride >= 3, "The stride of the vertices must be given"
+
+        vertices = np.reshape(vertexData[0:len(vertexData) // shapeStride * shapeStride], (-1, shapeStride)).copy()
+        matrix = np.asarray(transform, dtype=np.float32)
+
+        # Every vertex of the shape is transformed at once
+        vertices[:, 0:3] = np.matmul(vertices[:, 0:3], matrix[0:3, 0:3].T) + matrix[0:3, 3]
+
+        if normalOffset is not None:
+            # Normals are transformed by the inverse transpose, as the lighting shaders do
+            normalMatrix = np.linalg.inv(matrix[0:3, 0:3]).T
+            normals = np.matmul(vertices[:, normalOffset:normalOffset + 3], normalMatrix.T)
+            lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+            lengths[lengths == 0] = 1
+            vertices[:, normalOffset:normalOffset + 3] = normals / lengths
+
+        vertexList += [vertices]
+        indexList += [indices + vertexCount]
+        vertexCount += len(vertices)
+
+    vertexStrides = set(vertices.shape[1] for vertices in vertexList)
+    assert len(vertexStrides) == 1, "Merged GPUShapes must have the same vertex format"
+
+    gpuShape = gs.GPUShape().initBuffers()
+    pipeline.setupVAO(gpuShape)
+    gpuShape.fillBuffers(np.concatenate(vertexList).ravel(), np.concatenate(indexList), usage, vertexStrides.pop())
+    return gpuShape
+
+
+def bakeSceneGraphNode(node, pipeline, normalOffset=None, stride=None, usage=GL_STATIC_DRAW):
+    """
+    Merges a static subtree into one GPUShape per texture.
+    Vertices are read back from GPU memory and transformed on the CPU: positions
+    are the first 3 floats of each vertex, normals start at normalOffset (if given).
+    If the stride (floats per vertex) is not given, it is the stride each GPUShape was filled with.
+    The returned node has the same name and transform as node, so it can replace it.
+    Textures are shared with the original GPUShapes, retaining a reference to each one.
+    """
+    assert(isinstance(node, SceneGraphNode))
+
+    groups = {}
+    _collectShapes(node, tr.identity(), groups)
+
+    bakedShapes = []
+    for texture, shapes in groups.items():
+        gpuShape = _bakeShapes(shapes, pipeline, normalOffset, stride, usage)
+        gpuShape.texture = texture
+        if texture is not None:
+            gr.registry.retain(gr.TEXTURE, texture)
+        bakedShapes += [gpuShape]
+
+    bakedNode = SceneGraphNode(node.name)
+    bakedNode.transform = node.transform
+
+    if len(bakedShapes) == 1:
+        bakedNode.childs = bakedShapes
+    else:
+        for i in range(len(bakedShapes)):
+            textureNode = SceneGraphNode(node.name + " " + str(i))
+            textureNode.childs = [bakedShapes[i]]
+            bakedNode.childs += [textureNode]
+
+    return bakedNode
+
+
+def memoryReport(*nodes):
+    """
+    Text table with the GPU memory of the GPUShapes below the given nodes,
+    named after the node drawing them. Shared GPUShapes are listed once.
+    """
+    namedShapes = []
+    visited = set()
+
+    def add(name, gpuShape):
+        if id(gpuShape) not in visited:
+            visited.add(id(gpuShape))
+            namedShapes.append((name, gpuShape))
+
+    def collect(node):
+        if isinstance(node, InstancedNode):
+            add(node.name, node.gpuShape.source)
+            return
+
+        if isinstance(node, LODNode):
+            for i in range(len(node.levels)):
+                add(node.name + " " + str(i), node.levels[i])
+            return
+
+        for child in node.childs:
+            if isinstance(child, gs.GPUShape):
+                add(node.name, child)
+            else:
+                collect(child)
+
+    for node in nodes:
+        collect(node)
 
+    return gs.memoryReport(namedShapes)
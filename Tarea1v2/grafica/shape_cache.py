@@ -0,0 +1,137 @@
+# coding=utf-8
+"""
+Cache of GPUShapes and textures already on GPU memory.
+
+Shapes are found by the generator and parameters that built them, or by
+a hash of their vertices and indices, for each pipeline. A shape found in
+the cache is the same GPUShape, with one more reference: every caller
+must clear it, and the cache releases its own reference in clear().
+"""
+
+import hashlib
+import numpy as np
+import grafica.gpu_registry as gr
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+
+def contentKey(shape):
+    """Hash of the vertices and indices of a bs.Shape"""
+    vertices = np.ascontiguousarray(shape.vertices, dtype=np.float32)
+    indices = np.ascontiguousarray(shape.indices, dtype=np.uint32)
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.int64(vertices.size).tobytes())
+    digest.update(vertices.tobytes())
+    digest.update(indices.tobytes())
+    return digest.hexdigest()
+
+
+def generatorKey(generator, *args):
+    """Name and parameters of the function that builds a shape"""
+    return (generator.__module__ + "." + generator.__qualname__,) + args
+
+
+class ShapeCache:
+    """
+    GPUShapes by key, with the uploads they saved.
+    Keys include the pipeline and its vertex format, as the same vertices
+    have another layout on GPU memory for another pipeline.
+    """
+
+    def __init__(self):
+        self.shapes = {}
+        self.textures = {}
+        self.uploads = 0
+        self.hits = 0
+        self.savedBytes = 0
+        self.textureUploads = 0
+        self.textureHits = 0
+        self.savedTextureBytes = 0
+
+    def _shapeKey(self, pipeline, key, texture):
+        return (pipeline, pipeline.vertexFormat, key, texture)
+
+    def _find(self, key):
+        gpuShape = self.shapes.get(key)
+        if gpuShape is None:
+            return None
+
+        self.hits += 1
+        self.savedBytes += gpuShape.bytes
+        return gpuShape.retain()
+
+    def _add(self, key, gpuShape):
+        # The cache is one more owner of the shape
+        self.shapes[key] = gpuShape.retain()
+        return gpuShape
+
+    def getShape(self, pipeline, shape, upload, texture=None):
+        """
+        The GPUShape with the vertices and indices of shape, for the pipeline.
+        If it is not cached, upload() must create it.
+        texture is any key of the texture of the shape, e.g. its file name and parameters.
+        """
+        key = self._shapeKey(pipeline, contentKey(shape), texture)
+        gpuShape = self._find(key)
+        if gpuShape is not None:
+            return gpuShape
+
+        self.uploads += 1
+        return self._add(key, upload())
+
+    def generate(self, pipeline, upload, generator, *args, texture=None):
+        """
+        The GPUShape of generator(*args), for the pipeline.
+        The shape is only built if the same generator and parameters were not used before,
+        and it is only uploaded, with upload(shape), if no cached shape has the same content.
+        """
+        key = self._shapeKey(pipeline, generatorKey(generator, *args), texture)
+        gpuShape = self._find(key)
+        if gpuShape is not None:
+            return gpuShape
+
+        shape = generator(*args)
+        gpuShape = self.getShape(pipeline, shape, lambda: upload(shape), texture)
+        return self._add(key, gpuShape)
+
+    def getTexture(self, key, load):
+        """
+        The texture found by key, e.g. its file name and parameters.
+        If it is not cached, load() must create it.
+        The caller owns one reference, released with gr.deleteTexture, as GPUShape.clear does.
+        """
+        texture = self.textures.get(key)
+        if texture is not None:
+            self.textureHits += 1
+            self.savedTextureBytes += gr.registry.bytesOf(gr.TEXTURE, texture)
+            gr.registry.retain(gr.TEXTURE, texture)
+            return texture
+
+        self.textureUploads += 1
+        texture = load()
+        self.textures[key] = texture
+        gr.registry.retain(gr.TEXTURE, texture)
+        return texture
+
+    def __str__(self):
+        megabytes = (self.savedBytes + self.savedTextureBytes) / (1024 * 1024)
+        return f"Shape cache: {self.uploads} uploads, {self.hits} saved; " +\
+            f"{self.textureUploads} textures, {self.textureHits} saved; {megabytes:.2f} MB saved"
+
+    def clear(self):
+        """Releases the references of the cache, shapes are freed when their other owners clear them"""
+
+        # A shape may be cached by generator and by content
+        for gpuShape in self.shapes.values():
+            gpuShape.clear()
+        self.shapes = {}
+
+        for texture in self.textures.values():
+            gr.deleteTexture(texture)
+        self.textures = {}
+
+
+# Shapes shared by every scene of the application
+cache = ShapeCache()
@@ -10,6 +10,7 @@ import numpy as np
 import grafica.basic_shapes as bs
 import grafica.easy_shaders as es
 import grafica.font8x8_basic as f88
+import grafica.gpu_registry as gr
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
@@ -47,7 +48,7 @@ def toOpenGLTexture(textBitsTexture):
     data = np.copy(textBitsTexture)
     data.reshape((8*8*128,1), order='C')
 
-    texture = glGenTextures(1)
+    texture = gr.genTexture("text")
     glBindTexture(GL_TEXTURE_3D, texture)
 
     # texture wrapping params
@@ -60,6 +61,7 @@ def toOpenGLTexture(textBitsTexture):
     glTexParameteri(GL_TEXTURE_3D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
 
     glTexImage3D(GL_TEXTURE_3D, 0, GL_RED, 128, 8, 8, 0, GL_RED, GL_UNSIGNED_BYTE, data)
+    gr.registry.resize(gr.TEXTURE, texture, data.nbytes)
 
     return texture
 
@@ -86,21 +88,22 @@ def getCharacterShape(char):
         2,3,0
     ]
 
-    return bs.Shape(vertices, indices)
+    return bs.Shape(vertices, indices, stride=6)
 
 
 def textToShape(text, charWidth, charHeight):
 
-    shape = bs.Shape([],[])
+    charShapes = []
 
     for i in range(len(text)):
         char = text[i]
         charShape = getCharacterShape(char)
         bs.applyOffset(charShape, 6, [i, 0, 0])
         bs.scaleVertices(charShape, 6, [charWidth, charHeight, 1])
-        bs.merge(shape, 6, charShape)
+        charShapes += [charShape]
 
-    return shape
+    # Every character is merged at once
+    return bs.mergeShapes(charShapes, 6)
 
 
 
@@ -181,7 +184,7 @@ class TextureTextRendererShaderProgram:
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_3D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
         
         # Unbind the current VAO
         glBindVertexArray(0)
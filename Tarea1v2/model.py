@@ -16,6 +16,7 @@ class Player():
         self.radio = 0.1 # distancia para realiozar los calculos de colision
         self.infected = 0.0 # atributo de infeccion
         self.zombie = 0 # atributo de estado
+        self.transform = tr.identity() # Matriz del nodo, se reescribe en cada update
 
     def set_model(self, new_model):
         # Se obtiene una referencia a uno nodo
@@ -42,7 +43,7 @@ class Player():
         if self.controller.is_s_pressed and self.pos[1] > -0.85 and self.zombie==0:
             self.pos[1] -= self.vel[1] * delta
         # Se le aplica la transformacion de traslado segun la posicion actual
-        self.model.transform = tr.matmul([tr.translate(self.pos[0], self.pos[1], 0), tr.scale(direction * self.size, self.size*2, 1)])
+        self.model.transform = tr.trs((self.pos[0], self.pos[1], 0), (0, 0, 0), (direction * self.size, self.size*2, 1), out=self.transform)
 
     def collision(self, cargas):
         # Funcion para detectar las colisiones con las cargas
@@ -81,6 +82,7 @@ class Humanoid():
         self.point4 = [rd.uniform(-0.55, 0.55), -1.1]
         self.t = 0.0
         self.name = aName
+        self.transform = tr.identity()
     
     def set_model(self, new_model):
         self.model = new_model
@@ -91,7 +93,7 @@ class Humanoid():
         if self.t < 1.1:
             self.pos[0] = ((1-(self.t))**3)*self.point1[0] + (self.t)*((1-(self.t))**2)*self.point2[0] + ((self.t)**2)*(1-(self.t))*self.point3[0] + ((self.t)**3)*self.point4[0]
             self.pos[1] = ((1-(self.t))**3)*self.point1[1] + (self.t)*((1-(self.t))**2)*self.point2[1] + ((self.t)**2)*(1-(self.t))*self.point3[1] + ((self.t)**3)*self.point4[1]
-            self.model.transform = tr.matmul([tr.translate(self.pos[0], self.pos[1], 0), tr.scale(self.size, self.size, 1)])
+            self.model.transform = tr.trs((self.pos[0], self.pos[1], 0), (0, 0, 0), (self.size, self.size, 1), out=self.transform)
 
     def collision(self, cargas):
         for carga in cargas:
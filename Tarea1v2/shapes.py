@@ -54,7 +54,7 @@ def createCrossShape():
         1,2,5,
         5,6,1
     ]
-    return bs.Shape(vertices,indices)
+    return bs.Shape(vertices,indices, stride=6)
 
 def createPowerUp():
     vertices = [
@@ -73,7 +73,7 @@ def createPowerUp():
         2,3,4
     ]
 
-    return bs.Shape(vertices, indices)
+    return bs.Shape(vertices, indices, stride=6)
 
 
 def createTextureScene(tex_pipeline):
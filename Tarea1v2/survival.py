@@ -10,6 +10,7 @@ import grafica.easy_shaders as es
 import grafica.transformations as tr
 import grafica.performance_monitor as pm
 import grafica.scene_graph as sg
+import grafica.gpu_registry as gr
 from shapes import *
 from model import *
 
@@ -93,7 +94,7 @@ class infectedPipeline:
         assert isinstance(gpuShape, GPUShape)
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
         # Unbind the current VAO
         glBindVertexArray(0)
 
@@ -168,7 +169,7 @@ class switchingColorPipeline:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
         
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -315,8 +316,9 @@ if __name__ == "__main__":
     # Shape con texturas
     gpuZombie = createTextureGPUShape(bs.createTextureQuad(1,1), green_pipeline, "sprites/zombie.png", GL_STATIC_DRAW, True)
     gpuHuman = createTextureGPUShape(bs.createTextureQuad(1,1), green_pipeline, "sprites/estudiante5.png", GL_STATIC_DRAW, True)
-    #gpuGameOver = createTextureGPUShape(bs.createTextureQuad(1,1), tex_pipeline, "sprites/game_over.png", GL_STATIC_DRAW, True)##
-    #gpuWin = createTextureGPUShape(bs.createTextureQuad(1,1), tex_pipeline, "sprites/win2.png", GL_STATIC_DRAW, True)##
+    # Se crean una sola vez, antes se creaban de nuevo en el loop sin liberar las anteriores
+    gpuGameOver = createTextureGPUShape(bs.createTextureQuad(1,1), tex_pipeline, "sprites/game_over.png", GL_STATIC_DRAW, True)
+    gpuWin = createTextureGPUShape(bs.createTextureQuad(1,1), tex_pipeline, "sprites/win2.png", GL_STATIC_DRAW, True)
 
     forest = createTextureScene(tex_pipeline) # arriba
 
@@ -344,6 +346,9 @@ if __name__ == "__main__":
     tex_scene = sg.SceneGraphNode("textureScene")
     tex_scene.childs = [forest]
 
+    # El nodo que se deforma en cada frame se busca una sola vez
+    shearing = sg.findNode(tex_scene, "shearing")
+
     tex_scene_green = sg.SceneGraphNode("green scene")
     tex_scene_green.childs = [jillNode]
 
@@ -370,6 +375,9 @@ if __name__ == "__main__":
     gameOver = False
     switch = True
 
+    # Matriz reutilizada en cada frame para la animacion de victoria
+    winTransform = tr.identity()
+
     # Application loop
     while not glfw.window_should_close(window):
         # Variables del tiempo
@@ -399,21 +407,19 @@ if __name__ == "__main__":
         # Se llama al metodo del player para detectar colisiones
         #player.collision(enemies)
         if player.objective(store) and notGameOver:
-            gpuWin = createTextureGPUShape(bs.createTextureQuad(1,1), tex_pipeline, "sprites/win2.png", GL_STATIC_DRAW, True)##
             winNode.childs= [gpuWin]##
             tex_scene.childs += [winNode]
             notGameOver = not notGameOver
             gameOver = True
 
         if player.zombie == 1 and gameOver:
-            gpuGameOver = createTextureGPUShape(bs.createTextureQuad(1,1), tex_pipeline, "sprites/game_over.png", GL_STATIC_DRAW, True)
             gameoverNode.childs = [gpuGameOver]
             player.model.childs = [gpuZombie]
             winNode.childs = []
             tex_scene.childs+= [gameoverNode]
             gameOver = not gameOver
 
-        winNode.transform = tr.matmul([tr.uniformScale(1 + 0.5*np.cos(-t1)), tr.rotationZ(-t1*0.5)])
+        winNode.transform = tr.trs((0, 0, 0), (0, 0, -t1*0.5), 1 + 0.5*np.cos(-t1), out=winTransform)
 
         # Se llama al metodo del player para actualizar su posicion
         player.update(delta, controller.direction)
@@ -422,7 +428,6 @@ if __name__ == "__main__":
         glUseProgram(pipeline.shaderProgram)
         sg.drawSceneGraphNode(worlds, pipeline, "transform")
 
-        shearing = sg.findNode(tex_scene, "shearing")
         shearing.transform = tr.shearing(0, 0.1 * np.cos(t1), 0, 0, 0, 0)
         #######################################################################
         # Se crean personajes cada T segundos
@@ -478,11 +483,10 @@ if __name__ == "__main__":
 
         # Verificamos si el jugador se convierte en zombie
         if player.zombie==1 and notGameOver:
-            gpuGameOver = createTextureGPUShape(bs.createTextureQuad(1,1), tex_pipeline, "sprites/game_over.png", GL_STATIC_DRAW, True)##
             gameoverNode.childs = [gpuGameOver]##
             player.model.childs = [gpuZombie]
             tex_scene.childs+=[gameoverNode]
-            winNode.clear()
+            winNode.childs = []
             notGameOver = False
 
         gameoverNode.transform = tr.scale(1 + 0.5*np.cos(t1), 1 + 0.2*np.sin(t1), 0)
@@ -536,10 +540,12 @@ if __name__ == "__main__":
         glfw.swap_buffers(window)
 
     # freeing GPU memory
-    supahScene.clear()
-    mainScene.clear()
-    worlds.clear()
-    tex_scene.clear()
-    tex_scene_green.clear()
-    
+    # Las figuras compartidas por varias escenas se liberan una sola vez
+    resources = sg.SceneGraphNode("resources")
+    resources.childs = [supahScene, mainScene, worlds, tex_scene, tex_scene_green, gpuJill, gpuZombie, gpuHuman, gpuWin, gpuGameOver]
+    resources.clear()
+
+    # Avisa de los objetos de OpenGL que quedaron sin liberar, o que se liberaron dos veces
+    gr.registry.checkLeaks()
+
     glfw.terminate()
\ No newline at end of file
@@ -9,6 +9,10 @@ import grafica.easy_shaders as es
 import grafica.performance_monitor as pm
 import grafica.lighting_shaders as ls
 import grafica.scene_graph as sg
+import grafica.mesh_optimizer as mo
+import grafica.array_scene_graph as asg
+import grafica.uniform_buffer as ub
+import grafica.shape_cache as sc
 from shapes3d import *
 from grafica.gpu_shape import GPUShape
 import openmesh as om
@@ -22,6 +26,9 @@ from imgui.integrations.glfw import GlfwRenderer
 LIGHT_CEL_SHADING = 0
 LIGHT_PHONG   = 1
 
+# Con DEBUG = True se imprimen al iniciar los reportes del cache y de las mallas
+DEBUG = False
+
 def readFaceVertex(faceDescription):
 
     aux = faceDescription.split('/')
@@ -92,7 +99,7 @@ def readOBJ(filename, color):
             indices += [index, index + 1, index + 2]
             index += 3        
 
-        return bs.Shape(vertexData, indices)
+        return bs.Shape(vertexData, indices, stride=9)
 
 class PolarCamera:
     def __init__(self, aCurve):
@@ -106,6 +113,8 @@ class PolarCamera:
         self.curve = aCurve
         self.pos = [0,0,0]
         self.index = 0
+        # Matrices de vista de cada punto de la curva, calculadas una sola vez
+        self.autoviews = tr.lookAtBatch(self.curve, self.center, self.up)
 
     def set_theta(self, delta):
         self.theta = (self.theta + delta) % (np.pi * 2)
@@ -140,12 +149,7 @@ class PolarCamera:
         self.eye[0] = self.pos[0]
         self.eye[1] = self.pos[1]
         self.eye[2] = self.pos[2]
-        viewMatrix = tr.lookAt(
-            self.eye,
-            self.center,
-            self.up
-        )
-        return viewMatrix
+        return self.autoviews[self.index]
 
 class Controller:
     def __init__(self, cameraCurve):
@@ -338,6 +342,10 @@ if __name__ == "__main__":
     CSphongTexPipeline = sh.CelShadingTexturePhongShaderProgram()
     CSspotlightPipeline = sh.CelShadingSpotLight()
 
+    # Camera and lights are shared by all the lighting pipelines
+    cameraBuffer = ub.CameraBuffer()
+    lightsBuffer = ub.LightsBuffer()
+
     # This shader program does not consider lighting
     mvpPipeline = es.SimpleModelViewProjectionShaderProgram()
 
@@ -507,7 +515,10 @@ if __name__ == "__main__":
     torusNode.transform = tr.matmul([tr.translate(-2.0,-1.5,-2.0),tr.scale(0.5, 0.5, 2.0)])
     torusNode.childs = [Torus]
 
-    shapeBaby = readOBJ('sprites/dababy.obj', (0.9, 0.6, 0.2))
+    # El OBJ repite los vertices de cada triangulo, se unen y se ordenan para el cache de la GPU
+    shapeBaby, report = mo.optimizeShape(readOBJ('sprites/dababy.obj', (0.9, 0.6, 0.2)))
+    if DEBUG:
+        print("dababy.obj:", report)
     gpuBaby = createGPUShape(phongPipeline, shapeBaby)
 
     dababy = sg.SceneGraphNode("baby")
@@ -517,6 +528,9 @@ if __name__ == "__main__":
     body = createBodyScene2(phongPipeline, dababy)
     body.transform = tr.translate(0,-0.4,-0.4)
 
+    # El cuerpo se guarda en arreglos, sus transformaciones se calculan por nivel
+    bodyGraph = asg.ArraySceneGraph(body)
+
     sphereMesh = createSphereMesh(64,0,0,0)
     sphereMesh_vertices, sphereMesh_indices = get_vertexs_and_indexes(sphereMesh, [0.66,0.66,0.66])
 
@@ -573,6 +587,10 @@ if __name__ == "__main__":
     testNode.transform = tr.matmul([tr.translate(0,-2.0,-0.5),tr.uniformScale(0.5)])
     testNode.childs = [gpuTest]
 
+    # Figuras repetidas que no se volvieron a subir a la GPU
+    if DEBUG:
+        print(sc.cache)
+
     perfMonitor = pm.PerformanceMonitor(glfw.get_time(), 0.5)
     # glfw will swap buffers as soon as possible
     glfw.swap_interval(0)
@@ -615,31 +633,31 @@ if __name__ == "__main__":
 
     # Busqueda de Nodods y creacion de articulaciones
 
-    leftArm = sg.findNode(body, "leftArmRot")
+    leftArm = asg.findNode(bodyGraph, "leftArmRot")
     leftArmArticulation = articulation(setOfCurvesLA)
     leftArmArticulation.set_model(leftArm)
 
-    rightArm = sg.findNode(body, "rightArmRot")
+    rightArm = asg.findNode(bodyGraph, "rightArmRot")
     rightArmArticulation = articulation(setOfCurvesRA)
     rightArmArticulation.set_model(rightArm)
 
-    leftForearm = sg.findNode(body, "leftForearmRot")
+    leftForearm = asg.findNode(bodyGraph, "leftForearmRot")
     leftForearmArticulation = articulation(setOfCurvesLFA)
     leftForearmArticulation.set_model(leftForearm)
 
-    rightForearm = sg.findNode(body, "rightForearmRot")
+    rightForearm = asg.findNode(bodyGraph, "rightForearmRot")
     rightForearmArticulation = articulation(setOfCurvesRFA)
     rightForearmArticulation.set_model(rightForearm)
     
-    rightLeg1 = sg.findNode(body, "rightLegRot")
+    rightLeg1 = asg.findNode(bodyGraph, "rightLegRot")
     rightLegArticulation = articulation(setOfCurvesRL)
     rightLegArticulation.set_model(rightLeg1)
 
-    headNode = sg.findNode(body, "headRotation")
+    headNode = asg.findNode(bodyGraph, "headRotation")
     headArticulation = articulation(setOfCurvesHR)
     headArticulation.set_model(headNode)
 
-    leftLeg1 = sg.findNode(body, "leftLegRot")
+    leftLeg1 = asg.findNode(bodyGraph, "leftLegRot")
     leftLegArticulation = articulation(setOfCurvesMixed)
     leftLegArticulation.set_model(leftLeg1)
 
@@ -687,10 +705,10 @@ if __name__ == "__main__":
         # The axis is drawn without lighting effects
         if controller.showAxis:
             glUseProgram(mvpPipeline.shaderProgram)
-            glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "projection"), 1, GL_TRUE, projection)
-            glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-            #glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
-            glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "model"), 1, GL_TRUE,
+            mvpPipeline.setMat4("projection", projection)
+            mvpPipeline.setMat4("view", viewMatrix)
+            #mvpPipeline.setMat4("model", tr.identity())
+            mvpPipeline.setMat4("model",
              tr.matmul([tr.translate(0, -2.3, 0),tr.rotationX(np.pi/2), tr.uniformScale(0.5)])) # tr.identity
             #mvpPipeline.drawCall(gpuAxis, GL_LINES)
             mvpPipeline.drawCall(gpuHanger, GL_LINES)
@@ -712,8 +730,8 @@ if __name__ == "__main__":
         if controller.spotLight == True:
             lightingPipeline = CSspotlightPipeline
             glUseProgram(lightingPipeline.shaderProgram)
-            glUniform1f(glGetUniformLocation(lightingPipeline.shaderProgram, "concentrationP"), 100.0)
-            glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "spotDirR"), 0.0, 0.0, -3.0)
+            lightingPipeline.setFloat("concentrationP", 100.0)
+            lightingPipeline.setVec3("spotDirR", 0.0, 0.0, -3.0)
 
 
         r = 1.0
@@ -740,6 +758,11 @@ if __name__ == "__main__":
             var += 1
             s=t1
 
+        # A single buffer write per block updates every lighting pipeline
+        cameraBuffer.update(projection, viewMatrix, camera.eye)
+        lightColor = (aux_r, aux_g, aux_b)
+        lightsBuffer.update(lightposition, lightColor, lightColor, lightColor, cte_at, lnr_at, qud_at)
+
         leftForearmArticulation.move()
         leftForearmArticulation.update()
         rightForearmArticulation.move()
@@ -755,114 +778,64 @@ if __name__ == "__main__":
         leftLegArticulation.move()
         leftLegArticulation.update()
 
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "La"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "Ld"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "Ls"), aux_r, aux_g, aux_b)
-
         # Object is barely visible at only ambient. Diffuse behavior is slightly red. Sparkles are white
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "Ka"), 0.2, 0.2, 0.2)
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "Kd"), 0.5, 0.5, 0.5)
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "Ks"), 0.3, 0.3, 0.3)
+        lightingPipeline.setVec3("Ka", 0.2, 0.2, 0.2)
+        lightingPipeline.setVec3("Kd", 0.5, 0.5, 0.5)
+        lightingPipeline.setVec3("Ks", 0.3, 0.3, 0.3)
 
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "lightPosition"), lightposition[0], lightposition[1], lightposition[2])
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "viewPosition"), camera.eye[0], camera.eye[1], camera.eye[2])
-        glUniform1ui(glGetUniformLocation(lightingPipeline.shaderProgram, "shininess"), int(shininess))
-        
-        glUniform1f(glGetUniformLocation(lightingPipeline.shaderProgram, "constantAttenuation"), cte_at)
-        glUniform1f(glGetUniformLocation(lightingPipeline.shaderProgram, "linearAttenuation"), lnr_at)
-        glUniform1f(glGetUniformLocation(lightingPipeline.shaderProgram, "quadraticAttenuation"), qud_at)
+        lightingPipeline.setUint("shininess", int(shininess))
 
-        glUniformMatrix4fv(glGetUniformLocation(lightingPipeline.shaderProgram, "projection"), 1, GL_TRUE, projection)
-        glUniformMatrix4fv(glGetUniformLocation(lightingPipeline.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-        glUniformMatrix4fv(glGetUniformLocation(lightingPipeline.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
+        lightingPipeline.setMat4("model", tr.identity())
 
         # Drawing
         sg.drawSceneGraphNode(scene, lightingPipeline, "model")
         ### envio otras transformadas para mas brillo metalico
-        sg.drawSceneGraphNode(body, lightingPipeline, "model")
+        asg.drawSceneGraphNode(bodyGraph, lightingPipeline, "model")
         
         
         glUseProgram(texPipeline.shaderProgram)
-        # White light in all components: ambient, diffuse and specular.
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "La"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ld"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ls"), aux_r, aux_g, aux_b)
+        texPipeline.setUint("shininess", int(shininess))
 
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "lightPosition"), lightposition[0], lightposition[1], lightposition[2])
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "viewPosition"), camera.eye[0], camera.eye[1], camera.eye[2])
-        glUniform1ui(glGetUniformLocation(texPipeline.shaderProgram, "shininess"), int(shininess))
+        texPipeline.setVec3("Ka", 0.2, 0.2, 0.2)
+        texPipeline.setVec3("Kd", 0.8, 0.8, 0.8)
+        texPipeline.setVec3("Ks", 1.0, 1.0, 1.0)
 
-        glUniform1f(glGetUniformLocation(texPipeline.shaderProgram, "constantAttenuation"), cte_at)
-        glUniform1f(glGetUniformLocation(texPipeline.shaderProgram, "linearAttenuation"), lnr_at)
-        glUniform1f(glGetUniformLocation(texPipeline.shaderProgram, "quadraticAttenuation"), qud_at)
-        
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ka"), 0.2, 0.2, 0.2)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Kd"), 0.8, 0.8, 0.8)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ks"), 1.0, 1.0, 1.0)
-
-        glUniformMatrix4fv(glGetUniformLocation(texPipeline.shaderProgram, "projection"), 1, GL_TRUE, projection)
-        glUniformMatrix4fv(glGetUniformLocation(texPipeline.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-        glUniformMatrix4fv(glGetUniformLocation(texPipeline.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
+        texPipeline.setMat4("model", tr.identity())
 
         sg.drawSceneGraphNode(toraxNode, texPipeline, "model")
         sg.drawSceneGraphNode(screenNode, texPipeline, "model")
         sg.drawSceneGraphNode(screen2Node, texPipeline, "model")
 
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ka"), 0.2, 0.2, 0.2)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Kd"), 1.0, 1.0, 1.0)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ks"), 1.0, 1.0, 1.0)
+        texPipeline.setVec3("Ka", 0.2, 0.2, 0.2)
+        texPipeline.setVec3("Kd", 1.0, 1.0, 1.0)
+        texPipeline.setVec3("Ks", 1.0, 1.0, 1.0)
 
         sg.drawSceneGraphNode(torusNode, texPipeline, "model")
 
         
         glUseProgram(CSspotlightPipeline.shaderProgram)
-        # Light in all components: ambient, diffuse and specular.
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "La"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "Ld"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "Ls"), aux_r, aux_g, aux_b)
-
         # Object is barely visible at only ambient. Diffuse behavior is slightly grey. Sparkles are white
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "Ka"), 0.1, 0.1, 0.1)
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "Kd"), 1.0, 1.0, 1.0)
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "Ks"), 0.8, 0.8, 0.8)
+        CSspotlightPipeline.setVec3("Ka", 0.1, 0.1, 0.1)
+        CSspotlightPipeline.setVec3("Kd", 1.0, 1.0, 1.0)
+        CSspotlightPipeline.setVec3("Ks", 0.8, 0.8, 0.8)
 
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "lightPosition"), lightposition[0], lightposition[1], lightposition[2])
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "viewPosition"), camera.eye[0], camera.eye[1], camera.eye[2])
-        glUniform1ui(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "shininess"), int(shininess))
+        CSspotlightPipeline.setUint("shininess", int(shininess))
         
-        glUniform1f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "constantAttenuation"), cte_at)
-        glUniform1f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "linearAttenuation"), lnr_at)
-        glUniform1f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "quadraticAttenuation"), qud_at)
-        glUniform1f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "concentrationP"), 100.0)
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "spotDirR"), 0.0, 0.0, -3.0)
-
-        glUniformMatrix4fv(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "projection"), 1, GL_TRUE, projection)
-        glUniformMatrix4fv(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-        glUniformMatrix4fv(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
+        CSspotlightPipeline.setFloat("concentrationP", 100.0)
+        CSspotlightPipeline.setVec3("spotDirR", 0.0, 0.0, -3.0)
+
+        CSspotlightPipeline.setMat4("model", tr.identity())
         #sg.drawSceneGraphNode(testNode, CSspotlightPipeline, "model")
 
         glUseProgram(pipeline1.shaderProgram)
-        # White light in all components: ambient, diffuse and specular.
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "La"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "Ld"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "Ls"), aux_r, aux_g, aux_b)
-
         # Object is barely visible at only ambient. Diffuse behavior is slightly red. Sparkles are white
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "Ka"), 0.1, 0.1, 0.1)
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "Kd"), 1.0, 1.0, 1.0)
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "Ks"), 0.9, 0.9, 0.9)
+        pipeline1.setVec3("Ka", 0.1, 0.1, 0.1)
+        pipeline1.setVec3("Kd", 1.0, 1.0, 1.0)
+        pipeline1.setVec3("Ks", 0.9, 0.9, 0.9)
 
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "lightPosition"), lightposition[0], lightposition[1], lightposition[2])
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "viewPosition"), camera.eye[0], camera.eye[1], camera.eye[2])
-        glUniform1ui(glGetUniformLocation(pipeline1.shaderProgram, "shininess"), int(shininess))
-        
-        glUniform1f(glGetUniformLocation(pipeline1.shaderProgram, "constantAttenuation"), cte_at)
-        glUniform1f(glGetUniformLocation(pipeline1.shaderProgram, "linearAttenuation"), lnr_at)
-        glUniform1f(glGetUniformLocation(pipeline1.shaderProgram, "quadraticAttenuation"), qud_at)
+        pipeline1.setUint("shininess", int(shininess))
 
-        glUniformMatrix4fv(glGetUniformLocation(pipeline1.shaderProgram, "projection"), 1, GL_TRUE, projection)
-        glUniformMatrix4fv(glGetUniformLocation(pipeline1.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-        glUniformMatrix4fv(glGetUniformLocation(pipeline1.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
+        pipeline1.setMat4("model", tr.identity())
         sg.drawSceneGraphNode(sphereNodeLoc, pipeline1,"model")
         
         # Drawing the imgui texture over our drawing
@@ -883,6 +856,10 @@ if __name__ == "__main__":
     dababy.clear()
     sphereNode.clear()
     toraxNode.clear()
-    body.clear()
+    bodyGraph.clear()
+    sc.cache.clear()
+
+    cameraBuffer.clear()
+    lightsBuffer.clear()
 
     glfw.terminate()
\ No newline at end of file
@@ -0,0 +1,319 @@
+# coding=utf-8
+"""
+A scene graph stored as arrays (structure of arrays).
+It is built from a scene graph of sg.SceneGraphNode and offers the same
+functionality: findNode, findTransform, findPosition and drawSceneGraphNode.
+"""
+
+from OpenGL.GL import *
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import grafica.transformations as tr
+import grafica.gpu_shape as gs
+import grafica.easy_shaders as es
+import grafica.scene_graph as sg
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+# Levels with fewer nodes than this are not split across threads
+MIN_NODES_PER_THREAD = 256
+
+
+class ArrayNode:
+    """
+    A node of an ArraySceneGraph, as returned by findNode.
+    Its transform is stored in the arrays of the graph.
+    If the transform is modified in place, markDirty() must be called.
+    """
+    def __init__(self, graph, name, indices):
+        self.graph = graph
+        self.name = name
+        # A node shared by several parents has one copy per path
+        self.indices = indices
+
+    @property
+    def transform(self):
+        return self.graph.localTransforms[self.indices[0]]
+
+    @transform.setter
+    def transform(self, transform):
+        self.graph.localTransforms[self.indices] = transform
+        self.graph.markDirty()
+
+    def markDirty(self):
+        self.graph.markDirty()
+
+
+class ArraySceneGraph:
+    """
+    Every node of a scene graph in contiguous arrays:
+    - localTransforms: (N,4,4) float32 transform of each node
+    - worldTransforms: (N,4,4) float32 transform from the root to each node
+    - parents: index of the parent of each node, -1 for the root
+    Nodes are ordered by depth level, so world transforms are computed
+    one level at a time with a single matrix multiplication.
+    Nodes with several parents get a copy for each path.
+    With threads > 1, large levels are split across a thread pool.
+
+    The structure is a snapshot of the graph when it is built: the graph can not
+    be used after the childs of any of its original nodes change, until rebuild()
+    is called. Transforms are changed through the ArrayNodes given by findNode.
+    """
+
+    def __init__(self, root, threads=1):
+        assert(isinstance(root, sg.SceneGraphNode))
+        self.root = root
+        self._executor = ThreadPoolExecutor(threads) if threads > 1 else None
+        self._threads = threads
+        self._build()
+
+    def rebuild(self):
+        """
+        Builds the arrays again from the current structure and transforms of the original nodes.
+        ArrayNodes found before are not valid anymore.
+        """
+        self._build()
+
+    def _build(self):
+        nodes, parents, self.levels = _breadthFirst(self.root)
+        self._structure = _structureOf(nodes)
+        self._structureStamp = sg._structureStamp
+
+        self.parents = np.array(parents, dtype=np.int32)
+        self.localTransforms = np.array([node.transform for node in nodes], dtype=np.float32)
+        self.worldTransforms = np.zeros_like(self.localTransforms)
+
+        childIndices = [[] for node in nodes]
+        for index in range(1, len(nodes)):
+            childIndices[parents[index]] += [index]
+
+        # Names are found as in a depth first search, as sg.findNode does
+        self._order = []
+        self._depthFirst(0, childIndices)
+
+        copies = {}
+        for index in range(len(nodes)):
+            copies.setdefault(id(nodes[index]), []).append(index)
+
+        self._nodes = {}
+        for index in self._order:
+            node = nodes[index]
+            if node.name not in self._nodes:
+                self._nodes[node.name] = ArrayNode(self, node.name, np.array(copies[id(node)]))
+
+        # Nodes drawing a GPUShape, in the order drawSceneGraphNode draws them.
+        # Levels of detail are chosen while drawing, leaves keep the finest one.
+        self._leaves = []
+        self._lodNodes = {}
+        for index in self._order:
+            node = nodes[index]
+            if isinstance(node, sg.InstancedNode):
+                self._leaves += [(index, node.gpuShape, node.instances)]
+            elif isinstance(node, sg.LODNode):
+                self._lodNodes[len(self._leaves)] = node
+                self._leaves += [(index, node.levels[0], None)]
+            elif len(node.childs) == 1 and isinstance(node.childs[0], gs.GPUShape):
+                self._leaves += [(index, node.childs[0], None)]
+
+        self._leafIndices = np.array([leaf[0] for leaf in self._leaves], dtype=np.int32)
+
+        self._parentTransform = None
+        self._dirty = True
+
+    def _depthFirst(self, index, childIndices):
+        self._order += [index]
+        for child in childIndices[index]:
+            self._depthFirst(child, childIndices)
+
+    def __len__(self):
+        return len(self.parents)
+
+    def markDirty(self):
+        """World transforms will be computed again before the next use"""
+        self._dirty = True
+
+    def _checkStructure(self):
+        # Only a change of the structure of any scene graph makes the snapshot to be compared
+        if self._structureStamp == sg._structureStamp:
+            return
+
+        assert _structureOf(_breadthFirst(self.root)[0]) == self._structure, \
+            "The structure of " + self.root.name + " changed after building its ArraySceneGraph, rebuild() must be called"
+        self._structureStamp = sg._structureStamp
+
+    def _updateLevel(self, start, end):
+        np.matmul(self.worldTransforms[self.parents[start:end]], self.localTransforms[start:end],
+                  out=self.worldTransforms[start:end])
+
+    def update(self, parentTransform=tr.identity()):
+        """Computes the world transforms, only if a transform changed"""
+
+        self._checkStructure()
+
+        if not self._dirty and np.array_equal(self._parentTransform, parentTransform):
+            return
+
+        self._parentTransform = np.array(parentTransform, dtype=np.float32)
+        np.matmul(self._parentTransform, self.localTransforms[0], out=self.worldTransforms[0])
+
+        for start, end in self.levels[1:]:
+            size = end - start
+            if self._executor is None or size < 2 * MIN_NODES_PER_THREAD:
+                self._updateLevel(start, end)
+                continue
+
+            # numpy releases the GIL while multiplying, so chunks run in parallel
+            chunks = min(self._threads, size // MIN_NODES_PER_THREAD)
+            bounds = np.linspace(start, end, chunks + 1, dtype=np.int32)
+            list(self._executor.map(self._updateLevel, bounds[:-1], bounds[1:]))
+
+        self._dirty = False
+
+    def clear(self):
+        """Freeing GPU memory"""
+
+        self.root.clear()
+
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+def _breadthFirst(root):
+    # Nodes in breadth first order, so each level is contiguous, with their parents and levels
+    nodes = [root]
+    parents = [-1]
+    levels = []
+    start = 0
+    while start < len(nodes):
+        end = len(nodes)
+        levels += [(start, end)]
+        for index in range(start, end):
+            for child in nodes[index].childs:
+                if isinstance(child, sg.SceneGraphNode):
+                    nodes += [child]
+                    parents += [index]
+        start = end
+
+    return nodes, parents, levels
+
+
+def _structureOf(nodes):
+    # Each node with its childs, GPUShapes included
+    return tuple((id(node), tuple(id(child) for child in node.childs)) for node in nodes)
+
+
+def _leafBounds(graph):
+    # Centers and extents of the shapes drawn by each leaf, in its own frame
+    centers = np.zeros((len(graph._leaves), 3), dtype=np.float32)
+    extents = np.full((len(graph._leaves), 3), np.inf, dtype=np.float32)
+
+    for i in range(len(graph._leaves)):
+        index, gpuShape, instances = graph._leaves[i]
+        bounds = gpuShape.bounds
+        if instances is not None:
+            bounds = sg._mergeBounds([sg._transformBounds(instances.models, sg._shapeBounds(gpuShape))])
+
+        if bounds is not None and np.all(np.isfinite(bounds[0])) and np.all(np.isfinite(bounds[1])):
+            centers[i] = (bounds[0] + bounds[1]) / 2
+            extents[i] = (bounds[1] - bounds[0]) / 2
+
+    return centers, extents
+
+
+def _visibleLeaves(graph, viewProjection):
+    # Every leaf is tested against the view frustum at once
+    clip = np.matmul(viewProjection, graph.worldTransforms[graph._leafIndices])
+    planes = np.stack([clip[:, 3] + clip[:, 0], clip[:, 3] - clip[:, 0],
+                       clip[:, 3] + clip[:, 1], clip[:, 3] - clip[:, 1],
+                       clip[:, 3] + clip[:, 2], clip[:, 3] - clip[:, 2]], axis=1)
+
+    centers, extents = _leafBounds(graph)
+    distances = np.einsum("lpk,lk->lp", planes[:, :, 0:3], centers) + planes[:, :, 3]
+    radius = np.einsum("lpk,lk->lp", np.abs(planes[:, :, 0:3]), extents)
+
+    # Unbounded shapes have an infinite radius, so they are always drawn
+    with np.errstate(invalid="ignore"):
+        outside = np.any(distances + radius < 0, axis=1)
+    return ~outside
+
+
+def findNode(graph, name):
+    graph._checkStructure()
+    return graph._nodes.get(name)
+
+
+def findTransform(graph, name, parentTransform=tr.identity()):
+    node = findNode(graph, name)
+    if node is None:
+        return None
+
+    graph.update(parentTransform)
+    return np.array(graph.worldTransforms[node.indices[0]])
+
+
+def findPosition(graph, name, parentTransform=tr.identity()):
+    foundTransform = findTransform(graph, name, parentTransform)
+
+    if isinstance(foundTransform, (np.ndarray, np.generic) ):
+        return foundTransform[:, 3:4]
+
+    return None
+
+
+def drawSceneGraphNode(graph, pipeline, transformName, parentTransform=tr.identity(), viewProjection=None):
+    """
+    Same as sg.drawSceneGraphNode, but the world transforms are computed level by level.
+    If viewProjection is given, shapes outside the view frustum are not drawn.
+    """
+    assert(isinstance(graph, ArraySceneGraph))
+
+    # The whole graph is measured as its root node
+    if sg._profiler is not None:
+        sg._profiler.beginNode(graph.root.name)
+
+    graph.update(parentTransform)
+
+    if isinstance(pipeline, es.ShaderProgram):
+        location = pipeline.getUniformLocation(transformName)
+        normalLocation = pipeline.getUniformLocation("normalMatrix")
+    else:
+        location = glGetUniformLocation(pipeline.shaderProgram, transformName)
+        normalLocation = -1
+
+    # Normal matrices of every leaf, with a single batched call
+    if normalLocation != -1:
+        normals = tr.normalMatrix(graph.worldTransforms[graph._leafIndices])
+
+    if viewProjection is None:
+        visible = np.ones(len(graph._leaves), dtype=bool)
+    else:
+        viewProjection = np.asarray(viewProjection, dtype=np.float32)
+        visible = _visibleLeaves(graph, viewProjection)
+        sg.cullingCounters.culled += int(np.count_nonzero(~visible))
+
+    for i in range(len(graph._leaves)):
+        if not visible[i]:
+            continue
+
+        index, gpuShape, instances = graph._leaves[i]
+        if i in graph._lodNodes and viewProjection is not None:
+            clipMatrix = np.matmul(viewProjection, graph.worldTransforms[index])
+            gpuShape = graph._lodNodes[i].selectLevel((graph, index), clipMatrix)
+
+        es.uploadMatrix4(location, graph.worldTransforms[index])
+        if normalLocation != -1:
+            es.uploadMatrix3(normalLocation, normals[i])
+
+        if instances is None:
+            pipeline.drawCall(gpuShape)
+        else:
+            pipeline.drawCall(gpuShape, instances.count)
+        sg.cullingCounters.drawn += 1
+
+        if sg._profiler is not None:
+            triangles = gpuShape.size // 3 if instances is None else instances.count * gpuShape.size // 3
+            sg._profiler.countDraw(triangles, 1 if normalLocation == -1 else 2)
+
+    if sg._profiler is not None:
+        sg._profiler.endNode()
@@ -0,0 +1,175 @@
+# coding=utf-8
+"""
+Registry of the OpenGL objects created by grafica: VAOs, buffers and textures.
+
+It keeps the size in bytes and the owner of each object, and counts the
+references to objects shared by several owners, so an object is deleted
+when its last reference is released. At shutdown, registry.checkLeaks()
+warns about objects never released and about objects released twice.
+"""
+
+from OpenGL.GL import *
+import collections
+import os
+import traceback
+import warnings
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+VAO = "vao"
+BUFFER = "buffer"
+TEXTURE = "texture"
+
+
+def _callSite():
+    # First frame outside grafica, where the application requested the object
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if os.path.basename(os.path.dirname(frame.filename)) != "grafica":
+            return os.path.basename(frame.filename) + ":" + str(frame.lineno)
+    return "unknown"
+
+
+class _Resource:
+    __slots__ = ["kind", "handle", "bytes", "owner", "refs"]
+
+    def __init__(self, kind, handle, owner):
+        self.kind = kind
+        self.handle = handle
+        self.bytes = 0
+        self.owner = owner
+        self.refs = 1
+
+
+class GPURegistry:
+    """
+    Live OpenGL objects, by kind and handle.
+    The memory of the last frames is kept in self.frames, see update().
+    """
+
+    def __init__(self, window=60):
+        self.resources = {}
+        self.freed = set()
+        self.doubleFrees = []
+        self.frames = collections.deque(maxlen=window)
+
+    def register(self, kind, handle, owner=None):
+        owner = "" if owner is None else owner + " "
+        self.resources[(kind, handle)] = _Resource(kind, handle, owner + "created at " + _callSite())
+
+        # OpenGL reuses the handles of deleted objects
+        self.freed.discard((kind, handle))
+
+    def resize(self, kind, handle, bytes):
+        resource = self.resources.get((kind, handle))
+        if resource is not None:
+            resource.bytes = bytes
+
+    def retain(self, kind, handle):
+        """One more owner shares the object"""
+        resource = self.resources.get((kind, handle))
+        if resource is not None:
+            resource.refs += 1
+
+    def release(self, kind, handle):
+        """
+        Drops a reference to the object.
+        It returns True when the object must be deleted: it was the last reference,
+        or the object was not created through the registry.
+        """
+        key = (kind, handle)
+        resource = self.resources.get(key)
+
+        if resource is None:
+            if key in self.freed:
+                self.reportDoubleFree(kind + " " + str(handle))
+                return False
+            return True
+
+        resource.refs -= 1
+        if resource.refs > 0:
+            return False
+
+        del self.resources[key]
+        self.freed.add(key)
+        return True
+
+    def reportDoubleFree(self, description):
+        self.doubleFrees += [description + " freed again at " + _callSite()]
+
+    def bytesOf(self, kind, handle):
+        resource = self.resources.get((kind, handle))
+        return 0 if resource is None else resource.bytes
+
+    def count(self, kind=None):
+        return sum(1 for resource in self.resources.values() if kind is None or resource.kind == kind)
+
+    def liveBytes(self, kind=None):
+        return sum(resource.bytes for resource in self.resources.values() if kind is None or resource.kind == kind)
+
+    def update(self):
+        """
+        It must be called once per frame, it records the live objects and bytes
+        """
+        self.frames.append((self.count(), self.liveBytes()))
+
+    def __str__(self):
+        megabytes = self.liveBytes() / (1024 * 1024)
+        return f"GPU: {self.count(VAO)} vaos, {self.count(BUFFER)} buffers, {self.count(TEXTURE)} textures, {megabytes:.2f} MB"
+
+    def table(self):
+        """Text table of the live objects, the largest first"""
+        lines = [f"{'kind':<8} {'handle':>8} {'bytes':>10} {'refs':>5}  owner"]
+        for resource in sorted(self.resources.values(), key=lambda resource: resource.bytes, reverse=True):
+            lines += [f"{resource.kind:<8} {resource.handle:>8} {resource.bytes:>10} {resource.refs:>5}  {resource.owner}"]
+        return "\n".join(lines)
+
+    def checkLeaks(self):
+        """
+        It must be called at shutdown, after freeing every object.
+        It warns about objects still alive and objects freed twice, returning how many there are.
+        """
+        for resource in self.resources.values():
+            warnings.warn(f"Leaked {resource.kind} {resource.handle} ({resource.bytes} bytes, {resource.refs} references), {resource.owner}", stacklevel=2)
+
+        for description in self.doubleFrees:
+            warnings.warn("Double free: " + description, stacklevel=2)
+
+        return len(self.resources) + len(self.doubleFrees)
+
+
+# Every object created by grafica is registered here
+registry = GPURegistry()
+
+
+def genVertexArray(owner=None):
+    vao = glGenVertexArrays(1)
+    registry.register(VAO, vao, owner)
+    return vao
+
+
+def genBuffer(owner=None):
+    buffer = glGenBuffers(1)
+    registry.register(BUFFER, buffer, owner)
+    return buffer
+
+
+def genTexture(owner=None):
+    texture = glGenTextures(1)
+    registry.register(TEXTURE, texture, owner)
+    return texture
+
+
+def deleteVertexArray(vao):
+    if registry.release(VAO, vao):
+        glDeleteVertexArrays(1, [vao])
+
+
+def deleteBuffer(buffer):
+    if registry.release(BUFFER, buffer):
+        glDeleteBuffers(1, [buffer])
+
+
+def deleteTexture(texture):
+    if registry.release(TEXTURE, texture):
+        glDeleteTextures(1, [texture])
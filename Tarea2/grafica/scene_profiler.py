@@ -0,0 +1,107 @@
+# coding=utf-8
+"""Simple class to profile the traversals of a scene graph, node by node"""
+
+import collections
+import json
+import time
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+
+class SceneProfiler:
+    """
+    Measures each named node visited by sg.drawSceneGraphNode and sg.findNode:
+    time spent in its subtree and in the node itself, draw calls,
+    triangles and uniform uploads of its subtree.
+    Metrics are averaged per frame over the last window frames.
+    It is enabled with sg.setProfiler(profiler)
+    """
+
+    def __init__(self, window=60):
+        self.window = window
+        self.frames = collections.deque(maxlen=window)
+        self._current = {}
+        self._stack = []
+
+    def beginNode(self, name, kind="draw"):
+        # kind, name, start time, time spent in childs, draw calls, triangles, uniform uploads
+        self._stack.append([kind, name, time.perf_counter(), 0.0, 0, 0, 0])
+
+    def countDraw(self, triangles, uniformUploads=1):
+        entry = self._stack[-1]
+        entry[4] += 1
+        entry[5] += triangles
+        entry[6] += uniformUploads
+
+    def endNode(self):
+        kind, name, start, childSeconds, drawCalls, triangles, uniformUploads = self._stack.pop()
+        seconds = time.perf_counter() - start
+
+        # visits, seconds, self seconds, draw calls, triangles, uniform uploads
+        metrics = self._current.setdefault((kind, name), [0, 0.0, 0.0, 0, 0, 0])
+        metrics[0] += 1
+        metrics[1] += seconds
+        metrics[2] += seconds - childSeconds
+        metrics[3] += drawCalls
+        metrics[4] += triangles
+        metrics[5] += uniformUploads
+
+        # The subtree of the parent contains this node
+        if len(self._stack) > 0:
+            parent = self._stack[-1]
+            parent[3] += seconds
+            parent[4] += drawCalls
+            parent[5] += triangles
+            parent[6] += uniformUploads
+
+    def update(self):
+        """
+        It must be called once per frame, after drawing
+        """
+        self.frames.append(self._current)
+        self._current = {}
+
+    def getStats(self, sortBy="ms"):
+        """
+        Returns a list with the metrics of each node, averaged per frame
+        """
+        totals = {}
+        for frame in self.frames:
+            for key, metrics in frame.items():
+                total = totals.setdefault(key, [0, 0.0, 0.0, 0, 0, 0])
+                for i in range(len(metrics)):
+                    total[i] += metrics[i]
+
+        frames = max(len(self.frames), 1)
+        stats = []
+        for (kind, name), total in totals.items():
+            stats += [{
+                "kind": kind,
+                "name": name,
+                "visits": total[0] / frames,
+                "ms": 1000.0 * total[1] / frames,
+                "selfMs": 1000.0 * total[2] / frames,
+                "drawCalls": total[3] / frames,
+                "triangles": total[4] / frames,
+                "uniformUploads": total[5] / frames
+            }]
+
+        stats.sort(key=lambda row: row[sortBy], reverse=True)
+        return stats
+
+    def table(self, sortBy="ms"):
+        """
+        Returns the metrics as a text table, sorted by the given column
+        """
+        lines = [f"{'kind':<8} {'name':<24} {'visits':>8} {'ms':>8} {'self ms':>8} {'draws':>8} {'triangles':>10} {'uniforms':>8}"]
+        for row in self.getStats(sortBy):
+            lines += [f"{row['kind']:<8} {str(row['name']):<24} {row['visits']:>8.1f} {row['ms']:>8.3f} {row['selfMs']:>8.3f}"
+                      f" {row['drawCalls']:>8.1f} {row['triangles']:>10.0f} {row['uniformUploads']:>8.1f}"]
+        return "\n".join(lines)
+
+    def toJSON(self, sortBy="ms"):
+        return json.dumps({"frames": len(self.frames), "nodes": self.getStats(sortBy)}, indent=4)
+
+    def __str__(self):
+        return self.table()
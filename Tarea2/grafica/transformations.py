@@ -1,62 +1,99 @@
 # coding=utf-8
-"""Transformation matrices for computer graphics"""
+"""
+Transformation matrices for computer graphics
+
+Constructors also accept arrays of parameters, returning stacks of
+matrices with shape (N,4,4) (or the broadcast shape of the parameters).
+They also accept an out float32 buffer of that shape, where the matrices
+are written instead of allocating new ones.
+
+Every matrix is a float32, C-contiguous numpy array stored by rows.
+OpenGL receives them as they are, with transpose=GL_TRUE (or row_major
+uniform blocks), so no conversion is needed when uploading them.
+"""
 
 import numpy as np
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
 
+def _matrices(*params, out=None):
+    # Zero matrices with the broadcast shape of the parameters, (4,4) for scalars
+    if out is not None:
+        out.fill(0)
+        return out
+
+    shape = np.broadcast(*params).shape
+    return np.zeros(shape + (4, 4), dtype=np.float32)
+
+
 def identity():
     return np.identity(4, dtype=np.float32)
 
 
-def uniformScale(s):
-    return np.array([
-        [s,0,0,0],
-        [0,s,0,0],
-        [0,0,s,0],
-        [0,0,0,1]], dtype = np.float32)
+def asMatrix(matrix):
+    """The matrix as float32 and C-contiguous, copying it only if it is not already"""
+    return np.ascontiguousarray(matrix, dtype=np.float32)
 
 
-def scale(sx, sy, sz):
-    return np.array([
-        [sx,0,0,0],
-        [0,sy,0,0],
-        [0,0,sz,0],
-        [0,0,0,1]], dtype = np.float32)
+def uniformScale(s, out=None):
+    out = _matrices(s, out=out)
+    out[..., 0, 0] = s
+    out[..., 1, 1] = s
+    out[..., 2, 2] = s
+    out[..., 3, 3] = 1
+    return out
+
 
+def scale(sx, sy, sz, out=None):
+    out = _matrices(sx, sy, sz, out=out)
+    out[..., 0, 0] = sx
+    out[..., 1, 1] = sy
+    out[..., 2, 2] = sz
+    out[..., 3, 3] = 1
+    return out
 
-def rotationX(theta):
+
+def rotationX(theta, out=None):
     sin_theta = np.sin(theta)
     cos_theta = np.cos(theta)
 
-    return np.array([
-        [1,0,0,0],
-        [0,cos_theta,-sin_theta,0],
-        [0,sin_theta,cos_theta,0],
-        [0,0,0,1]], dtype = np.float32)
+    out = _matrices(theta, out=out)
+    out[..., 0, 0] = 1
+    out[..., 1, 1] = cos_theta
+    out[..., 1, 2] = -sin_theta
+    out[..., 2, 1] = sin_theta
+    out[..., 2, 2] = cos_theta
+    out[..., 3, 3] = 1
+    return out
 
 
-def rotationY(theta):
+def rotationY(theta, out=None):
     sin_theta = np.sin(theta)
     cos_theta = np.cos(theta)
 
-    return np.array([
-        [cos_theta,0,sin_theta,0],
-        [0,1,0,0],
-        [-sin_theta,0,cos_theta,0],
-        [0,0,0,1]], dtype = np.float32)
+    out = _matrices(theta, out=out)
+    out[..., 0, 0] = cos_theta
+    out[..., 0, 2] = sin_theta
+    out[..., 1, 1] = 1
+    out[..., 2, 0] = -sin_theta
+    out[..., 2, 2] = cos_theta
+    out[..., 3, 3] = 1
+    return out
 
 
-def rotationZ(theta):
+def rotationZ(theta, out=None):
     sin_theta = np.sin(theta)
     cos_theta = np.cos(theta)
 
-    return np.array([
-        [cos_theta,-sin_theta,0,0],
-        [sin_theta,cos_theta,0,0],
-        [0,0,1,0],
-        [0,0,0,1]], dtype = np.float32)
+    out = _matrices(theta, out=out)
+    out[..., 0, 0] = cos_theta
+    out[..., 0, 1] = -sin_theta
+    out[..., 1, 0] = sin_theta
+    out[..., 1, 1] = cos_theta
+    out[..., 2, 2] = 1
+    out[..., 3, 3] = 1
+    return out
 
 
 def rotationA(theta, axis):
@@ -89,12 +126,16 @@ def rotationA(theta, axis):
         [0,0,0,1]], dtype = np.float32)
 
 
-def translate(tx, ty, tz):
-    return np.array([
-        [1,0,0,tx],
-        [0,1,0,ty],
-        [0,0,1,tz],
-        [0,0,0,1]], dtype = np.float32)
+def translate(tx, ty, tz, out=None):
+    out = _matrices(tx, ty, tz, out=out)
+    out[..., 0, 0] = 1
+    out[..., 1, 1] = 1
+    out[..., 2, 2] = 1
+    out[..., 3, 3] = 1
+    out[..., 0, 3] = tx
+    out[..., 1, 3] = ty
+    out[..., 2, 3] = tz
+    return out
 
 
 def shearing(xy, yx, xz, zx, yz, zy):
@@ -105,11 +146,85 @@ def shearing(xy, yx, xz, zx, yz, zy):
         [ 0,  0,  0, 1]], dtype = np.float32)
 
 
-def matmul(mats):
-    out = mats[0]
+def matmul(mats, out=None):
+    # Stacks of matrices are broadcast, e.g. (N,4,4) times (4,4) gives (N,4,4)
+    if out is not None:
+        out[...] = mats[0]
+        for i in range(1, len(mats)):
+            np.matmul(out, mats[i], out=out)
+        return out
+
+    # Products stay in float32 even if a factor has float64 data
+    out = asMatrix(mats[0])
     for i in range(1, len(mats)):
-        out = np.matmul(out, mats[i])
+        out = np.matmul(out, mats[i], dtype=np.float32)
+
+    return out
+
 
+def normalMatrix(model):
+    """
+    Matrices transforming normals by the given model matrices, (3,3) or (N,3,3).
+    This is the inverse transpose of the upper 3x3 block, which is only computed
+    for models with a non uniform scale. Otherwise the block itself is returned,
+    as shaders normalize the transformed normals.
+    """
+    block = np.array(np.asarray(model)[..., 0:3, 0:3], dtype=np.float32)
+
+    # A rotation with a uniform scale s satisfies block^T block = s^2 I
+    gram = np.matmul(np.swapaxes(block, -1, -2), block)
+    squaredScale = np.trace(gram, axis1=-2, axis2=-1)[..., np.newaxis, np.newaxis] / 3
+    nonUniform = np.any(np.abs(gram - squaredScale * np.identity(3)) > 1e-4 * squaredScale, axis=(-2, -1))
+
+    if np.any(nonUniform):
+        try:
+            inverses = np.linalg.inv(block[nonUniform])
+        except np.linalg.LinAlgError:
+            # Flattened models (a scale of 0) have no inverse
+            inverses = np.linalg.pinv(block[nonUniform])
+        block[nonUniform] = np.swapaxes(inverses, -1, -2)
+
+    return block
+
+
+def trs(translation, rotation, scale, out=None):
+    """
+    Same as matmul([translate(tx, ty, tz), rotationZ(rz), rotationY(ry), rotationX(rx), scale(sx, sy, sz)]),
+    written directly into a single matrix (or into out).
+    translation is (tx, ty, tz), rotation is (rx, ry, rz) and scale is (sx, sy, sz) or a number.
+    Arrays with shape (N,3) give stacks of matrices.
+    """
+    translation = np.asarray(translation)
+    rotation = np.asarray(rotation)
+    scale = np.asarray(scale)
+
+    if scale.ndim == 0:
+        kx = ky = kz = scale
+    else:
+        kx, ky, kz = scale[..., 0], scale[..., 1], scale[..., 2]
+
+    out = _matrices(translation[..., 0], rotation[..., 0], kx, out=out)
+
+    sin_x, sin_y, sin_z = np.sin(rotation[..., 0]), np.sin(rotation[..., 1]), np.sin(rotation[..., 2])
+    cos_x, cos_y, cos_z = np.cos(rotation[..., 0]), np.cos(rotation[..., 1]), np.cos(rotation[..., 2])
+
+    # Columns of rotationZ * rotationY * rotationX, each one scaled
+    out[..., 0, 0] = cos_z * cos_y * kx
+    out[..., 1, 0] = sin_z * cos_y * kx
+    out[..., 2, 0] = -sin_y * kx
+
+    out[..., 0, 1] = (cos_z * sin_y * sin_x - sin_z * cos_x) * ky
+    out[..., 1, 1] = (sin_z * sin_y * sin_x + cos_z * cos_x) * ky
+    out[..., 2, 1] = cos_y * sin_x * ky
+
+    out[..., 0, 2] = (cos_z * sin_y * cos_x + sin_z * sin_x) * kz
+    out[..., 1, 2] = (sin_z * sin_y * cos_x - cos_z * sin_x) * kz
+    out[..., 2, 2] = cos_y * cos_x * kz
+
+    out[..., 0, 3] = translation[..., 0]
+    out[..., 1, 3] = translation[..., 1]
+    out[..., 2, 3] = translation[..., 2]
+    out[..., 3, 3] = 1
     return out
 
 
@@ -182,3 +297,34 @@ def lookAt(eye, at, up):
             [-forward[0], -forward[1], -forward[2], np.dot(forward, eye)],
             [0,0,0,1]
         ], dtype = np.float32)
+
+
+def lookAtBatch(eyes, ats, ups):
+    """
+    View matrices (N,4,4) for arrays of eyes, ats and ups with shape (N,3).
+    A single eye, at or up with shape (3,) is shared by every matrix.
+    """
+    eyes = np.asarray(eyes, dtype=np.float32)
+    ats = np.asarray(ats, dtype=np.float32)
+    ups = np.asarray(ups, dtype=np.float32)
+
+    forward = ats - eyes
+    forward = forward / np.linalg.norm(forward, axis=-1, keepdims=True)
+
+    side = np.cross(forward, ups)
+    side = side / np.linalg.norm(side, axis=-1, keepdims=True)
+
+    newUp = np.cross(side, forward)
+    newUp = newUp / np.linalg.norm(newUp, axis=-1, keepdims=True)
+
+    eyes = np.broadcast_to(eyes, forward.shape)
+
+    out = np.zeros(forward.shape[:-1] + (4, 4), dtype=np.float32)
+    out[..., 0, 0:3] = side
+    out[..., 1, 0:3] = newUp
+    out[..., 2, 0:3] = -forward
+    out[..., 0, 3] = -np.sum(side * eyes, axis=-1)
+    out[..., 1, 3] = -np.sum(newUp * eyes, axis=-1)
+    out[..., 2, 3] = np.sum(forward * eyes, axis=-1)
+    out[..., 3, 3] = 1
+    return out
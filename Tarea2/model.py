@@ -4,6 +4,11 @@ import glfw
 import numpy as np
 import random as rd
 import grafica.transformations as tr
+import grafica.quaternions as qt
+
+X_AXIS = (1, 0, 0)
+Y_AXIS = (0, 1, 0)
+Z_AXIS = (0, 0, 1)
 
 # class for each articulation
 # works with the curves and model given
@@ -16,6 +21,8 @@ class articulation():
         self.j = 0
         self.setOfCurves = aSetOfCurves
         self.lastTransform = 0
+        # Rotacion de la articulacion como cuaternion, su matriz se calcula solo si cambia
+        self.joint = qt.Transform()
 
     def move(self):
         if self.index < len(self.curve) -2:
@@ -36,16 +43,19 @@ class articulation():
         self.controller = new_controller
     
     def update(self):
+        # Cada fase rota sobre un eje, partiendo de la rotacion final de la fase anterior
         if self.j % 4 == 0:
-            self.model.transform = tr.matmul([tr.rotationX(self.pos[1])]) # self.transform
-            self.transform1 = tr.rotationX(self.pos[1])
+            self.joint.rotation = qt.axisAngle(X_AXIS, self.pos[1]) # self.transform
+            self.rotation1 = self.joint.rotation
         elif self.j % 4 == 1:
-            self.model.transform = tr.matmul([tr.rotationY(self.pos[1]), self.transform1])
-            self.transform2 = tr.matmul([tr.rotationY(self.pos[1]), self.transform1])
+            self.joint.rotation = qt.multiply(qt.axisAngle(Y_AXIS, self.pos[1]), self.rotation1)
+            self.rotation2 = self.joint.rotation
         elif self.j % 4 == 2:
-            self.model.transform = tr.matmul([tr.rotationZ(self.pos[1]), self.transform2])
-            self.transform3 = tr.matmul([tr.rotationZ(self.pos[1]), self.transform2])
+            self.joint.rotation = qt.multiply(qt.axisAngle(Z_AXIS, self.pos[1]), self.rotation2)
+            self.rotation3 = self.joint.rotation
         else: # self.j % 4 == 3
-            self.model.transform = tr.matmul([tr.rotationX(self.pos[1])])
+            self.joint.rotation = qt.axisAngle(X_AXIS, self.pos[1])
+
+        self.model.transform = self.joint.matrix
 
 # tr.translate(self.finalTransform[0], self.finalTransform[1],self.finalTransform[2])
\ No newline at end of file
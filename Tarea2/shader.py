@@ -1,8 +1,9 @@
 from OpenGL.GL import *
 import OpenGL.GL.shaders
 from grafica.gpu_shape import GPUShape
+from grafica.easy_shaders import ShaderProgram
 
-class CelShadingPhongShaderProgram:
+class CelShadingPhongShaderProgram(ShaderProgram):
 
     def __init__(self):
         vertex_shader = """
@@ -17,14 +18,20 @@ class CelShadingPhongShaderProgram:
             out vec3 fragNormal;
 
             uniform mat4 model;
-            uniform mat4 view;
-            uniform mat4 projection;
+            uniform mat3 normalMatrix;
+
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
 
             void main()
             {
                 fragPosition = vec3(model * vec4(position, 1.0));
                 fragOriginalColor = color;
-                fragNormal = mat3(transpose(inverse(model))) * normal;  
+                fragNormal = normalMatrix * normal;
                 
                 gl_Position = projection * view * vec4(fragPosition, 1.0);
             }
@@ -39,18 +46,28 @@ class CelShadingPhongShaderProgram:
             in vec3 fragPosition;
             in vec3 fragOriginalColor;
             
-            uniform vec3 lightPosition; 
-            uniform vec3 viewPosition;
-            uniform vec3 La;
-            uniform vec3 Ld;
-            uniform vec3 Ls;
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
+
+            layout (std140, row_major) uniform Lights
+            {
+                vec3 lightPosition;
+                vec3 La;
+                vec3 Ld;
+                vec3 Ls;
+                float constantAttenuation;
+                float linearAttenuation;
+                float quadraticAttenuation;
+            };
+
             uniform vec3 Ka;
             uniform vec3 Kd;
             uniform vec3 Ks;
             uniform uint shininess;
-            uniform float constantAttenuation;
-            uniform float linearAttenuation;
-            uniform float quadraticAttenuation;
 
             void main()
             {
@@ -118,10 +135,14 @@ class CelShadingPhongShaderProgram:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -149,12 +170,12 @@ class CelShadingPhongShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
-class CelShading4TonesPhongShaderProgram:
+class CelShading4TonesPhongShaderProgram(ShaderProgram):
 
     def __init__(self):
         vertex_shader = """
@@ -169,14 +190,20 @@ class CelShading4TonesPhongShaderProgram:
             out vec3 fragNormal;
 
             uniform mat4 model;
-            uniform mat4 view;
-            uniform mat4 projection;
+            uniform mat3 normalMatrix;
+
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
 
             void main()
             {
                 fragPosition = vec3(model * vec4(position, 1.0));
                 fragOriginalColor = color;
-                fragNormal = mat3(transpose(inverse(model))) * normal;  
+                fragNormal = normalMatrix * normal;
                 
                 gl_Position = projection * view * vec4(fragPosition, 1.0);
             }
@@ -191,18 +218,28 @@ class CelShading4TonesPhongShaderProgram:
             in vec3 fragPosition;
             in vec3 fragOriginalColor;
             
-            uniform vec3 lightPosition; 
-            uniform vec3 viewPosition;
-            uniform vec3 La;
-            uniform vec3 Ld;
-            uniform vec3 Ls;
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
+
+            layout (std140, row_major) uniform Lights
+            {
+                vec3 lightPosition;
+                vec3 La;
+                vec3 Ld;
+                vec3 Ls;
+                float constantAttenuation;
+                float linearAttenuation;
+                float quadraticAttenuation;
+            };
+
             uniform vec3 Ka;
             uniform vec3 Kd;
             uniform vec3 Ks;
             uniform uint shininess;
-            uniform float constantAttenuation;
-            uniform float linearAttenuation;
-            uniform float quadraticAttenuation;
 
             void main()
             {
@@ -270,10 +307,14 @@ class CelShading4TonesPhongShaderProgram:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -301,12 +342,12 @@ class CelShading4TonesPhongShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
-class CelShadingTexturePhongShaderProgram:
+class CelShadingTexturePhongShaderProgram(ShaderProgram):
 
     def __init__(self):
         vertex_shader = """
@@ -321,14 +362,20 @@ class CelShadingTexturePhongShaderProgram:
             out vec3 fragNormal;
 
             uniform mat4 model;
-            uniform mat4 view;
-            uniform mat4 projection;
+            uniform mat3 normalMatrix;
+
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
 
             void main()
             {
                 fragPosition = vec3(model * vec4(position, 1.0));
                 fragTexCoords = texCoords;
-                fragNormal = mat3(transpose(inverse(model))) * normal;  
+                fragNormal = normalMatrix * normal;
                 
                 gl_Position = projection * view * vec4(fragPosition, 1.0);
             }
@@ -343,18 +390,28 @@ class CelShadingTexturePhongShaderProgram:
 
             out vec4 fragColor;
             
-            uniform vec3 lightPosition; 
-            uniform vec3 viewPosition; 
-            uniform vec3 La;
-            uniform vec3 Ld;
-            uniform vec3 Ls;
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
+
+            layout (std140, row_major) uniform Lights
+            {
+                vec3 lightPosition;
+                vec3 La;
+                vec3 Ld;
+                vec3 Ls;
+                float constantAttenuation;
+                float linearAttenuation;
+                float quadraticAttenuation;
+            };
+
             uniform vec3 Ka;
             uniform vec3 Kd;
             uniform vec3 Ks;
             uniform uint shininess;
-            uniform float constantAttenuation;
-            uniform float linearAttenuation;
-            uniform float quadraticAttenuation;
 
             uniform sampler2D samplerTex;
 
@@ -402,10 +459,14 @@ class CelShadingTexturePhongShaderProgram:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -435,12 +496,12 @@ class CelShadingTexturePhongShaderProgram:
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
-class CelShadingSpotLight:
+class CelShadingSpotLight(ShaderProgram):
 
     def __init__(self):
         vertex_shader = """
@@ -455,14 +516,20 @@ class CelShadingSpotLight:
             out vec3 fragNormal;
 
             uniform mat4 model;
-            uniform mat4 view;
-            uniform mat4 projection;
+            uniform mat3 normalMatrix;
+
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
 
             void main()
             {
                 fragPosition = vec3(model * vec4(position, 1.0));
                 fragOriginalColor = color;
-                fragNormal = mat3(transpose(inverse(model))) * normal;  
+                fragNormal = normalMatrix * normal;
                 
                 gl_Position = projection * view * vec4(fragPosition, 1.0);
             }
@@ -477,18 +544,28 @@ class CelShadingSpotLight:
             in vec3 fragPosition;
             in vec3 fragOriginalColor;
             
-            uniform vec3 lightPosition; 
-            uniform vec3 viewPosition;
-            uniform vec3 La;
-            uniform vec3 Ld;
-            uniform vec3 Ls;
+            layout (std140, row_major) uniform Camera
+            {
+                mat4 projection;
+                mat4 view;
+                vec3 viewPosition;
+            };
+
+            layout (std140, row_major) uniform Lights
+            {
+                vec3 lightPosition;
+                vec3 La;
+                vec3 Ld;
+                vec3 Ls;
+                float constantAttenuation;
+                float linearAttenuation;
+                float quadraticAttenuation;
+            };
+
             uniform vec3 Ka;
             uniform vec3 Kd;
             uniform vec3 Ks;
             uniform uint shininess;
-            uniform float constantAttenuation;
-            uniform float linearAttenuation;
-            uniform float quadraticAttenuation;
 
             uniform float concentrationP;
             uniform vec3 spotDirR;
@@ -559,10 +636,14 @@ class CelShadingSpotLight:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -589,7 +670,7 @@ class CelShadingSpotLight:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
\ No newline at end of file
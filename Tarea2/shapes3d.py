@@ -9,37 +9,54 @@ import grafica.basic_shapes as bs
 import grafica.easy_shaders as es
 import grafica.transformations as tr
 import grafica.scene_graph as sg
+import grafica.shape_cache as sc
 import openmesh as om
 import random
 import copy
 
 # Convenience function to ease initialization
 def createGPUShape(pipeline, shape):
+    # Las figuras iguales de un mismo pipeline se suben una sola vez
+    return sc.cache.getShape(pipeline, shape, lambda: _uploadShape(pipeline, shape))
+
+def _uploadShape(pipeline, shape):
     gpuShape = es.GPUShape().initBuffers()
     pipeline.setupVAO(gpuShape)
     gpuShape.fillBuffers(shape.vertices, shape.indices, GL_STATIC_DRAW)
     return gpuShape
 
-# Convenience function to ease initialization
-def createTextureGPUShape(shape, pipeline, path):
-    # Funcion Conveniente para facilitar la inicializacion de un GPUShape con texturas
+def _loadTexture(path, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmap):
+    # Cada imagen con los mismos parametros se carga una sola vez
+    def load():
+        texture = es.textureSimpleSetup(path, sWrapMode, tWrapMode, minFilterMode, maxFilterMode)
+        if mipmap:
+            glGenerateMipmap(GL_TEXTURE_2D)
+        return texture
+
+    return sc.cache.getTexture((path, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmap), load)
+
+def _uploadTextureShape(shape, pipeline, textureKey):
     gpuShape = es.GPUShape().initBuffers()
     pipeline.setupVAO(gpuShape)
     gpuShape.fillBuffers(shape.vertices, shape.indices, GL_STATIC_DRAW)
-    gpuShape.texture = es.textureSimpleSetup(
-        path, GL_CLAMP_TO_EDGE, GL_CLAMP_TO_EDGE, GL_NEAREST, GL_NEAREST)
+    gpuShape.texture = _loadTexture(*textureKey)
     return gpuShape
 
+# Convenience function to ease initialization
+def createTextureGPUShape(shape, pipeline, path):
+    # Funcion Conveniente para facilitar la inicializacion de un GPUShape con texturas
+    textureKey = (path, GL_CLAMP_TO_EDGE, GL_CLAMP_TO_EDGE, GL_NEAREST, GL_NEAREST, False)
+    return sc.cache.getShape(pipeline, shape, lambda: _uploadTextureShape(shape, pipeline, textureKey), textureKey)
+
 # Convenience function to ease initialization
 def createTextureGPUShapeX(shape, pipeline,sWrapMode, tWrapMode, minFilterMode, maxFilterMode, path):
     # Funcion Conveniente para facilitar la inicializacion de un GPUShape con texturas
-    gpuShape = es.GPUShape().initBuffers()
-    pipeline.setupVAO(gpuShape)
-    gpuShape.fillBuffers(shape.vertices, shape.indices, GL_STATIC_DRAW)
-    gpuShape.texture = es.textureSimpleSetup(
-        path, sWrapMode, tWrapMode, minFilterMode, maxFilterMode)
-    glGenerateMipmap(GL_TEXTURE_2D)
-    return gpuShape
+    textureKey = (path, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, True)
+    return sc.cache.getShape(pipeline, shape, lambda: _uploadTextureShape(shape, pipeline, textureKey), textureKey)
+
+def generateGPUShape(pipeline, generator, *args):
+    # Como createGPUShape, pero la figura generator(*args) solo se construye si no esta en el cache
+    return sc.cache.generate(pipeline, lambda shape: _uploadShape(pipeline, shape), generator, *args)
 
 # creates the scene where the dance takes place
 # returns sceneGraphNode
@@ -113,13 +130,13 @@ def createTextureQuad(nx, ny):
          0, 1, 2,
          2, 3, 0]
 
-    return bs.Shape(vertices, indices)
+    return bs.Shape(vertices, indices, stride=8)
 
 # creates the body that will be dancing
 # return a sceneGraphNode
 def createBodyScene2(pipeline, babyNode):
     gpuGrayCube = createGPUShape(pipeline, bs.createColorNormalsCube(0.7, 0.7, 0.7))
-    articulationShape = createGPUShape(pipeline, createColorNormalSphere(64, 0.4, 0.4, 0.4))
+    articulationShape = generateGPUShape(pipeline, createColorNormalSphere, 64, 0.4, 0.4, 0.4)
 
     neckNode = sg.SceneGraphNode("neck")
     neckNode.transform = tr.matmul([tr.uniformScale(0.15)])
@@ -251,7 +268,7 @@ def hanger():
         0.7, 0, 0, 1, 1, 1        # 4
     ]
     indices = [1,0, 2, 3, 2, 0, 4, 3, 4, 1]
-    return bs.Shape(vertices, indices)
+    return bs.Shape(vertices, indices, stride=6)
 
 # creates a node with a cube and its transformations
 # returns a sceneGraphNode
@@ -341,60 +358,28 @@ def createTorax():
         9,10,11,
         11,12,9
     ]
-    return bs.Shape(vertices, indices)
+    return bs.Shape(vertices, indices, stride=8)
 
-# creates a shape of a sphere
-# returns a Shape 
-def createColorNormalSphere(N, red, g, b):
+# Esfera de radio 0.5, con phi alrededor del eje z y theta desde el polo norte
+def _spherePosition(phi, theta):
+    return 0.5 * np.sin(theta) * np.cos(phi), 0.5 * np.sin(theta) * np.sin(phi), 0.5 * np.cos(theta)
 
-    vertices = []
-    indices = []
-    dTheta = 2 * np.pi /N
-    dPhi = 2 * np.pi /N
-    r = 0.5
-    c = 0
+def _sphereNormal(phi, theta):
+    return np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)
 
-    for i in range(N - 1):
-        theta = i * dTheta
-        theta1 = (i + 1) * dTheta
-        for j in range(N):
-            phi = j*dPhi
-            phi1 = (j+1)*dPhi
-            v0 = [r*np.sin(theta)*np.cos(phi), r*np.sin(theta)*np.sin(phi), r*np.cos(theta)]
-            v1 = [r*np.sin(theta1)*np.cos(phi), r*np.sin(theta1)*np.sin(phi), r*np.cos(theta1)]
-            v2 = [r*np.sin(theta1)*np.cos(phi1), r*np.sin(theta1)*np.sin(phi1), r*np.cos(theta1)]
-            v3 = [r*np.sin(theta)*np.cos(phi1), r*np.sin(theta)*np.sin(phi1), r*np.cos(theta)]
-            n0 = [np.sin(theta)*np.cos(phi), np.sin(theta)*np.sin(phi), np.cos(theta)]
-            n1 = [np.sin(theta1)*np.cos(phi), np.sin(theta1)*np.sin(phi), np.cos(theta1)]
-            n2 = [np.sin(theta1)*np.cos(phi1), np.sin(theta1)*np.sin(phi1), np.cos(theta1)]
-            n3 = [np.sin(theta)*np.cos(phi1), np.sin(theta)*np.sin(phi1), np.cos(theta)]
+# Toro de radio 0.5 y seccion de radio 0.1, con phi alrededor del eje z y theta alrededor de la seccion
+def _torusPosition(phi, theta):
+    return (0.5 + 0.1 * np.cos(theta)) * np.cos(phi), (0.5 + 0.1 * np.cos(theta)) * np.sin(phi), 0.1 * np.sin(theta)
 
+def _torusNormal(phi, theta):
+    return np.cos(theta) * np.cos(phi), np.cos(theta) * np.sin(phi), np.sin(theta)
 
-            # Creamos los quad superiores
-            if i == 0:
-                vertices += [v0[0], v0[1], v0[2], red, g, b, n0[0], n0[1], n0[2]]
-                vertices += [v1[0], v1[1], v1[2], red, g, b, n1[0], n1[1], n1[2]]
-                vertices += [v2[0], v2[1], v2[2], red, g, b, n2[0], n2[1], n2[2]]
-                indices += [ c + 0, c + 1, c +2 ]
-                c += 3
-            # Creamos los quads inferiores
-            elif i == (N-2):
-                vertices += [v0[0], v0[1], v0[2], red, g, b, n0[0], n0[1], n0[2]]
-                vertices += [v1[0], v1[1], v1[2], red, g, b, n1[0], n1[1], n1[2]]
-                vertices += [v3[0], v3[1], v3[2], red, g, b, n3[0], n3[1], n3[2]]
-                indices += [ c + 0, c + 1, c +2 ]
-                c += 3
-            
-            # Creamos los quads intermedios
-            else: 
-                vertices += [v0[0], v0[1], v0[2], red, g, b, n0[0], n0[1], n0[2]]
-                vertices += [v1[0], v1[1], v1[2], red, g, b, n1[0], n1[1], n1[2]]
-                vertices += [v2[0], v2[1], v2[2], red, g, b, n2[0], n2[1], n2[2]]
-                vertices += [v3[0], v3[1], v3[2], red, g, b, n3[0], n3[1], n3[2]]
-                indices += [ c + 0, c + 1, c +2 ]
-                indices += [ c + 2, c + 3, c + 0 ]
-                c += 4
-    return bs.Shape(vertices, indices)
+# creates a shape of a sphere
+# returns a Shape 
+def createColorNormalSphere(N, red, g, b):
+    # N divisiones alrededor del eje, N/2 entre los polos
+    return bs.parametricSurface(_spherePosition, _sphereNormal, ((0, 2 * np.pi), (0, np.pi)),
+                                N, max(N // 2, 2), ["position", (red, g, b), "normal"])
 
 # creates the mesh of a Sphere
 # returns a Mesh
@@ -507,124 +492,22 @@ def get_vertexs_and_indexes(mesh, color):
 # creates a shape of sphere with textures
 # returns a Shape
 def createTextureNormalSphere(N):
-    vertices = []
-    indices = []
-    dTheta = 2 * np.pi /N
-    dPhi = 2 * np.pi /N
-    r = 0.5
-    c = 0
-
-    for i in range(N - 1):
-        theta = i * dTheta
-        theta1 = (i + 1) * dTheta
-        for j in range(N):
-            phi = j*dPhi
-            phi1 = (j+1)*dPhi
-            v0 = [r*np.sin(theta)*np.cos(phi), r*np.sin(theta)*np.sin(phi), r*np.cos(theta)]
-            v1 = [r*np.sin(theta1)*np.cos(phi), r*np.sin(theta1)*np.sin(phi), r*np.cos(theta1)]
-            v2 = [r*np.sin(theta1)*np.cos(phi1), r*np.sin(theta1)*np.sin(phi1), r*np.cos(theta1)]
-            v3 = [r*np.sin(theta)*np.cos(phi1), r*np.sin(theta)*np.sin(phi1), r*np.cos(theta)]
-            n0 = [np.sin(theta)*np.cos(phi), np.sin(theta)*np.sin(phi), np.cos(theta)]
-            n1 = [np.sin(theta1)*np.cos(phi), np.sin(theta1)*np.sin(phi), np.cos(theta1)]
-            n2 = [np.sin(theta1)*np.cos(phi1), np.sin(theta1)*np.sin(phi1), np.cos(theta1)]
-            n3 = [np.sin(theta)*np.cos(phi1), np.sin(theta)*np.sin(phi1), np.cos(theta)]
-
-
-            # Creamos los quad superiores
-            if i == 0:
-                vertices += [v0[0], v0[1], v0[2], 0, 1, n0[0], n0[1], n0[2]]
-                vertices += [v1[0], v1[1], v1[2], 1, 1, n1[0], n1[1], n1[2]]
-                vertices += [v2[0], v2[1], v2[2], 0.5, 0, n2[0], n2[1], n2[2]]
-                indices += [ c + 0, c + 1, c +2 ]
-                c += 3
-            # Creamos los quads inferiores
-            elif i == (N-2):
-                vertices += [v0[0], v0[1], v0[2], 0, 0, n0[0], n0[1], n0[2]]
-                vertices += [v1[0], v1[1], v1[2], 0.5, 1, n1[0], n1[1], n1[2]]
-                vertices += [v3[0], v3[1], v3[2], 1, 0, n3[0], n3[1], n3[2]]
-                indices += [ c + 0, c + 1, c +2 ]
-                c += 3
-            
-            # Creamos los quads intermedios
-            else: 
-                vertices += [v0[0], v0[1], v0[2], 0, 0, n0[0], n0[1], n0[2]]
-                vertices += [v1[0], v1[1], v1[2], 0, 1, n1[0], n1[1], n1[2]]
-                vertices += [v2[0], v2[1], v2[2], 1, 1, n2[0], n2[1], n2[2]]
-                vertices += [v3[0], v3[1], v3[2], 0, 1, n3[0], n3[1], n3[2]]
-                indices += [ c + 0, c + 1, c +2 ]
-                indices += [ c + 2, c + 3, c + 0 ]
-                c += 4
-    return bs.Shape(vertices, indices)
+    # La imagen cubre la esfera una vez
+    return bs.parametricSurface(_spherePosition, _sphereNormal, ((0, 2 * np.pi), (0, np.pi)),
+                                N, max(N // 2, 2), ["position", "uv", "normal"])
 
 # creates the shape of a torus
 # returns a Shape
 def createColorTorus(N):
-    vertices = []
-    indices = []
-    dPhi = 2 * np.pi/N
-    dTheta = 2 * np.pi/N
-    c= 0
-    for i in range(N):
-        theta = i * dTheta
-        theta1 = (i + 1) * dTheta
-        for j in range(N):
-            phi = j*dPhi
-            phi1 = (j+1)*dPhi
-
-            v0 = [(0.5 + 0.1*np.cos(theta))*np.cos(phi), (0.5 + 0.1*np.cos(theta))*np.sin(phi), 0.1 * np.sin(theta)]
-            v1 = [(0.5 + 0.1*np.cos(theta1))*np.cos(phi), (0.5 + 0.1*np.cos(theta1))*np.sin(phi), 0.1 * np.sin(theta1)]
-            v2 = [(0.5 + 0.1*np.cos(theta1))*np.cos(phi1), (0.5 + 0.1*np.cos(theta1))*np.sin(phi1), 0.1 * np.sin(theta1)]
-            v3 = [(0.5 + 0.1*np.cos(theta))*np.cos(phi1), (0.5 + 0.1*np.cos(theta))*np.sin(phi1), 0.1 * np.sin(theta)]
-
-            n0 = [(0.5 + np.cos(theta))*np.cos(phi), (0.5 + np.cos(theta))*np.sin(phi),  np.sin(theta)]
-            n1 = [(0.5 + np.cos(theta1))*np.cos(phi), (0.5 + np.cos(theta1))*np.sin(phi), np.sin(theta1)]
-            n2 = [(0.5 + np.cos(theta1))*np.cos(phi1), (0.5 + np.cos(theta1))*np.sin(phi1),  np.sin(theta1)]
-            n3 = [(0.5 + np.cos(theta))*np.cos(phi1), (0.5 + np.cos(theta))*np.sin(phi1),   np.sin(theta)]
-
-            vertices += [v0[0], v0[1], v0[2], 0.3, 0.3, 0.3, n0[0], n0[1], n0[2]]
-            vertices += [v1[0], v1[1], v1[2], 0.3, 0.3, 0.3, n1[0], n1[1], n1[2]]
-            vertices += [v2[0], v2[1], v2[2], 0.3, 0.3, 0.3, n2[0], n2[1], n2[2]]
-            vertices += [v3[0], v3[1], v3[2], 0.3, 0.3, 0.3, n3[0], n3[1], n3[2]]
-            indices += [ c + 0, c + 1, c +2 ]
-            indices += [ c + 2, c + 3, c + 0 ]
-            c += 4
-    
-    return bs.Shape(vertices, indices)
+    return bs.parametricSurface(_torusPosition, _torusNormal, ((0, 2 * np.pi), (0, 2 * np.pi)),
+                                N, N, ["position", (0.3, 0.3, 0.3), "normal"])
 
 # creates the shape of a torus with textures
 # returns a Shape
 def createTextureTorus(N):
-    vertices = []
-    indices = []
-    dPhi = 2 * np.pi/N
-    dTheta = 2 * np.pi/N
-    c= 0
-    for i in range(N):
-        theta = i * dTheta
-        theta1 = (i + 1) * dTheta
-        for j in range(N):
-            phi = j*dPhi
-            phi1 = (j+1)*dPhi
-
-            v0 = [(0.5 + 0.1*np.cos(theta))*np.cos(phi), (0.5 + 0.1*np.cos(theta))*np.sin(phi), 0.1 * np.sin(theta)]
-            v1 = [(0.5 + 0.1*np.cos(theta1))*np.cos(phi), (0.5 + 0.1*np.cos(theta1))*np.sin(phi), 0.1 * np.sin(theta1)]
-            v2 = [(0.5 + 0.1*np.cos(theta1))*np.cos(phi1), (0.5 + 0.1*np.cos(theta1))*np.sin(phi1), 0.1 * np.sin(theta1)]
-            v3 = [(0.5 + 0.1*np.cos(theta))*np.cos(phi1), (0.5 + 0.1*np.cos(theta))*np.sin(phi1), 0.1 * np.sin(theta)]
-
-            n0 = [(0.5 + np.cos(theta))*np.cos(phi), (0.5 + np.cos(theta))*np.sin(phi),  np.sin(theta)]
-            n1 = [(0.5 + np.cos(theta1))*np.cos(phi), (0.5 + np.cos(theta1))*np.sin(phi), np.sin(theta1)]
-            n2 = [(0.5 + np.cos(theta1))*np.cos(phi1), (0.5 + np.cos(theta1))*np.sin(phi1),  np.sin(theta1)]
-            n3 = [(0.5 + np.cos(theta))*np.cos(phi1), (0.5 + np.cos(theta))*np.sin(phi1),   np.sin(theta)]
-
-            vertices += [v0[0], v0[1], v0[2], 0, 0, n0[0], n0[1], n0[2]]
-            vertices += [v1[0], v1[1], v1[2], 0, 1, n1[0], n1[1], n1[2]]
-            vertices += [v2[0], v2[1], v2[2], 1, 1, n2[0], n2[1], n2[2]]
-            vertices += [v3[0], v3[1], v3[2], 0, 1, n3[0], n3[1], n3[2]]
-            indices += [ c + 0, c + 1, c +2 ]
-            indices += [ c + 2, c + 3, c + 0 ]
-            c += 4
-    
-    return bs.Shape(vertices, indices)
+    # La imagen cubre el toro una vez
+    return bs.parametricSurface(_torusPosition, _torusNormal, ((0, 2 * np.pi), (0, 2 * np.pi)),
+                                N, N, ["position", "uv", "normal"])
 
 # creates the shape of a cube with normals and textures
 # returns a Shape
@@ -676,7 +559,7 @@ def createTextureNormalsCube(nx, ny):
          19,18,17,17,16,19, # Y+
          20,21,22,22,23,20] # Y-
 
-    return bs.Shape(vertices, indices)
+    return bs.Shape(vertices, indices, stride=8)
 
 # creates a node for the sphere mesh
 # returns a sceneGraphNode
@@ -702,7 +585,7 @@ def createSphMshNode(pipeline):
 # creates a node of a sphere
 # returns a Node  
 def createSphereNode(r, g, b, pipeline):
-    sphere = createGPUShape(pipeline, createColorNormalSphere(20, r,g,b))
+    sphere = generateGPUShape(pipeline, createColorNormalSphere, 20, r, g, b)
 
     sphereNode = sg.SceneGraphNode("sphere")
     sphereNode.transform =tr.matmul([
@@ -738,7 +621,7 @@ def createTexSphereNode(pipeline):
 # creates a node of a torus
 # returns a sceneGraphNode
 def createTorusNode(pipeline, num = 0.0):
-    torus = createGPUShape(pipeline,createColorTorus(20))
+    torus = generateGPUShape(pipeline, createColorTorus, 20)
 
     torusNode = sg.SceneGraphNode("torus")
     torusNode.transform =tr.matmul([
@@ -4,10 +4,14 @@
 from OpenGL.GL import *
 import OpenGL.GL.shaders
 import numpy as np
+import warnings
 from PIL import Image
 
 import grafica.basic_shapes as bs
+import grafica.gpu_registry as gr
+import grafica.transformations as tr
 from grafica.gpu_shape import GPUShape
+import grafica.uniform_buffer as ub
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
@@ -16,11 +20,46 @@ __license__ = "MIT"
 # 1 byte = 8 bits
 SIZE_IN_BYTES = 4
 
+# When enabled, matrices that need a conversion before being uploaded are reported
+_checkUploads = False
+
+
+def setUploadChecks(enabled):
+    global _checkUploads
+    _checkUploads = enabled
+
+
+def _checkMatrix(matrix):
+    if not isinstance(matrix, np.ndarray):
+        problem = type(matrix).__name__
+    elif matrix.dtype != np.float32:
+        problem = str(matrix.dtype)
+    elif not matrix.flags.c_contiguous:
+        problem = "non contiguous array"
+    else:
+        return
+
+    warnings.warn(f"A {problem} matrix is converted to float32 on every upload, use tr.asMatrix", stacklevel=3)
+
+
+def uploadMatrix3(location, matrix):
+    """Uploads a float32 matrix stored by rows as it is, OpenGL transposes it"""
+    if _checkUploads:
+        _checkMatrix(matrix)
+    glUniformMatrix3fv(location, 1, GL_TRUE, matrix)
+
+
+def uploadMatrix4(location, matrix):
+    """Uploads a float32 matrix stored by rows as it is, OpenGL transposes it"""
+    if _checkUploads:
+        _checkMatrix(matrix)
+    glUniformMatrix4fv(location, 1, GL_TRUE, matrix)
+
 
 def textureSimpleSetup(imgName, sWrapMode, tWrapMode, minFilterMode, maxFilterMode):
      # wrapMode: GL_REPEAT, GL_CLAMP_TO_EDGE
      # filterMode: GL_LINEAR, GL_NEAREST
-    texture = glGenTextures(1)
+    texture = gr.genTexture(imgName)
     glBindTexture(GL_TEXTURE_2D, texture)
     
     # texture wrapping params
@@ -46,10 +85,85 @@ def textureSimpleSetup(imgName, sWrapMode, tWrapMode, minFilterMode, maxFilterMo
 
     glTexImage2D(GL_TEXTURE_2D, 0, internalFormat, image.size[0], image.size[1], 0, format, GL_UNSIGNED_BYTE, img_data)
 
+    # Size of the base level, mipmaps add up to a third more
+    gr.registry.resize(gr.TEXTURE, texture, img_data.nbytes)
+
     return texture
 
 
-class SimpleShaderProgram:
+class ShaderProgram:
+    """
+    Base class for shader programs.
+    Locations of the active uniforms are queried once, right after compiling,
+    so the setters below do not call glGetUniformLocation on every frame.
+    """
+
+    # A vf.VertexFormat to store the vertices of its shapes in a compact layout,
+    # None for the float32 layout described in setupVAO
+    vertexFormat = None
+
+    def initUniforms(self):
+        """It must be called once self.shaderProgram has been compiled"""
+
+        self.uniformLocations = {}
+        self.uniformTypes = {}
+
+        count = glGetProgramiv(self.shaderProgram, GL_ACTIVE_UNIFORMS)
+        for index in range(count):
+            name, size, uniformType = glGetActiveUniform(self.shaderProgram, index)
+            name = name.decode() if isinstance(name, bytes) else name
+
+            # Arrays are reported as "name[0]"
+            if name.endswith("[0]"):
+                name = name[:-3]
+
+            location = glGetUniformLocation(self.shaderProgram, name)
+
+            # Uniforms inside uniform blocks do not have a location
+            if location != -1:
+                self.uniformLocations[name] = location
+                self.uniformTypes[name] = uniformType
+
+        # Shared uniform blocks are connected to their binding points
+        for name, binding in ub.BLOCK_BINDINGS.items():
+            blockIndex = glGetUniformBlockIndex(self.shaderProgram, name)
+            if blockIndex != GL_INVALID_INDEX:
+                glUniformBlockBinding(self.shaderProgram, blockIndex, binding)
+
+    def getUniformLocation(self, name):
+        # -1 is silently ignored by OpenGL, as with glGetUniformLocation
+        return self.uniformLocations.get(name, -1)
+
+    def setInt(self, name, value):
+        glUniform1i(self.uniformLocations.get(name, -1), value)
+
+    def setUint(self, name, value):
+        glUniform1ui(self.uniformLocations.get(name, -1), value)
+
+    def setFloat(self, name, value):
+        glUniform1f(self.uniformLocations.get(name, -1), value)
+
+    def setVec3(self, name, x, y, z):
+        glUniform3f(self.uniformLocations.get(name, -1), x, y, z)
+
+    def setVec4(self, name, x, y, z, w):
+        glUniform4f(self.uniformLocations.get(name, -1), x, y, z, w)
+
+    def setMat3(self, name, matrix):
+        uploadMatrix3(self.uniformLocations.get(name, -1), matrix)
+
+    def setMat4(self, name, matrix):
+        # Matrices are stored by rows in numpy, hence they are transposed
+        uploadMatrix4(self.uniformLocations.get(name, -1), matrix)
+
+    def setModel(self, matrix, name="model"):
+        """Sets the model matrix and, if the program uses it, the normal matrix"""
+        self.setMat4(name, matrix)
+        if "normalMatrix" in self.uniformLocations:
+            self.setMat3("normalMatrix", tr.normalMatrix(matrix))
+
+
+class SimpleShaderProgram(ShaderProgram):
 
     def __init__(self):
 
@@ -81,10 +195,14 @@ class SimpleShaderProgram:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -108,13 +226,13 @@ class SimpleShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
-class SimpleTextureShaderProgram:
+class SimpleTextureShaderProgram(ShaderProgram):
 
     def __init__(self):
 
@@ -151,8 +269,12 @@ class SimpleTextureShaderProgram:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
     def setupVAO(self, gpuShape):
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -177,13 +299,13 @@ class SimpleTextureShaderProgram:
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
         
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
-class SimpleTransformShaderProgram:
+class SimpleTransformShaderProgram(ShaderProgram):
 
     def __init__(self):
 
@@ -219,8 +341,12 @@ class SimpleTransformShaderProgram:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
     def setupVAO(self, gpuShape):
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -244,13 +370,13 @@ class SimpleTransformShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
         
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
-class SimpleTextureTransformShaderProgram:
+class SimpleTextureTransformShaderProgram(ShaderProgram):
 
     def __init__(self):
 
@@ -290,10 +416,14 @@ class SimpleTextureTransformShaderProgram:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -317,13 +447,13 @@ class SimpleTextureTransformShaderProgram:
 
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
-class SimpleModelViewProjectionShaderProgram:
+class SimpleModelViewProjectionShaderProgram(ShaderProgram):
 
     def __init__(self):
 
@@ -359,10 +489,14 @@ class SimpleModelViewProjectionShaderProgram:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -386,13 +520,13 @@ class SimpleModelViewProjectionShaderProgram:
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
-class SimpleTextureModelViewProjectionShaderProgram:
+class SimpleTextureModelViewProjectionShaderProgram(ShaderProgram):
 
     def __init__(self):
 
@@ -433,10 +567,14 @@ class SimpleTextureModelViewProjectionShaderProgram:
         self.shaderProgram = OpenGL.GL.shaders.compileProgram(
             OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
             OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
 
 
     def setupVAO(self, gpuShape):
 
+        if self.vertexFormat is not None:
+            return self.vertexFormat.setupVAO(self, gpuShape)
+
         glBindVertexArray(gpuShape.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
@@ -461,9 +599,101 @@ class SimpleTextureModelViewProjectionShaderProgram:
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        glDrawElementsBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, gpuShape.baseVertex)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
+
+
+class SimpleInstancedModelViewProjectionShaderProgram(ShaderProgram):
+    """
+    Draws several copies of a GPUShape with a single draw call.
+    Each copy has its own model matrix and color, given by a gs.InstanceBuffer.
+    """
+
+    def __init__(self):
+
+        vertex_shader = """
+            #version 330 core
+            
+            uniform mat4 projection;
+            uniform mat4 view;
+            uniform mat4 model;
+
+            in vec3 position;
+            in vec3 color;
+
+            in mat4 instanceModel;
+            in vec4 instanceColor;
+
+            out vec3 newColor;
+            void main()
+            {
+                gl_Position = projection * view * model * instanceModel * vec4(position, 1.0f);
+                newColor = color * instanceColor.rgb;
+            }
+            """
+
+        fragment_shader = """
+            #version 330 core
+            in vec3 newColor;
+
+            out vec4 outColor;
+            void main()
+            {
+                outColor = vec4(newColor, 1.0f);
+            }
+            """
+
+        self.shaderProgram = OpenGL.GL.shaders.compileProgram(
+            OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
+            OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+        self.initUniforms()
+
+
+    def setupVAO(self, gpuShape, instanceBuffer):
+
+        glBindVertexArray(gpuShape.vao)
+
+        glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, gpuShape.ebo)
+
+        # 3d vertices + rgb color specification => 3*4 + 3*4 = 24 bytes
+        position = glGetAttribLocation(self.shaderProgram, "position")
+        glVertexAttribPointer(position, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(position)
+        
+        color = glGetAttribLocation(self.shaderProgram, "color")
+        glVertexAttribPointer(color, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(12))
+        glEnableVertexAttribArray(color)
+
+        # 4x4 model matrix + rgba color per instance => 16*4 + 4*4 = 80 bytes
+        # A mat4 attribute uses 4 consecutive locations, one per column
+        glBindBuffer(GL_ARRAY_BUFFER, instanceBuffer.vbo)
+
+        instanceModel = glGetAttribLocation(self.shaderProgram, "instanceModel")
+        for column in range(4):
+            glVertexAttribPointer(instanceModel + column, 4, GL_FLOAT, GL_FALSE, 80, ctypes.c_void_p(16 * column))
+            glEnableVertexAttribArray(instanceModel + column)
+            glVertexAttribDivisor(instanceModel + column, 1)
+
+        instanceColor = glGetAttribLocation(self.shaderProgram, "instanceColor")
+        glVertexAttribPointer(instanceColor, 4, GL_FLOAT, GL_FALSE, 80, ctypes.c_void_p(64))
+        glEnableVertexAttribArray(instanceColor)
+        glVertexAttribDivisor(instanceColor, 1)
+
+        # Unbinding current vao
+        glBindVertexArray(0)
+
+
+    def drawCall(self, gpuShape, instanceCount, mode=GL_TRIANGLES):
+        assert isinstance(gpuShape, GPUShape)
+
+        # Binding the VAO and executing the draw call
+        glBindVertexArray(gpuShape.vao)
+        glDrawElementsInstancedBaseVertex(mode, gpuShape.size, gpuShape.indexType, gpuShape.indexPointer, instanceCount, gpuShape.baseVertex)
+
+        # Unbind the current VAO
+        glBindVertexArray(0)
@@ -3,7 +3,10 @@
 
 #import OpenGL.GL as ogl
 from OpenGL.GL import *
+import copy
+import ctypes
 import numpy as np
+import grafica.gpu_registry as gr
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
@@ -12,6 +15,75 @@ __license__ = "MIT"
 # 1 byte = 8 bits
 SIZE_IN_BYTES = 4
 
+
+def inferStride(vertexData, pipeline=None):
+    """
+    Floats per vertex, from the rows of the vertices or from the vertex format of the pipeline.
+    It returns None when the stride can not be known.
+    """
+    # Vertices of a bs.Shape have one row per vertex
+    if isinstance(vertexData, np.ndarray) and vertexData.ndim == 2:
+        return vertexData.shape[1]
+
+    vertexFormat = getattr(pipeline, "vertexFormat", None)
+    if vertexFormat is not None:
+        return vertexFormat.floatStride
+
+    return None
+
+
+def computeBounds(vertexData, indices, stride):
+    """
+    Axis aligned bounding box (min, max) of the positions, the first 3 floats of each vertex.
+    It returns None when the bounds can not be known, as when the stride is None.
+    """
+    if len(indices) == 0:
+        return None
+
+    return _positionBounds(np.reshape(vertexData, -1), stride)
+
+
+def _indexData(indices, vertexCount=None):
+    # Indices take 2 bytes each when every vertex can be addressed with them
+    if vertexCount is None:
+        vertexCount = int(np.max(indices)) + 1 if len(indices) > 0 else 0
+
+    if vertexCount <= 65536:
+        return indices.astype(np.uint16), GL_UNSIGNED_SHORT
+    return indices, GL_UNSIGNED_INT
+
+
+def _positionBounds(vertexData, stride):
+    # Bounds of every vertex in vertexData, indexed or not
+    if stride is None or stride < 3 or len(vertexData) < stride:
+        return None
+
+    positions = np.reshape(vertexData[0:len(vertexData) // stride * stride], (-1, stride))[:, 0:3]
+    return np.min(positions, axis=0), np.max(positions, axis=0)
+
+
+
+def memoryReport(namedShapes):
+    """
+    Text table with the GPU memory of each (name, gpuShape) pair,
+    compared with storing float32 vertices and uint32 indices.
+    """
+    lines = [f"{'name':<24} {'bytes':>10} {'float32':>10} {'saved':>10} {'saved %':>8}"]
+    totalBytes = 0
+    totalFloat32Bytes = 0
+
+    for name, gpuShape in namedShapes:
+        saved = gpuShape.float32Bytes - gpuShape.bytes
+        percent = 100.0 * saved / gpuShape.float32Bytes if gpuShape.float32Bytes > 0 else 0.0
+        lines += [f"{str(name):<24} {gpuShape.bytes:>10} {gpuShape.float32Bytes:>10} {saved:>10} {percent:>8.1f}"]
+        totalBytes += gpuShape.bytes
+        totalFloat32Bytes += gpuShape.float32Bytes
+
+    saved = totalFloat32Bytes - totalBytes
+    percent = 100.0 * saved / totalFloat32Bytes if totalFloat32Bytes > 0 else 0.0
+    lines += [f"{'total':<24} {totalBytes:>10} {totalFloat32Bytes:>10} {saved:>10} {percent:>8.1f}"]
+    return "\n".join(lines)
+
 class GPUShape:
     def __init__(self):
         """VAO, VBO, EBO and texture handlers to GPU memory"""
@@ -21,6 +93,27 @@ class GPUShape:
         self.ebo = None
         self.texture = None
         self.size = None
+        self.bounds = None
+
+        # Range of the buffers used by draw calls, see glDrawElementsBaseVertex
+        self.indexType = GL_UNSIGNED_INT
+        self.indexPointer = None
+        self.baseVertex = 0
+
+        # Set by vf.VertexFormat.setupVAO, vertices are converted to it when uploaded
+        self.vertexFormat = None
+
+        # Bytes the shape would take with float32 vertices and uint32 indices
+        self.float32Bytes = 0
+
+        self.stride = None
+        self.usage = None
+        self._vertexBytes = 0
+        self._indexBytes = 0
+        self._ring = None
+
+        # Owners sharing this shape, see retain
+        self._refs = 1
 
     def initBuffers(self):
         """Convenience function for initialization of OpenGL buffers.
@@ -30,42 +123,666 @@ class GPUShape:
         Note: this is not the default constructor as you may want
         to use some already existing buffers.
         """
-        self.vao = glGenVertexArrays(1)
-        self.vbo = glGenBuffers(1)
-        self.ebo = glGenBuffers(1)
+        self.vao = gr.genVertexArray(type(self).__name__)
+        self.vbo = gr.genBuffer(type(self).__name__)
+        self.ebo = gr.genBuffer(type(self).__name__)
+        return self
+
+    def retain(self):
+        """
+        One more owner shares this shape, e.g. a cache or several scene graphs.
+        GPU memory is freed when every owner has called clear.
+        """
+        self._refs += 1
         return self
 
+    def shareBuffers(self):
+        """A new GPUShape drawing the same VAO, vertices and indices, e.g. with another texture"""
+        assert self._ring is None, "Ring buffer shapes can not be shared"
+
+        shape = copy.copy(self)
+        shape.texture = None
+        shape._refs = 1
+        gr.registry.retain(gr.VAO, self.vao)
+        gr.registry.retain(gr.BUFFER, self.vbo)
+        gr.registry.retain(gr.BUFFER, self.ebo)
+        return shape
+
     def __str__(self):
         return "vao=" + str(self.vao) +\
             "  vbo=" + str(self.vbo) +\
             "  ebo=" + str(self.ebo) +\
             "  tex=" + str(self.texture)
 
-    def fillBuffers(self, vertices, indices, usage):
+    @property
+    def bytes(self):
+        """Bytes of GPU memory used by the vertices and indices"""
+        return self._vertexBytes + self._indexBytes
+
+    def _packVertices(self, vertexData):
+        if self.vertexFormat is None:
+            return vertexData
+        return self.vertexFormat.pack(vertexData)
+
+    def fillBuffers(self, vertices, indices, usage, stride=None):
 
         vertexData = np.array(vertices, dtype=np.float32)
-        indices = np.array(indices, dtype=np.uint32)
+        indices = np.array(indices, dtype=np.uint32).reshape(-1)
+
+        # Vertices of a bs.Shape have one row per vertex
+        if vertexData.ndim == 2:
+            stride = vertexData.shape[1] if stride is None else stride
+            vertexData = vertexData.reshape(-1)
+
+        if self.vertexFormat is not None:
+            stride = self.vertexFormat.floatStride
 
         self.size = len(indices)
+        self.stride = stride
+        self.bounds = computeBounds(vertexData, indices, self.stride)
+        self.usage = usage
+        self.float32Bytes = vertexData.nbytes + indices.nbytes
+
+        # Conversion to the formats used on GPU memory.
+        # The width of the indices depends on the vertices in the buffer, not on the largest index
+        vertexData = self._packVertices(vertexData)
+        self._vertexBytes = vertexData.nbytes
+        indices, self.indexType = _indexData(indices, self._vertexCount())
+        self._indexBytes = indices.nbytes
 
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        glBufferData(GL_ARRAY_BUFFER, len(vertexData) * SIZE_IN_BYTES, vertexData, usage)
+        glBufferData(GL_ARRAY_BUFFER, vertexData.nbytes, vertexData, usage)
+        gr.registry.resize(gr.BUFFER, self.vbo, vertexData.nbytes)
 
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER, len(indices) * SIZE_IN_BYTES, indices, usage)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, usage)
+        gr.registry.resize(gr.BUFFER, self.ebo, indices.nbytes)
+
+    def _updateBuffer(self, buffer, data, offset, capacity, orphan):
+        # Returns the new size in bytes of the buffer.
+        # GL_COPY_WRITE_BUFFER does not modify the state of the bound VAO
+        target = GL_COPY_WRITE_BUFFER
+        glBindBuffer(target, buffer)
+        end = offset + data.nbytes
+
+        if orphan or end > capacity:
+            # A new storage is allocated and the old one is released once the GPU stops using it,
+            # so the update does not wait for draw calls still reading the buffer.
+            # Data out of the updated range is only kept when the buffer grows.
+            size = max(end, capacity) if not orphan else end
+            if orphan or offset == 0:
+                glBufferData(target, size, None, self.usage)
+            else:
+                old = np.empty(capacity, dtype=np.uint8)
+                glGetBufferSubData(target, 0, capacity, old)
+                glBufferData(target, size, None, self.usage)
+                glBufferSubData(target, 0, capacity, old)
+            capacity = size
+            gr.registry.resize(gr.BUFFER, buffer, size)
+
+        glBufferSubData(target, offset, data.nbytes, data)
+        glBindBuffer(target, 0)
+        return capacity
+
+    def _vertexCount(self):
+        # Vertices the vertex buffer holds, None if the stride is unknown
+        if self.vertexFormat is not None:
+            return self._vertexBytes // self.vertexFormat.size
+        if self.stride is None:
+            return None
+        return self._vertexBytes // (self.stride * SIZE_IN_BYTES)
+
+    def _widenIndices(self):
+        # The uint16 index buffer is converted to uint32, keeping its indices
+        target = GL_COPY_WRITE_BUFFER
+        glBindBuffer(target, self.ebo)
+        narrow = np.empty(self._indexBytes // 2, dtype=np.uint16)
+        glGetBufferSubData(target, 0, narrow.nbytes, narrow)
+
+        wide = narrow.astype(np.uint32)
+        glBufferData(target, wide.nbytes, wide, self.usage)
+        glBindBuffer(target, 0)
+        gr.registry.resize(gr.BUFFER, self.ebo, wide.nbytes)
+
+        self._indexBytes = wide.nbytes
+        self.indexType = GL_UNSIGNED_INT
+
+    def updateVertices(self, vertices, offset=0, orphan=False):
+        """
+        Writes vertices into the vertex buffer, starting at the float number offset.
+        With orphan=True the whole buffer is replaced by vertices (offset must be 0),
+        allocating a new storage instead of waiting for the GPU to release the old one.
+        The buffer grows if vertices do not fit in it.
+        """
+        assert self._ring is None, "Ring buffer shapes are updated with stream"
+        assert not orphan or offset == 0
+
+        vertexData = np.asarray(vertices, dtype=np.float32).reshape(-1)
+        gpuData = self._packVertices(vertexData)
+        if self.vertexFormat is not None:
+            if self.stride is None:
+                raise ValueError("The stride of the shape is unknown, fillBuffers must be called before updateVertices")
+            assert offset % self.stride == 0, "Packed vertices are updated whole"
+            byteOffset = offset // self.stride * self.vertexFormat.size
+        else:
+            byteOffset = offset * SIZE_IN_BYTES
+
+        replaced = offset == 0 and (orphan or gpuData.nbytes >= self._vertexBytes)
+        self._vertexBytes = self._updateBuffer(self.vbo, gpuData, byteOffset, self._vertexBytes, orphan)
+
+        # Bounds of partial updates are merged with the previous ones, they may only grow
+        bounds = _positionBounds(vertexData, self.stride)
+        if bounds is None or (self.bounds is None and not replaced):
+            self.bounds = None
+        elif not replaced:
+            self.bounds = np.minimum(self.bounds[0], bounds[0]), np.maximum(self.bounds[1], bounds[1])
+        else:
+            self.bounds = bounds
+
+    def updateIndices(self, indices, offset=0, orphan=False):
+        """
+        Writes indices into the index buffer, starting at the index number offset.
+        With orphan=True the whole buffer is replaced by indices (offset must be 0)
+        and only them are drawn. Otherwise the drawn range grows to include them.
+        A uint16 index buffer is widened to uint32 when the indices do not fit in it.
+        """
+        assert self._ring is None, "Ring buffer shapes are updated with stream"
+        assert not orphan or offset == 0
+
+        indices = np.asarray(indices, dtype=np.uint32).reshape(-1)
+        if orphan:
+            indices, self.indexType = _indexData(indices, self._vertexCount())
+        elif self.indexType == GL_UNSIGNED_SHORT:
+            if len(indices) > 0 and np.max(indices) >= 65536:
+                self._widenIndices()
+            else:
+                indices = indices.astype(np.uint16)
+
+        self._indexBytes = self._updateBuffer(self.ebo, indices,
+            offset * indices.itemsize, self._indexBytes, orphan)
+
+        if orphan:
+            self.size = len(indices)
+        else:
+            self.size = max(self.size or 0, offset + len(indices))
+
+    def initRingBuffers(self, stride, maxVertices, maxIndices, regions=3, persistent=True):
+        """
+        Ring buffer mode, for geometry that changes every frame.
+        The buffers are split in regions of maxVertices vertices and maxIndices indices.
+        Each call to stream writes the next region while the GPU may still be drawing
+        the previous ones, so updates never reallocate nor wait for the pipeline.
+        With persistent=True and OpenGL 4.4 (or ARB_buffer_storage) the buffers are mapped
+        once and written directly, otherwise glBufferSubData is used.
+        It must be called after pipeline.setupVAO(gpuShape), instead of fillBuffers.
+        """
+        assert self.vertexFormat is None, "Ring buffers store float32 vertices"
+        self._ring = _Ring(self, stride, maxVertices, maxIndices, regions, persistent and bool(glBufferStorage))
+        self.stride = stride
+        self.size = 0
+        return self
+
+    def stream(self, vertices, indices):
+        """Replaces the geometry of a ring buffer shape, see initRingBuffers"""
+        self._ring.write(self, np.asarray(vertices, dtype=np.float32).reshape(-1),
+                         np.asarray(indices, dtype=np.uint32).reshape(-1))
+
+    def readBuffers(self):
+        """Copies of the vertices and indices stored on GPU memory"""
+
+        # GL_COPY_READ_BUFFER does not modify the state of the bound VAO
+        glBindBuffer(GL_COPY_READ_BUFFER, self.vbo)
+        vertexData = np.empty(glGetBufferParameteriv(GL_COPY_READ_BUFFER, GL_BUFFER_SIZE), dtype=np.uint8)
+        glGetBufferSubData(GL_COPY_READ_BUFFER, 0, vertexData.nbytes, vertexData)
+
+        glBindBuffer(GL_COPY_READ_BUFFER, self.ebo)
+        indices = np.empty(self.size, dtype=np.uint16 if self.indexType == GL_UNSIGNED_SHORT else np.uint32)
+        glGetBufferSubData(GL_COPY_READ_BUFFER, 0, indices.nbytes, indices)
+
+        glBindBuffer(GL_COPY_READ_BUFFER, 0)
+        return self._unpackVertices(vertexData), indices.astype(np.uint32)
+
+    def _unpackVertices(self, data):
+        if self.vertexFormat is None:
+            return data.view(np.float32)
+        return self.vertexFormat.unpack(data)
 
     def clear(self):
-        """Freeing GPU memory"""
+        """Freeing GPU memory, once every owner of the shape has cleared it"""
+
+        if self._refs == 0:
+            gr.registry.reportDoubleFree(type(self).__name__ + " " + str(self))
+            return
+
+        self._refs -= 1
+        if self._refs > 0:
+            return
 
         if self.texture != None:
-            glDeleteTextures(1, [self.texture])
+            gr.deleteTexture(self.texture)
         
         if self.ebo != None:
-            glDeleteBuffers(1, [self.ebo])
+            gr.deleteBuffer(self.ebo)
 
         if self.vbo != None:
-            glDeleteBuffers(1, [self.vbo])
+            gr.deleteBuffer(self.vbo)
 
         if self.vao != None:
-            glDeleteVertexArrays(1, [self.vao])
-        
\ No newline at end of file
+            gr.deleteVertexArray(self.vao)
+
+        if self._ring is not None:
+            self._ring.clear()
+            self._ring = None
+        
+
+class ShapeView(GPUShape):
+    """
+    The vertices and indices of another GPUShape, drawn with a VAO of its own.
+    It always draws the current range of the source shape, even if it is moved.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.vao = gr.genVertexArray(type(self).__name__)
+        self.vbo = source.vbo
+        self.ebo = source.ebo
+        self.texture = source.texture
+        self.stride = source.stride
+        self.vertexFormat = source.vertexFormat
+
+        # The range of the buffers is the one of the source, the GPUShape
+        # initializer can not be used as it assigns it
+        self.usage = source.usage
+        self.float32Bytes = 0
+        self._vertexBytes = 0
+        self._indexBytes = 0
+        self._ring = None
+        self._refs = 1
+
+    @property
+    def bytes(self):
+        """The buffers belong to the source shape, only the VAO is owned by the view"""
+        return 0
+
+    size = property(lambda self: self.source.size)
+    indexType = property(lambda self: self.source.indexType)
+    indexPointer = property(lambda self: self.source.indexPointer)
+    baseVertex = property(lambda self: self.source.baseVertex)
+    bounds = property(lambda self: self.source.bounds)
+
+    def readBuffers(self):
+        return self.source.readBuffers()
+
+    def clear(self):
+        """Freeing GPU memory. The source shape must be cleared by its owner"""
+        if self._refs == 0:
+            gr.registry.reportDoubleFree(type(self).__name__ + " " + str(self))
+            return
+
+        self._refs = 0
+        gr.deleteVertexArray(self.vao)
+
+
+class ArenaShape(GPUShape):
+    """A shape stored in a range of the buffers of a BufferArena"""
+
+    def __init__(self, arena, vertexStart, vertexCount, indexStart, indexCount):
+        super().__init__()
+        self.arena = arena
+        self.vao = arena.storage.vao
+        self.vbo = arena.storage.vbo
+        self.ebo = arena.storage.ebo
+        self.stride = arena.stride
+        self.usage = arena.usage
+        self.vertexFormat = arena.vertexFormat
+        self.vertexCount = vertexCount
+        self.size = indexCount
+        self._place(vertexStart, indexStart)
+
+    def _place(self, vertexStart, indexStart):
+        # Indices are relative to the first vertex of the shape
+        self.vertexStart = vertexStart
+        self.indexStart = indexStart
+        self.baseVertex = vertexStart
+        self.indexPointer = ctypes.c_void_p(indexStart * SIZE_IN_BYTES) if indexStart > 0 else None
+
+    def fillBuffers(self, vertices, indices, usage, stride=None):
+        assert False, "Arena shapes are filled by BufferArena.add"
+
+    def updateVertices(self, vertices, offset=0, orphan=False):
+        assert False, "Arena shapes can not be updated, add a new one and clear this one"
+
+    def updateIndices(self, indices, offset=0, orphan=False):
+        assert False, "Arena shapes can not be updated, add a new one and clear this one"
+
+    def readBuffers(self):
+        """Copies of the vertices and indices of this shape, indices start at 0"""
+
+        glBindBuffer(GL_COPY_READ_BUFFER, self.vbo)
+        vertexData = np.empty(self.vertexCount * self.arena.vertexSize, dtype=np.uint8)
+        glGetBufferSubData(GL_COPY_READ_BUFFER, self.vertexStart * self.arena.vertexSize, vertexData.nbytes, vertexData)
+
+        glBindBuffer(GL_COPY_READ_BUFFER, self.ebo)
+        indices = np.empty(self.size, dtype=np.uint32)
+        glGetBufferSubData(GL_COPY_READ_BUFFER, self.indexStart * SIZE_IN_BYTES, indices.nbytes, indices)
+
+        glBindBuffer(GL_COPY_READ_BUFFER, 0)
+        return self._unpackVertices(vertexData), indices
+
+    def clear(self):
+        """Freeing its range of the arena and its texture, once every owner has cleared it"""
+
+        if self._refs == 0:
+            gr.registry.reportDoubleFree(type(self).__name__ + " " + str(self))
+            return
+
+        self._refs -= 1
+        if self._refs > 0:
+            return
+
+        if self.texture != None:
+            gr.deleteTexture(self.texture)
+            self.texture = None
+
+        if self.arena is not None:
+            self.arena.free(self)
+            self.arena = None
+
+
+def _copyRanges(buffer, ranges, capacity, usage):
+    # Moves (source, destination, size) byte ranges of a buffer, through a temporary one.
+    # If capacity is given, the buffer is allocated again with that size.
+    temporary = glGenBuffers(1)
+    size = sum(count for source, destination, count in ranges)
+
+    glBindBuffer(GL_COPY_READ_BUFFER, buffer)
+    glBindBuffer(GL_COPY_WRITE_BUFFER, temporary)
+    glBufferData(GL_COPY_WRITE_BUFFER, max(size, 1), None, GL_STREAM_COPY)
+
+    offset = 0
+    for source, destination, count in ranges:
+        glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, source, offset, count)
+        offset += count
+
+    glBindBuffer(GL_COPY_READ_BUFFER, temporary)
+    glBindBuffer(GL_COPY_WRITE_BUFFER, buffer)
+    if capacity is not None:
+        glBufferData(GL_COPY_WRITE_BUFFER, capacity, None, usage)
+
+    offset = 0
+    for source, destination, count in ranges:
+        glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, offset, destination, count)
+        offset += count
+
+    glBindBuffer(GL_COPY_READ_BUFFER, 0)
+    glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+    glDeleteBuffers(1, [temporary])
+
+
+class BufferArena:
+    """
+    Many shapes with the same vertex layout packed in one VBO and one EBO,
+    drawn from a single VAO with glDrawElementsBaseVertex.
+    Shapes are added at the end of the used range, and the buffers double their
+    size when they are full. Ranges of cleared shapes are recovered by defragment,
+    which runs by itself when more than maxWaste of the used range is free.
+    Vertices are stored in the vertex format of the pipeline, if it has one.
+    Indices are always uint32, as the index buffer is shared.
+    """
+
+    def __init__(self, pipeline, stride, vertexCapacity=4096, indexCapacity=16384, usage=GL_STATIC_DRAW, maxWaste=0.5):
+        self.stride = stride
+        self.usage = usage
+        self.maxWaste = maxWaste
+
+        # Capacities and used ranges are counted in vertices and indices
+        self.vertexCapacity = vertexCapacity
+        self.indexCapacity = indexCapacity
+        self.vertexEnd = 0
+        self.indexEnd = 0
+        self.shapes = []
+
+        self.storage = GPUShape().initBuffers()
+        pipeline.setupVAO(self.storage)
+
+        # Bytes per vertex on GPU memory
+        self.vertexFormat = self.storage.vertexFormat
+        if self.vertexFormat is not None:
+            assert self.vertexFormat.floatStride == stride, "The stride does not match the vertex format of the pipeline"
+            self.vertexSize = self.vertexFormat.size
+        else:
+            self.vertexSize = stride * SIZE_IN_BYTES
+
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.storage.vbo)
+        glBufferData(GL_COPY_WRITE_BUFFER, vertexCapacity * self.vertexSize, None, usage)
+        gr.registry.resize(gr.BUFFER, self.storage.vbo, vertexCapacity * self.vertexSize)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.storage.ebo)
+        glBufferData(GL_COPY_WRITE_BUFFER, indexCapacity * SIZE_IN_BYTES, None, usage)
+        gr.registry.resize(gr.BUFFER, self.storage.ebo, indexCapacity * SIZE_IN_BYTES)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+
+    def add(self, vertices, indices):
+        """Copies a shape into the arena, returning its ArenaShape"""
+
+        vertexData = np.asarray(vertices, dtype=np.float32).reshape(-1)
+        indices = np.asarray(indices, dtype=np.uint32).reshape(-1)
+        assert len(vertexData) % self.stride == 0, "Vertices do not match the stride of the arena"
+        vertexCount = len(vertexData) // self.stride
+
+        self._reserve(self.vertexEnd + vertexCount, self.indexEnd + len(indices))
+
+        shape = ArenaShape(self, self.vertexEnd, vertexCount, self.indexEnd, len(indices))
+        shape.bounds = computeBounds(vertexData, indices, self.stride)
+        shape.float32Bytes = vertexData.nbytes + indices.nbytes
+
+        gpuData = shape._packVertices(vertexData)
+        shape._vertexBytes = gpuData.nbytes
+        shape._indexBytes = indices.nbytes
+
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.storage.vbo)
+        glBufferSubData(GL_COPY_WRITE_BUFFER, shape.vertexStart * self.vertexSize, gpuData.nbytes, gpuData)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.storage.ebo)
+        glBufferSubData(GL_COPY_WRITE_BUFFER, shape.indexStart * SIZE_IN_BYTES, indices.nbytes, indices)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+
+        self.vertexEnd += vertexCount
+        self.indexEnd += len(indices)
+        self.shapes += [shape]
+        return shape
+
+    def _reserve(self, vertexCount, indexCount):
+        # Buffers grow keeping their content, the VAO still refers to the same buffers
+        if vertexCount > self.vertexCapacity:
+            self.vertexCapacity = max(vertexCount, 2 * self.vertexCapacity)
+            size = self.vertexEnd * self.vertexSize
+            _copyRanges(self.storage.vbo, [(0, 0, size)] if size > 0 else [],
+                        self.vertexCapacity * self.vertexSize, self.usage)
+            gr.registry.resize(gr.BUFFER, self.storage.vbo, self.vertexCapacity * self.vertexSize)
+
+        if indexCount > self.indexCapacity:
+            self.indexCapacity = max(indexCount, 2 * self.indexCapacity)
+            size = self.indexEnd * SIZE_IN_BYTES
+            _copyRanges(self.storage.ebo, [(0, 0, size)] if size > 0 else [],
+                        self.indexCapacity * SIZE_IN_BYTES, self.usage)
+            gr.registry.resize(gr.BUFFER, self.storage.ebo, self.indexCapacity * SIZE_IN_BYTES)
+
+    def free(self, shape):
+        self.shapes.remove(shape)
+
+        if len(self.shapes) == 0:
+            self.vertexEnd = 0
+            self.indexEnd = 0
+        elif self.wastedVertices() > self.maxWaste * self.vertexEnd or self.wastedIndices() > self.maxWaste * self.indexEnd:
+            self.defragment()
+
+    def wastedVertices(self):
+        return self.vertexEnd - sum(shape.vertexCount for shape in self.shapes)
+
+    def wastedIndices(self):
+        return self.indexEnd - sum(shape.size for shape in self.shapes)
+
+    def defragment(self):
+        """Moves every shape to the start of the buffers, leaving no free ranges between them"""
+
+        vertexSize = self.vertexSize
+        vertexRanges = []
+        indexRanges = []
+        vertexEnd = 0
+        indexEnd = 0
+
+        # Shapes are added at the end, so they are sorted by position
+        for shape in self.shapes:
+            vertexRanges += [(shape.vertexStart * vertexSize, vertexEnd * vertexSize, shape.vertexCount * vertexSize)]
+            indexRanges += [(shape.indexStart * SIZE_IN_BYTES, indexEnd * SIZE_IN_BYTES, shape.size * SIZE_IN_BYTES)]
+            shape._place(vertexEnd, indexEnd)
+            vertexEnd += shape.vertexCount
+            indexEnd += shape.size
+
+        if vertexEnd > 0:
+            _copyRanges(self.storage.vbo, vertexRanges, None, self.usage)
+        if indexEnd > 0:
+            _copyRanges(self.storage.ebo, indexRanges, None, self.usage)
+
+        self.vertexEnd = vertexEnd
+        self.indexEnd = indexEnd
+
+    def clear(self):
+        """Freeing GPU memory of every shape in the arena"""
+
+        for shape in list(self.shapes):
+            shape.arena = None
+        self.shapes = []
+        self.storage.clear()
+
+
+class _Ring:
+    """Regions of the buffers of a GPUShape in ring buffer mode"""
+
+    def __init__(self, gpuShape, stride, maxVertices, maxIndices, regions, persistent):
+        self.stride = stride
+        self.maxVertices = maxVertices
+        self.maxIndices = maxIndices
+        self.regions = regions
+        self.persistent = persistent
+        self.current = -1
+        self.fences = [None] * regions
+
+        vertexBytes = regions * maxVertices * stride * SIZE_IN_BYTES
+        indexBytes = regions * maxIndices * SIZE_IN_BYTES
+
+        if persistent:
+            flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+            self.vertices = self._mapStorage(gpuShape.vbo, vertexBytes, flags, ctypes.c_float)
+            self.indices = self._mapStorage(gpuShape.ebo, indexBytes, flags, ctypes.c_uint32)
+        else:
+            glBindBuffer(GL_COPY_WRITE_BUFFER, gpuShape.vbo)
+            glBufferData(GL_COPY_WRITE_BUFFER, vertexBytes, None, GL_STREAM_DRAW)
+            glBindBuffer(GL_COPY_WRITE_BUFFER, gpuShape.ebo)
+            glBufferData(GL_COPY_WRITE_BUFFER, indexBytes, None, GL_STREAM_DRAW)
+            glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+
+        gr.registry.resize(gr.BUFFER, gpuShape.vbo, vertexBytes)
+        gr.registry.resize(gr.BUFFER, gpuShape.ebo, indexBytes)
+
+    def _mapStorage(self, buffer, size, flags, ctype):
+        # Immutable storage, mapped once for the whole life of the buffer
+        glBindBuffer(GL_COPY_WRITE_BUFFER, buffer)
+        glBufferStorage(GL_COPY_WRITE_BUFFER, size, None, flags)
+        pointer = glMapBufferRange(GL_COPY_WRITE_BUFFER, 0, size, flags)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        address = pointer.value if isinstance(pointer, ctypes.c_void_p) else pointer
+        return np.ctypeslib.as_array(ctypes.cast(address, ctypes.POINTER(ctype)), shape=(size // SIZE_IN_BYTES,))
+
+    def _wait(self, region):
+        # The GPU may still be drawing the data written the last time this region was used
+        fence = self.fences[region]
+        if fence is None:
+            return
+
+        while glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1000000) == GL_TIMEOUT_EXPIRED:
+            pass
+        glDeleteSync(fence)
+        self.fences[region] = None
+
+    def write(self, gpuShape, vertexData, indices):
+        assert len(vertexData) <= self.maxVertices * self.stride
+        assert len(indices) <= self.maxIndices
+
+        # Draw calls of the current region were issued before this update
+        if self.persistent and self.current >= 0:
+            self.fences[self.current] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+        self.current = (self.current + 1) % self.regions
+        vertexStart = self.current * self.maxVertices * self.stride
+        indexStart = self.current * self.maxIndices
+
+        if self.persistent:
+            self._wait(self.current)
+            self.vertices[vertexStart:vertexStart + len(vertexData)] = vertexData
+            self.indices[indexStart:indexStart + len(indices)] = indices
+        else:
+            glBindBuffer(GL_COPY_WRITE_BUFFER, gpuShape.vbo)
+            glBufferSubData(GL_COPY_WRITE_BUFFER, vertexStart * SIZE_IN_BYTES, vertexData.nbytes, vertexData)
+            glBindBuffer(GL_COPY_WRITE_BUFFER, gpuShape.ebo)
+            glBufferSubData(GL_COPY_WRITE_BUFFER, indexStart * SIZE_IN_BYTES, indices.nbytes, indices)
+            glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+
+        # Indices are relative to the region, draw calls add its first vertex
+        gpuShape.size = len(indices)
+        gpuShape.indexPointer = ctypes.c_void_p(indexStart * SIZE_IN_BYTES)
+        gpuShape.baseVertex = self.current * self.maxVertices
+        gpuShape.bounds = _positionBounds(vertexData, self.stride)
+
+    def clear(self):
+        for region in range(self.regions):
+            if self.fences[region] is not None:
+                glDeleteSync(self.fences[region])
+        self.fences = [None] * self.regions
+
+class InstanceBuffer:
+    """
+    Per instance data to draw several copies of a GPUShape with a single draw call.
+    Each instance has a model matrix and a color (rgba), interleaved in one buffer.
+    """
+
+    def __init__(self, count):
+        self.vbo = gr.genBuffer(type(self).__name__)
+        self.count = 0
+        self._resize(count)
+
+    def _resize(self, count):
+        self.count = count
+        self.models = np.tile(np.identity(4, dtype=np.float32), (count, 1, 1))
+        self.colors = np.ones((count, 4), dtype=np.float32)
+
+        # For each instance: 4 columns of the model matrix + 1 color => 5 * 4 floats = 80 bytes
+        self.data = np.zeros((count, 5, 4), dtype=np.float32)
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, self.data.nbytes, None, GL_STREAM_DRAW)
+        gr.registry.resize(gr.BUFFER, self.vbo, self.data.nbytes)
+
+    def update(self, models=None, colors=None):
+        """Sends the instance data to the GPU memory, reusing the same buffer"""
+
+        if models is not None:
+            if len(models) != self.count:
+                self._resize(len(models))
+            self.models[:] = models
+
+        if colors is not None:
+            self.colors[:] = colors
+
+        # OpenGL reads each row of a mat4 attribute as a column of the matrix
+        self.data[:, 0:4, :] = np.transpose(self.models, (0, 2, 1))
+        self.data[:, 4, :] = self.colors
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, self.data.nbytes, self.data)
+
+    def clear(self):
+        """Freeing GPU memory"""
+
+        if self.vbo != None:
+            gr.deleteBuffer(self.vbo)
+            self.vbo = None
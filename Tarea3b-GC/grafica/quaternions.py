@@ -0,0 +1,161 @@
+# coding=utf-8
+"""
+Quaternions and a translation-rotation-scale transform built on them.
+
+Quaternions are stored as (x, y, z, w). Every function also accepts
+arrays of quaternions with shape (N,4), working on all of them at once.
+"""
+
+import numpy as np
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+
+def identity():
+    return np.array([0, 0, 0, 1], dtype=np.float32)
+
+
+def axisAngle(axis, theta):
+    """Rotation of theta radians around a unit axis"""
+    axis = np.asarray(axis, dtype=np.float32)
+    halfTheta = np.asarray(theta, dtype=np.float32)[..., np.newaxis] / 2
+    return np.concatenate([axis * np.sin(halfTheta), np.cos(halfTheta)], axis=-1)
+
+
+def multiply(q1, q2):
+    """Rotation q2 followed by rotation q1, as the matrix product q1 * q2"""
+    x1, y1, z1, w1 = np.moveaxis(np.asarray(q1, dtype=np.float32), -1, 0)
+    x2, y2, z2, w2 = np.moveaxis(np.asarray(q2, dtype=np.float32), -1, 0)
+    return np.stack([
+        w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+        w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+        w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+        w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2], axis=-1)
+
+
+def normalize(q):
+    q = np.asarray(q, dtype=np.float32)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def lerp(a, b, t):
+    """Linear interpolation, for translations and scales"""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    t = np.asarray(t, dtype=np.float32)[..., np.newaxis]
+    return a + (b - a) * t
+
+
+def slerp(q1, q2, t):
+    """Spherical linear interpolation between unit quaternions, through the shortest path"""
+    q1 = np.asarray(q1, dtype=np.float32)
+    q2 = np.asarray(q2, dtype=np.float32)
+    t = np.asarray(t, dtype=np.float32)[..., np.newaxis]
+
+    # q and -q are the same rotation, the closest one is used
+    cosTheta = np.sum(q1 * q2, axis=-1, keepdims=True)
+    q2 = np.where(cosTheta < 0, -q2, q2)
+    cosTheta = np.abs(cosTheta)
+
+    # Almost equal rotations are interpolated linearly, avoiding a division by zero
+    theta = np.arccos(np.clip(cosTheta, -1, 1))
+    sinTheta = np.sin(theta)
+    close = sinTheta < 1e-4
+    safeSinTheta = np.where(close, 1, sinTheta)
+
+    w1 = np.where(close, 1 - t, np.sin((1 - t) * theta) / safeSinTheta)
+    w2 = np.where(close, t, np.sin(t * theta) / safeSinTheta)
+    return normalize(w1 * q1 + w2 * q2)
+
+
+def toMatrix(q, translation=(0, 0, 0), scale=(1, 1, 1)):
+    """
+    Matrices translate * rotation * scale, with shape (4,4) or (N,4,4)
+    """
+    x, y, z, w = np.moveaxis(np.asarray(q, dtype=np.float32), -1, 0)
+    translation = np.asarray(translation, dtype=np.float32)
+    scale = np.asarray(scale, dtype=np.float32)
+
+    shape = np.broadcast(x, translation[..., 0], scale[..., 0]).shape
+    out = np.zeros(shape + (4, 4), dtype=np.float32)
+
+    out[..., 0, 0] = (1 - 2 * (y * y + z * z)) * scale[..., 0]
+    out[..., 1, 0] = 2 * (x * y + z * w) * scale[..., 0]
+    out[..., 2, 0] = 2 * (x * z - y * w) * scale[..., 0]
+
+    out[..., 0, 1] = 2 * (x * y - z * w) * scale[..., 1]
+    out[..., 1, 1] = (1 - 2 * (x * x + z * z)) * scale[..., 1]
+    out[..., 2, 1] = 2 * (y * z + x * w) * scale[..., 1]
+
+    out[..., 0, 2] = 2 * (x * z + y * w) * scale[..., 2]
+    out[..., 1, 2] = 2 * (y * z - x * w) * scale[..., 2]
+    out[..., 2, 2] = (1 - 2 * (x * x + y * y)) * scale[..., 2]
+
+    out[..., 0:3, 3] = translation
+    out[..., 3, 3] = 1
+    return out
+
+
+class Transform:
+    """
+    A translation, a rotation (quaternion) and a scale.
+    Its 4x4 matrix is computed when it is requested, and kept until a component changes.
+    """
+
+    def __init__(self, translation=(0, 0, 0), rotation=(0, 0, 0, 1), scale=(1, 1, 1)):
+        self._matrix = None
+        self.translation = translation
+        self.rotation = rotation
+        self.scale = scale
+
+    @property
+    def translation(self):
+        return self._translation
+
+    @translation.setter
+    def translation(self, translation):
+        self._translation = np.array(translation, dtype=np.float32)
+        self._matrix = None
+
+    @property
+    def rotation(self):
+        return self._rotation
+
+    @rotation.setter
+    def rotation(self, rotation):
+        self._rotation = np.array(rotation, dtype=np.float32)
+        self._matrix = None
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, scale):
+        self._scale = np.array(scale, dtype=np.float32)
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = toMatrix(self._rotation, self._translation, self._scale)
+        return self._matrix
+
+    def interpolate(self, other, t):
+        """Transform between this one (t=0) and other (t=1)"""
+        return Transform(
+            lerp(self._translation, other.translation, t),
+            slerp(self._rotation, other.rotation, t),
+            lerp(self._scale, other.scale, t))
+
+
+def interpolate(translations1, rotations1, scales1, translations2, rotations2, scales2, t):
+    """
+    Matrices of many transforms, each one interpolated between two poses.
+    Arrays have shape (N,3) or (N,4) for rotations, t is a number or has shape (N,).
+    """
+    return toMatrix(
+        slerp(rotations1, rotations2, t),
+        lerp(translations1, translations2, t),
+        lerp(scales1, scales2, t))
@@ -0,0 +1,96 @@
+# coding=utf-8
+"""Uniform buffer objects shared by all the lighting shader programs"""
+
+from OpenGL.GL import *
+import numpy as np
+import grafica.gpu_registry as gr
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+# Binding points of the uniform blocks.
+# Every shader program declaring one of these blocks is connected
+# to its binding point when it is built (see es.ShaderProgram.initUniforms)
+CAMERA_BINDING = 0
+LIGHTS_BINDING = 1
+
+BLOCK_BINDINGS = {
+    "Camera": CAMERA_BINDING,
+    "Lights": LIGHTS_BINDING
+}
+
+# We will use 32 bits data, so we have 4 bytes
+# 1 byte = 8 bits
+SIZE_IN_BYTES = 4
+
+
+class UniformBuffer:
+    """
+    A block of uniforms stored on GPU memory.
+    Values are written on self.data and sent to the GPU with a single call to update.
+    """
+
+    def __init__(self, binding, sizeInBytes):
+        self.binding = binding
+        self.data = np.zeros(sizeInBytes // SIZE_IN_BYTES, dtype=np.float32)
+
+        self.ubo = gr.genBuffer(type(self).__name__)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, None, GL_DYNAMIC_DRAW)
+        gr.registry.resize(gr.BUFFER, self.ubo, self.data.nbytes)
+        glBindBufferBase(GL_UNIFORM_BUFFER, binding, self.ubo)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def upload(self):
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def clear(self):
+        """Freeing GPU memory"""
+
+        gr.deleteBuffer(self.ubo)
+
+
+class CameraBuffer(UniformBuffer):
+    """
+    std140 layout of the Camera block, declared as row_major so numpy matrices are copied as they are:
+        mat4 projection;    // offset 0
+        mat4 view;          // offset 64
+        vec3 viewPosition;  // offset 128
+    """
+
+    def __init__(self):
+        super().__init__(CAMERA_BINDING, 144)
+
+    def update(self, projection, view, viewPosition):
+        self.data[0:16] = np.reshape(projection, 16)
+        self.data[16:32] = np.reshape(view, 16)
+        self.data[32:35] = viewPosition
+        self.upload()
+
+
+class LightsBuffer(UniformBuffer):
+    """
+    std140 layout of the Lights block:
+        vec3 lightPosition;          // offset 0
+        vec3 La;                     // offset 16
+        vec3 Ld;                     // offset 32
+        vec3 Ls;                     // offset 48
+        float constantAttenuation;   // offset 60
+        float linearAttenuation;     // offset 64
+        float quadraticAttenuation;  // offset 68
+    """
+
+    def __init__(self):
+        super().__init__(LIGHTS_BINDING, 80)
+
+    def update(self, lightPosition, La, Ld, Ls, constantAttenuation, linearAttenuation, quadraticAttenuation):
+        self.data[0:3] = lightPosition
+        self.data[4:7] = La
+        self.data[8:11] = Ld
+        self.data[12:15] = Ls
+        self.data[15] = constantAttenuation
+        self.data[16] = linearAttenuation
+        self.data[17] = quadraticAttenuation
+        self.upload()
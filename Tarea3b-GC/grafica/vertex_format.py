@@ -0,0 +1,184 @@
+# coding=utf-8
+"""
+Compact vertex formats.
+
+Shapes are still built with float32 vertices, and they are converted
+to the format of the pipeline when they are uploaded to GPU memory.
+A pipeline uses a format when pipeline.vertexFormat is set, before
+calling pipeline.setupVAO(gpuShape) and gpuShape.fillBuffers(...).
+"""
+
+from OpenGL.GL import *
+import numpy as np
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+# Kinds of attributes
+FLOAT = "float"         # float32 per component
+HALF = "half"           # float16 per component, e.g. texture coordinates
+UNORM8 = "unorm8"       # uint8 per component, mapping [0, 1], e.g. colors
+SNORM_2_10_10_10 = "snorm_2_10_10_10"  # xyz in 10 bits each, mapping [-1, 1], e.g. normals
+
+
+def _align(size):
+    # Every attribute starts at a multiple of 4 bytes
+    return (size + 3) // 4 * 4
+
+
+class Attribute:
+    def __init__(self, name, components, kind=FLOAT):
+        self.name = name
+        self.components = components
+        self.kind = kind
+
+        if kind == FLOAT:
+            self.size = 4 * components
+        elif kind == HALF:
+            self.size = _align(2 * components)
+        elif kind == UNORM8:
+            self.size = _align(components)
+        elif kind == SNORM_2_10_10_10:
+            assert components == 3, "Packed attributes have 3 components"
+            self.size = 4
+        else:
+            assert False, "Unknown attribute kind: " + str(kind)
+
+    def pack(self, values):
+        """Bytes of the attribute of every vertex, values have shape (N, components)"""
+
+        if self.kind == FLOAT:
+            data = values.astype(np.float32)
+
+        elif self.kind == HALF:
+            data = values.astype(np.float16)
+
+        elif self.kind == UNORM8:
+            data = np.round(np.clip(values, 0, 1) * 255).astype(np.uint8)
+
+        else:
+            # Normals are stored with unit length, shaders normalize them anyway
+            lengths = np.linalg.norm(values, axis=1, keepdims=True)
+            lengths[lengths == 0] = 1
+            bits = np.round(np.clip(values / lengths, -1, 1) * 511).astype(np.int32) & 0x3FF
+            data = (bits[:, 0] | (bits[:, 1] << 10) | (bits[:, 2] << 20)).astype(np.uint32)
+
+        data = np.ascontiguousarray(data).view(np.uint8).reshape(len(values), -1)
+        padding = self.size - data.shape[1]
+        if padding > 0:
+            data = np.pad(data, ((0, 0), (0, padding)))
+        return data
+
+    def unpack(self, data):
+        """Inverse of pack, data has shape (N, size) of uint8"""
+
+        data = np.ascontiguousarray(data)
+
+        if self.kind == FLOAT:
+            return data.view(np.float32)[:, 0:self.components]
+
+        if self.kind == HALF:
+            return data.view(np.float16)[:, 0:self.components].astype(np.float32)
+
+        if self.kind == UNORM8:
+            return data[:, 0:self.components].astype(np.float32) / 255
+
+        packed = data.view(np.uint32)[:, 0]
+        values = np.stack([(packed >> 0) & 0x3FF, (packed >> 10) & 0x3FF, (packed >> 20) & 0x3FF], axis=1).astype(np.int32)
+        values[values >= 512] -= 1024
+        return np.maximum(values / 511, -1).astype(np.float32)
+
+    def setupPointer(self, location, stride, offset):
+        if self.kind == FLOAT:
+            glVertexAttribPointer(location, self.components, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(offset))
+        elif self.kind == HALF:
+            glVertexAttribPointer(location, self.components, GL_HALF_FLOAT, GL_FALSE, stride, ctypes.c_void_p(offset))
+        elif self.kind == UNORM8:
+            glVertexAttribPointer(location, self.components, GL_UNSIGNED_BYTE, GL_TRUE, stride, ctypes.c_void_p(offset))
+        else:
+            # The fourth component (2 bits) is ignored by vec3 attributes
+            glVertexAttribPointer(location, 4, GL_INT_2_10_10_10_REV, GL_TRUE, stride, ctypes.c_void_p(offset))
+
+
+class VertexFormat:
+    """
+    Layout of the vertices on GPU memory.
+    Attributes are given in the same order as the floats of each vertex of the shapes.
+    """
+
+    def __init__(self, *attributes):
+        self.attributes = attributes
+
+        # Floats per vertex of the shapes, and bytes per vertex on GPU memory
+        self.floatStride = sum(attribute.components for attribute in attributes)
+        self.size = sum(attribute.size for attribute in attributes)
+
+    def pack(self, vertexData):
+        """Bytes of the vertices, vertexData has floatStride floats per vertex"""
+
+        vertices = np.reshape(np.asarray(vertexData, dtype=np.float32), (-1, self.floatStride))
+        columns = []
+        start = 0
+        for attribute in self.attributes:
+            columns += [attribute.pack(vertices[:, start:start + attribute.components])]
+            start += attribute.components
+
+        return np.ascontiguousarray(np.concatenate(columns, axis=1)).reshape(-1)
+
+    def unpack(self, data):
+        """float32 vertices with floatStride floats per vertex, from the bytes given by pack"""
+
+        data = np.reshape(np.asarray(data, dtype=np.uint8), (-1, self.size))
+        columns = []
+        start = 0
+        for attribute in self.attributes:
+            columns += [attribute.unpack(data[:, start:start + attribute.size])]
+            start += attribute.size
+
+        return np.concatenate(columns, axis=1).reshape(-1)
+
+    def setupVAO(self, pipeline, gpuShape):
+        """Same as pipeline.setupVAO, using this format"""
+
+        glBindVertexArray(gpuShape.vao)
+
+        glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, gpuShape.ebo)
+
+        offset = 0
+        for attribute in self.attributes:
+            location = glGetAttribLocation(pipeline.shaderProgram, attribute.name)
+            if location != -1:
+                attribute.setupPointer(location, self.size, offset)
+                glEnableVertexAttribArray(location)
+            offset += attribute.size
+
+        # Unbinding current vao
+        glBindVertexArray(0)
+
+        # Vertices are converted to this format when they are uploaded
+        gpuShape.vertexFormat = self
+
+
+# Compact versions of the layouts used by the pipelines
+# 3d vertices + rgb color => 12 + 4 = 16 bytes, instead of 24
+COLOR_COMPACT = VertexFormat(
+    Attribute("position", 3),
+    Attribute("color", 3, UNORM8))
+
+# 3d vertices + texture coordinates => 12 + 4 = 16 bytes, instead of 20
+TEXTURE_COMPACT = VertexFormat(
+    Attribute("position", 3),
+    Attribute("texCoords", 2, HALF))
+
+# 3d vertices + rgb color + 3d normals => 12 + 4 + 4 = 20 bytes, instead of 36
+COLOR_NORMAL_COMPACT = VertexFormat(
+    Attribute("position", 3),
+    Attribute("color", 3, UNORM8),
+    Attribute("normal", 3, SNORM_2_10_10_10))
+
+# 3d vertices + texture coordinates + 3d normals => 12 + 4 + 4 = 20 bytes, instead of 32
+TEXTURE_NORMAL_COMPACT = VertexFormat(
+    Attribute("position", 3),
+    Attribute("texCoords", 2, HALF),
+    Attribute("normal", 3, SNORM_2_10_10_10))
@@ -12,6 +12,12 @@ import grafica.easy_shaders as es
 import grafica.performance_monitor as pm
 import grafica.lighting_shaders as ls
 import grafica.scene_graph as sg
+import grafica.mesh_optimizer as mo
+import grafica.scene_profiler as sp
+import grafica.uniform_buffer as ub
+import grafica.vertex_format as vf
+import grafica.gpu_registry as gr
+import grafica.shape_cache as sc
 from shapes3d import *
 from grafica.gpu_shape import GPUShape
 import openmesh as om
@@ -25,6 +31,9 @@ from imgui.integrations.glfw import GlfwRenderer
 LIGHT_CEL_SHADING = 0
 LIGHT_PHONG = 1
 
+# Con DEBUG = True se imprimen al iniciar los reportes de memoria, del cache y de las mallas
+DEBUG = False
+
 # Funciones del repositiorio del curso
 
 def rotate2D(vector, theta):
@@ -150,7 +159,7 @@ def readOBJ(filename, color):
             indices += [index, index + 1, index + 2]
             index += 3        
 
-        return bs.Shape(vertexData, indices)
+        return bs.Shape(vertexData, indices, stride=9)
 
 class PolarCamera:
     def __init__(self, aCurve):
@@ -164,6 +173,8 @@ class PolarCamera:
         self.curve = aCurve
         self.pos = [0,0,0]
         self.index = 0
+        # Matrices de vista de cada punto de la curva, calculadas una sola vez
+        self.autoviews = tr.lookAtBatch(self.curve, np.array([0.0, 0.0, -1.0]), self.up)
 
     def set_theta(self, delta):
         self.theta = (self.theta + delta) % (np.pi * 2)
@@ -210,12 +221,7 @@ class PolarCamera:
         self.eye[0] = self.pos[0]
         self.eye[1] = self.pos[1]
         self.eye[2] = self.pos[2]
-        viewMatrix = tr.lookAt(
-            self.eye,
-            np.array([0.0, 0.0, -1.0]),
-            self.up
-        )
-        return viewMatrix
+        return self.autoviews[self.index]
 
 class Controller:
     def __init__(self, cameraCurve):
@@ -243,6 +249,8 @@ class Controller:
 
         self.hit = False
 
+        self.profiling = False
+
     def get_camera(self):
         return self.polar_camera
 
@@ -276,6 +284,10 @@ class Controller:
             if action == glfw.PRESS:
                 self.fillPolygon = not self.fillPolygon
 
+        if key == glfw.KEY_P:
+            if action == glfw.PRESS:
+                self.profiling = not self.profiling
+
         if key == glfw.KEY_ESCAPE:
             if action == glfw.PRESS:
                 glfw.set_window_should_close(window, True)
@@ -418,9 +430,19 @@ if __name__ == "__main__":
     CSphongTexPipeline = sh.CelShadingTexturePhongShaderProgram()
     CSspotlightPipeline = sh.CelShadingSpotLight()
 
+    # Las figuras de estos pipelines se guardan con vertices compactos:
+    # colores de 8 bits, normales empaquetadas en 32 bits y coordenadas de textura de 16 bits
+    phongPipeline.vertexFormat = vf.COLOR_NORMAL_COMPACT
+    phongTexPipeline.vertexFormat = vf.TEXTURE_NORMAL_COMPACT
+
+    # Camera and lights are shared by all the lighting pipelines
+    cameraBuffer = ub.CameraBuffer()
+    lightsBuffer = ub.LightsBuffer()
+
     # This shader program does not consider lighting
     mvpPipeline = es.SimpleModelViewProjectionShaderProgram()
     shadowPipeline = es.SimpleTextureModelViewProjectionShaderProgram()
+    instancedPipeline = es.SimpleInstancedModelViewProjectionShaderProgram()
 
     # Setting up the clear screen color
     glClearColor(0.85, 0.85, 0.85, 1.0)
@@ -434,7 +456,10 @@ if __name__ == "__main__":
 
     gpuRedCube = createGPUShape(phongPipeline, bs.createColorNormalsCube(1,0,0))
 
-    scene = createScene(phongPipeline)
+    # La sala y la mesa no se mueven, sus cubos se unen en una sola figura (normales desde el float 6)
+    staticScene = createScene(phongPipeline)
+    scene = sg.bakeSceneGraphNode(staticScene, phongPipeline, normalOffset=6)
+    staticScene.clear()
 
     glEnable(GL_BLEND)
     glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
@@ -446,7 +471,10 @@ if __name__ == "__main__":
     torusNode.transform = tr.matmul([tr.translate(-2.0,-1.5,-2.0),tr.scale(0.5, 0.5, 2.0)])
     torusNode.childs = [Torus]
 
-    shapeStick = readOBJ('sprites/palito.obj',(0,0,0))
+    # El OBJ repite los vertices de cada triangulo, se unen y se ordenan para el cache de la GPU
+    shapeStick, report = mo.optimizeShape(readOBJ('sprites/palito.obj',(0,0,0)))
+    if DEBUG:
+        print("palito.obj:", report)
     gpuBaby = createGPUShape(phongPipeline, shapeStick)
 
     dababy = sg.SceneGraphNode("baby")
@@ -460,12 +488,21 @@ if __name__ == "__main__":
     sphereMesh = createSphereMesh(64,0,0,0)
     sphereMesh_vertices, sphereMesh_indices = get_vertexs_and_indexes(sphereMesh, [0.66,0.66,0.66])
 
-    gpuSphere = es.GPUShape().initBuffers()
-    pipeline1.setupVAO(gpuSphere)
-    gpuSphere.fillBuffers(sphereMesh_vertices, sphereMesh_indices, GL_STATIC_DRAW)
+    # La malla importada se simplifica por agrupacion de vertices en niveles de detalle,
+    # cada uno se usa bajo el tamano en pantalla (fraccion del alto) del anterior
+    sphereLodSizes = (0.3, 0.15, 0.07)
+    sphereShape, report = mo.optimizeShape(bs.Shape(sphereMesh_vertices, sphereMesh_indices, stride=9))
+    sphereLevels = []
+    for level in mo.lodChain(sphereShape, normalOffset=6):
+        gpuSphere = es.GPUShape().initBuffers()
+        pipeline1.setupVAO(gpuSphere)
+        gpuSphere.fillBuffers(level.vertices, level.indices, GL_STATIC_DRAW)
+        sphereLevels += [gpuSphere]
+    if DEBUG:
+        print("sphereMesh:", report, "- triangulos por nivel:", [gpuSphere.size // 3 for gpuSphere in sphereLevels])
 
     sphereNode = sg.SceneGraphNode("sphereMeshRot")
-    sphereNode.childs = [gpuSphere]
+    sphereNode.childs = [sg.LODNode("sphereMesh lod", sphereLevels, sphereLodSizes[0:len(sphereLevels) - 1])]
 
     sphereNodeLoc = sg.SceneGraphNode("sphereMesh")
     sphereNodeLoc.transform = tr.matmul([tr.translate(2.0, -2.0, -2.0)])
@@ -488,10 +525,8 @@ if __name__ == "__main__":
     screenNode.childs = [gpuScreen]
 
     # Reutilizamos vertices e indices de la figura anterior
-    gpuScreen2 = copy.deepcopy(gpuScreen)
-    CSphongTexPipeline.setupVAO(gpuScreen2)
+    gpuScreen2 = gpuScreen.shareBuffers()
     gpuScreen2.texture = es.textureSimpleSetup("sprites/lavalamp.jpg", GL_REPEAT, GL_REPEAT, GL_LINEAR_MIPMAP_LINEAR, GL_NEAREST)
-    gpuScreen2.fillBuffers(screenShape.vertices, screenShape.indices, GL_STATIC_DRAW)
     glGenerateMipmap(GL_TEXTURE_2D)
 
     screen2Node = sg.SceneGraphNode("screen")
@@ -503,20 +538,27 @@ if __name__ == "__main__":
     testNode.transform = tr.matmul([tr.translate(0,0,-0.94), tr.uniformScale(0.05)])
     testNode.childs = [gpuTest]
 
-    gpuWhiteBall = createGPUShape(phongPipeline ,createColorNormalSphere(50, 1, 1, 1))
+    # La bola blanca usa las mismas resoluciones que las demas bolas
+    whiteBallLevels = [createGPUShape(phongPipeline, createColorNormalSphere(N, 1, 1, 1)) for N in s3d.BALL_LOD_RESOLUTIONS]
     whiteBallNode = sg.SceneGraphNode("White Ball")
     whiteBallNode.transform = tr.matmul([tr.translate(0.5,0, -0.93),tr.uniformScale(0.04)])
-    whiteBallNode.childs = [gpuWhiteBall]
+    whiteBallNode.childs = [sg.LODNode("White Ball lod", whiteBallLevels, s3d.BALL_LOD_SIZES)]
 
     ballsNode = createPoolBalls(phongTexPipeline)
 
     shadows = createShadows(mvpPipeline)
 
-    table = createTable(phongPipeline)
+    staticTable = createTable(phongPipeline)
+    table = sg.bakeSceneGraphNode(staticTable, phongPipeline, normalOffset=6)
+    staticTable.clear()
     
     score = createCircleScore_v2(mvpPipeline)
 
     perfMonitor = pm.PerformanceMonitor(glfw.get_time(), 0.5)
+
+    # Con la tecla P se mide cada nodo dibujado, al terminar se imprime la tabla
+    profiler = sp.SceneProfiler(120)
+    profiling = False
     # glfw will swap buffers as soon as possible
     glfw.swap_interval(0)
     t0 = glfw.get_time()
@@ -551,52 +593,42 @@ if __name__ == "__main__":
     # Buscando nodos
 
     ball1 = sg.findNode(ballsNode, "ball1")
-    shadow1 = sg.findNode(shadows, "Shadow1")
     bola1 = poolBall(0.04, rest, fric, [0,0], [0,0])
     bola1.set_model(ball1)
 
     ball2 = sg.findNode(ballsNode, "ball2")
-    shadow2 = sg.findNode(shadows, "Shadow2")
     bola2 = poolBall(0.04, rest, fric,[-0.4 * 0.08,-0.3 * 0.08],[0,0])
     bola2.set_model(ball2)
 
     ball3 = sg.findNode(ballsNode, "ball3")
-    shadow3 = sg.findNode(shadows, "Shadow3")
     bola3 = poolBall(0.04, rest, fric,[-0.4 * 0.08, 0.3 * 0.08],[0,0])
     bola3.set_model(ball3)
 
     ball4 = sg.findNode(ballsNode, "ball4")
-    shadow4 = sg.findNode(shadows, "Shadow4")
     bola4 = poolBall(0.04, rest, fric,[-0.9*0.08,-0.4*0.08],[0,0])
     bola4.set_model(ball4)
 
     ball5 = sg.findNode(ballsNode, "ball5")
-    shadow5 = sg.findNode(shadows, "Shadow5")
     bola5 = poolBall(0.04, rest, fric,[-0.9*0.08, 0],[0,0])
     bola5.set_model(ball5)
 
     ball6 = sg.findNode(ballsNode, "ball6")
-    shadow6 = sg.findNode(shadows, "Shadow6")
     bola6 = poolBall(0.04, rest, fric,[-0.9*0.08, 0.4*0.08],[0,0])
     bola6.set_model(ball6)
 
     ball7 = sg.findNode(ballsNode, "ball7")
-    shadow7 = sg.findNode(shadows, "Shadow7")
     bola7 = poolBall(0.04, rest, fric,[-1.4*0.08,-0.7*0.08],[0,0])
     bola7.set_model(ball7)
 
     ball8 = sg.findNode(ballsNode, "ball8")
-    shadow8 = sg.findNode(shadows, "Shadow8")
     bola8 = poolBall(0.04, rest, fric,[-1.4*0.08,-0.25*0.08],[0,0])
     bola8.set_model(ball8)
 
     ball9 = sg.findNode(ballsNode, "ball9")
-    shadow9 = sg.findNode(shadows, "Shadow9")
     bola9 = poolBall(0.04, rest, fric,[-1.4*0.08, 0.25*0.08],[0,0])
     bola9.set_model(ball9)
 
     ball10 = sg.findNode(ballsNode, "ball10")
-    shadow10 = sg.findNode(shadows, "Shadow10")
     bola10 = poolBall(0.04, rest, fric,[-1.4*0.08, 0.7*0.08],[0,0])
     bola10.set_model(ball10)
 
@@ -606,7 +638,6 @@ if __name__ == "__main__":
     bolaBlanca.set_model(whiteBallNode)
     bolaBlanca.set_controller(controller)
 
-    mainShadow = sg.findNode(shadows, "ShadowMain")
 
     score1Node = sg.findNode(score, "Score 1")
     score1 = scoreHole(0.1)
@@ -627,6 +658,32 @@ if __name__ == "__main__":
     score6 = scoreHole(0.1)
     score6.set_model(score6Node)
 
+    # Las sombras y los puntajes comparten el mismo circulo, cada grupo se dibuja con una sola llamada
+    shadowInstances = sg.InstancedNode("Shadow Instances", shadows.childs[0].childs[0], instancedPipeline, len(shadows.childs))
+    scoreInstances = sg.InstancedNode("Score Instances", score.childs[0].childs[0], instancedPipeline, len(score.childs))
+    scoreInstances.instances.update([node.transform for node in score.childs])
+
+    # las traslaciones son la posicion original por el escalado del nodo de las bolas -> 0.08
+    # las sombras de las bolas de colores quedan fijas, se construyen con una sola llamada
+    shadowX = np.array([0, -0.4, -0.4, -0.9, -0.9, -0.9, -1.4, -1.4, -1.4, -1.4]) * 0.08
+    shadowY = np.array([0, -0.3, 0.3, -0.4, 0, 0.4, -0.7, -0.25, 0.25, 0.7]) * 0.08
+    shadowZ = np.full(len(shadowX), -0.935)
+    shadowModels = np.concatenate([tr.matmul([tr.translate(shadowX, shadowY, shadowZ), tr.uniformScale(0.04)]),
+                                   [tr.identity()]]).astype(np.float32)
+
+    # Las escenas se compilan en listas de dibujo, una por pipeline de iluminacion
+    instancedDrawList = sg.DrawList([(shadowInstances, instancedPipeline), (scoreInstances, instancedPipeline)])
+    lightingDrawLists = {}
+
+    # Matrices reutilizadas en cada frame, sin crear nuevos arreglos
+    palitoTransform = tr.identity()
+    hangerTransform = tr.trs((0, -2.3, 0), (np.pi/2, 0, 0), 0.5)
+
+    # Memoria de GPU de cada figura, comparada con vertices float32 e indices uint32
+    if DEBUG:
+        print(sg.memoryReport(ballsNode, palitoNode, whiteBallNode, scene, table))
+        print(sc.cache)
+
     # Application loop
     while not glfw.window_should_close(window):
         # Variables del tiempo
@@ -661,40 +718,34 @@ if __name__ == "__main__":
         if (controller.autoCameraView):
             viewMatrix = camera.update_autoview()
 
+        # Las figuras fuera de la vista de la camara no se dibujan
+        viewProjection = tr.matmul([projection, viewMatrix])
+        sg.cullingCounters.reset()
+        sg.lodCounters.reset()
+
         # The axis is drawn without lighting effects
         if controller.showAxis:
             glUseProgram(mvpPipeline.shaderProgram)
-            glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "projection"), 1, GL_TRUE, projection)
-            glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-            #glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
-            glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "model"), 1, GL_TRUE,
-             tr.matmul([tr.translate(0, -2.3, 0),tr.rotationX(np.pi/2), tr.uniformScale(0.5)])) # tr.identity
+            mvpPipeline.setMat4("projection", projection)
+            mvpPipeline.setMat4("view", viewMatrix)
+            #mvpPipeline.setMat4("model", tr.identity())
+            mvpPipeline.setMat4("model", hangerTransform) # tr.identity
             #mvpPipeline.drawCall(gpuAxis, GL_LINES)
             mvpPipeline.drawCall(gpuHanger, GL_LINES)
 
-        glUseProgram(mvpPipeline.shaderProgram)
-        glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "projection"), 1, GL_TRUE, projection)
-        glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-        glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
-        # las traslaciones son la posicion original (o actual) por el escalado del nodo de las bolas -> 0.08
-        shadow1.transform = tr.matmul([tr.translate(0,0,-0.935),tr.uniformScale(0.04)])
-        shadow2.transform = tr.matmul([tr.translate(-0.4 * 0.08,-0.3 * 0.08,-0.935),tr.uniformScale(0.04)])
-        shadow3.transform = tr.matmul([tr.translate(-0.4 * 0.08,0.3 * 0.08,-0.935),tr.uniformScale(0.04)])
-        shadow4.transform = tr.matmul([tr.translate(-0.9*0.08,-0.4*0.08,-0.935),tr.uniformScale(0.04)])
-        shadow5.transform = tr.matmul([tr.translate(-0.9*0.08,0,-0.935),tr.uniformScale(0.04)])
-        shadow6.transform = tr.matmul([tr.translate(-0.9*0.08,0.4*0.08,-0.935),tr.uniformScale(0.04)])
-        shadow7.transform = tr.matmul([tr.translate(-1.4*0.08,-0.7*0.08,-0.935),tr.uniformScale(0.04)])
-        shadow8.transform = tr.matmul([tr.translate(-1.4*0.08,-0.25*0.08,-0.935),tr.uniformScale(0.04)])
-        shadow9.transform = tr.matmul([tr.translate(-1.4*0.08,0.25*0.08,-0.935),tr.uniformScale(0.04)])
-        shadow10.transform = tr.matmul([tr.translate(-1.4*0.08,0.7* 0.08,-0.935),tr.uniformScale(0.04)])
-        mainShadow.transform = tr.matmul([tr.translate(bolaBlanca.position[0], bolaBlanca.position[1], 0),tr.translate(0.5,0,-0.945),tr.uniformScale(0.04)])
-        sg.drawSceneGraphNode(shadows, mvpPipeline, "model")
-        sg.drawSceneGraphNode(score, mvpPipeline, "model")
+        # Solo la sombra de la bola blanca sigue a la bola
+        tr.matmul([tr.translate(bolaBlanca.position[0] + 0.5, bolaBlanca.position[1], -0.945), tr.uniformScale(0.04)], out=shadowModels[-1])
+        shadowInstances.instances.update(shadowModels)
+
+        glUseProgram(instancedPipeline.shaderProgram)
+        instancedPipeline.setMat4("projection", projection)
+        instancedPipeline.setMat4("view", viewMatrix)
+        instancedDrawList.draw(viewProjection=viewProjection)
         
         glUseProgram(shadowPipeline.shaderProgram)
-        glUniformMatrix4fv(glGetUniformLocation(shadowPipeline.shaderProgram, "projection"), 1, GL_TRUE, projection)
-        glUniformMatrix4fv(glGetUniformLocation(shadowPipeline.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-        glUniformMatrix4fv(glGetUniformLocation(shadowPipeline.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
+        shadowPipeline.setMat4("projection", projection)
+        shadowPipeline.setMat4("view", viewMatrix)
+        shadowPipeline.setMat4("model", tr.identity())
 
         lightingPipeline = phongPipeline
         lightingPipeline2 = phongPipeline2
@@ -712,8 +763,8 @@ if __name__ == "__main__":
         if controller.spotLight == True:
             lightingPipeline = CSspotlightPipeline
             glUseProgram(lightingPipeline.shaderProgram)
-            glUniform1f(glGetUniformLocation(lightingPipeline.shaderProgram, "concentrationP"), 100.0)
-            glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "spotDirR"), 0.0, 0.0, -3.0)
+            lightingPipeline.setFloat("concentrationP", 100.0)
+            lightingPipeline.setVec3("spotDirR", 0.0, 0.0, -3.0)
 
         # Setting all uniform shader variables
         
@@ -721,7 +772,7 @@ if __name__ == "__main__":
 
         # demas saco la primera traslacion
         #tr.translate(bolaBlanca.position[0], bolaBlanca.position[1], 0)
-        palitoNode.transform = tr.matmul([tr.translate(bolaBlanca.position[0], bolaBlanca.position[1], 0),tr.translate(0.5,0,0),tr.rotationZ(camera.theta)])
+        palitoNode.transform = tr.trs((bolaBlanca.position[0] + 0.5, bolaBlanca.position[1], 0), (0, 0, camera.theta), 1, out=palitoTransform)
         # White light in all components: ambient, diffuse and specular.
         if selta > 0.75:
             if var%3 == 0:
@@ -739,32 +790,25 @@ if __name__ == "__main__":
             var += 1
             s=t1
 
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "La"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "Ld"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "Ls"), aux_r, aux_g, aux_b)
+        # A single buffer write per block updates every lighting pipeline
+        cameraBuffer.update(projection, viewMatrix, camera.eye)
+        lightColor = (aux_r, aux_g, aux_b)
+        lightsBuffer.update(lightposition, lightColor, lightColor, lightColor, cte_at, lnr_at, qud_at)
 
         # Object is barely visible at only ambient. Diffuse behavior is slightly red. Sparkles are white
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "Ka"), 0.2, 0.2, 0.2)
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "Kd"), 0.5, 0.5, 0.5)
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "Ks"), 0.3, 0.3, 0.3)
+        lightingPipeline.setVec3("Ka", 0.2, 0.2, 0.2)
+        lightingPipeline.setVec3("Kd", 0.5, 0.5, 0.5)
+        lightingPipeline.setVec3("Ks", 0.3, 0.3, 0.3)
 
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "lightPosition"), lightposition[0], lightposition[1], lightposition[2])
-        glUniform3f(glGetUniformLocation(lightingPipeline.shaderProgram, "viewPosition"), camera.eye[0], camera.eye[1], camera.eye[2])
-        glUniform1ui(glGetUniformLocation(lightingPipeline.shaderProgram, "shininess"), int(shininess))
-        
-        glUniform1f(glGetUniformLocation(lightingPipeline.shaderProgram, "constantAttenuation"), cte_at)
-        glUniform1f(glGetUniformLocation(lightingPipeline.shaderProgram, "linearAttenuation"), lnr_at)
-        glUniform1f(glGetUniformLocation(lightingPipeline.shaderProgram, "quadraticAttenuation"), qud_at)
+        lightingPipeline.setUint("shininess", int(shininess))
 
-        glUniformMatrix4fv(glGetUniformLocation(lightingPipeline.shaderProgram, "projection"), 1, GL_TRUE, projection)
-        glUniformMatrix4fv(glGetUniformLocation(lightingPipeline.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-        glUniformMatrix4fv(glGetUniformLocation(lightingPipeline.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
+        lightingPipeline.setMat4("model", tr.identity())
 
         # Drawing
-        sg.drawSceneGraphNode(scene, lightingPipeline, "model")
-        sg.drawSceneGraphNode(palitoNode, lightingPipeline, "model")
-        sg.drawSceneGraphNode(table, lightingPipeline, "model")
-        sg.drawSceneGraphNode(whiteBallNode, lightingPipeline, "model")
+        if lightingPipeline not in lightingDrawLists:
+            lightingDrawLists[lightingPipeline] = sg.DrawList([(scene, lightingPipeline),
+                (palitoNode, lightingPipeline), (table, lightingPipeline), (whiteBallNode, lightingPipeline)])
+        lightingDrawLists[lightingPipeline].draw(viewProjection=viewProjection)
         
         
         glUseProgram(texPipeline.shaderProgram)
@@ -784,87 +828,49 @@ if __name__ == "__main__":
                         collide(bolas[i], bolas[j])
         """
 
-        # White light in all components: ambient, diffuse and specular.
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "La"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ld"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ls"), aux_r, aux_g, aux_b)
-
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "lightPosition"), lightposition[0], lightposition[1], lightposition[2])
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "viewPosition"), camera.eye[0], camera.eye[1], camera.eye[2])
-        glUniform1ui(glGetUniformLocation(texPipeline.shaderProgram, "shininess"), int(shininess))
+        texPipeline.setUint("shininess", int(shininess))
 
-        glUniform1f(glGetUniformLocation(texPipeline.shaderProgram, "constantAttenuation"), cte_at)
-        glUniform1f(glGetUniformLocation(texPipeline.shaderProgram, "linearAttenuation"), lnr_at)
-        glUniform1f(glGetUniformLocation(texPipeline.shaderProgram, "quadraticAttenuation"), qud_at)
-        
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ka"), 0.2, 0.2, 0.2)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Kd"), 0.8, 0.8, 0.8)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ks"), 1.0, 1.0, 1.0)
+        texPipeline.setVec3("Ka", 0.2, 0.2, 0.2)
+        texPipeline.setVec3("Kd", 0.8, 0.8, 0.8)
+        texPipeline.setVec3("Ks", 1.0, 1.0, 1.0)
 
-        glUniformMatrix4fv(glGetUniformLocation(texPipeline.shaderProgram, "projection"), 1, GL_TRUE, projection)
-        glUniformMatrix4fv(glGetUniformLocation(texPipeline.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-        glUniformMatrix4fv(glGetUniformLocation(texPipeline.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
+        texPipeline.setMat4("model", tr.identity())
 
         #sg.drawSceneGraphNode(toraxNode, texPipeline, "model")
-        sg.drawSceneGraphNode(screenNode, texPipeline, "model")
-        sg.drawSceneGraphNode(screen2Node, texPipeline, "model")
-        sg.drawSceneGraphNode(ballsNode, texPipeline, "model")
+        sg.drawSceneGraphNode(screenNode, texPipeline, "model", viewProjection=viewProjection)
+        sg.drawSceneGraphNode(screen2Node, texPipeline, "model", viewProjection=viewProjection)
+        sg.drawSceneGraphNode(ballsNode, texPipeline, "model", viewProjection=viewProjection)
 
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ka"), 0.2, 0.2, 0.2)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Kd"), 1.0, 1.0, 1.0)
-        glUniform3f(glGetUniformLocation(texPipeline.shaderProgram, "Ks"), 1.0, 1.0, 1.0)
+        texPipeline.setVec3("Ka", 0.2, 0.2, 0.2)
+        texPipeline.setVec3("Kd", 1.0, 1.0, 1.0)
+        texPipeline.setVec3("Ks", 1.0, 1.0, 1.0)
 
-        sg.drawSceneGraphNode(torusNode, texPipeline, "model")
+        sg.drawSceneGraphNode(torusNode, texPipeline, "model", viewProjection=viewProjection)
         
         glUseProgram(CSspotlightPipeline.shaderProgram)
-        # Light in all components: ambient, diffuse and specular.
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "La"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "Ld"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "Ls"), aux_r, aux_g, aux_b)
-
         # Object is barely visible at only ambient. Diffuse behavior is slightly grey. Sparkles are white
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "Ka"), 0.1, 0.1, 0.1)
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "Kd"), 1.0, 1.0, 1.0)
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "Ks"), 0.8, 0.8, 0.8)
+        CSspotlightPipeline.setVec3("Ka", 0.1, 0.1, 0.1)
+        CSspotlightPipeline.setVec3("Kd", 1.0, 1.0, 1.0)
+        CSspotlightPipeline.setVec3("Ks", 0.8, 0.8, 0.8)
 
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "lightPosition"), lightposition[0], lightposition[1], lightposition[2])
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "viewPosition"), camera.eye[0], camera.eye[1], camera.eye[2])
-        glUniform1ui(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "shininess"), int(shininess))
+        CSspotlightPipeline.setUint("shininess", int(shininess))
         
-        glUniform1f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "constantAttenuation"), cte_at)
-        glUniform1f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "linearAttenuation"), lnr_at)
-        glUniform1f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "quadraticAttenuation"), qud_at)
-        glUniform1f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "concentrationP"), 100.0)
-        glUniform3f(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "spotDirR"), 0.0, 0.0, -3.0)
-
-        glUniformMatrix4fv(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "projection"), 1, GL_TRUE, projection)
-        glUniformMatrix4fv(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-        glUniformMatrix4fv(glGetUniformLocation(CSspotlightPipeline.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
+        CSspotlightPipeline.setFloat("concentrationP", 100.0)
+        CSspotlightPipeline.setVec3("spotDirR", 0.0, 0.0, -3.0)
+
+        CSspotlightPipeline.setMat4("model", tr.identity())
         #sg.drawSceneGraphNode(testNode, CSspotlightPipeline, "model")
 
         glUseProgram(pipeline1.shaderProgram)
-        # White light in all components: ambient, diffuse and specular.
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "La"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "Ld"), aux_r, aux_g, aux_b)
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "Ls"), aux_r, aux_g, aux_b)
-
         # Object is barely visible at only ambient. Diffuse behavior is slightly red. Sparkles are white
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "Ka"), 0.1, 0.1, 0.1)
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "Kd"), 1.0, 1.0, 1.0)
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "Ks"), 0.9, 0.9, 0.9)
+        pipeline1.setVec3("Ka", 0.1, 0.1, 0.1)
+        pipeline1.setVec3("Kd", 1.0, 1.0, 1.0)
+        pipeline1.setVec3("Ks", 0.9, 0.9, 0.9)
 
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "lightPosition"), lightposition[0], lightposition[1], lightposition[2])
-        glUniform3f(glGetUniformLocation(pipeline1.shaderProgram, "viewPosition"), camera.eye[0], camera.eye[1], camera.eye[2])
-        glUniform1ui(glGetUniformLocation(pipeline1.shaderProgram, "shininess"), int(shininess))
-        
-        glUniform1f(glGetUniformLocation(pipeline1.shaderProgram, "constantAttenuation"), cte_at)
-        glUniform1f(glGetUniformLocation(pipeline1.shaderProgram, "linearAttenuation"), lnr_at)
-        glUniform1f(glGetUniformLocation(pipeline1.shaderProgram, "quadraticAttenuation"), qud_at)
-
-        glUniformMatrix4fv(glGetUniformLocation(pipeline1.shaderProgram, "projection"), 1, GL_TRUE, projection)
-        glUniformMatrix4fv(glGetUniformLocation(pipeline1.shaderProgram, "view"), 1, GL_TRUE, viewMatrix)
-        glUniformMatrix4fv(glGetUniformLocation(pipeline1.shaderProgram, "model"), 1, GL_TRUE, tr.identity())
-        sg.drawSceneGraphNode(sphereNodeLoc, pipeline1,"model")
+        pipeline1.setUint("shininess", int(shininess))
+
+        pipeline1.setMat4("model", tr.identity())
+        sg.drawSceneGraphNode(sphereNodeLoc, pipeline1,"model", viewProjection=viewProjection)
         
         # Drawing the imgui texture over our drawing
         glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
@@ -873,13 +879,42 @@ if __name__ == "__main__":
         # Once the drawing is rendered, buffers are swap so an uncomplete drawing is never seen.
         glfw.swap_buffers(window)
 
+        perfMonitor.update(glfw.get_time())
+
+        if profiling:
+            profiler.update()
+
+        if controller.profiling != profiling:
+            profiling = controller.profiling
+            sg.setProfiler(profiler if profiling else None)
+            if not profiling:
+                print(profiler.table())
+        gr.registry.update()
+        glfw.set_window_title(window, title + str(perfMonitor) + str(sg.cullingCounters) + str(sg.lodCounters) + " " + str(gr.registry))
+
     gpuAxis.clear()
     #impl.shutdown()
     scene.clear()
+    table.clear()
     screenNode.clear()
     screen2Node.clear()
     torusNode.clear()
     dababy.clear()
     sphereNode.clear()
+    gpuRedCube.clear()
+    gpuHanger.clear()
+    testNode.clear()
+    whiteBallNode.clear()
+    ballsNode.clear()
+    shadowInstances.clear()
+    scoreInstances.clear()
+    sc.cache.clear()
+    s3d.clearArenas()
+
+    cameraBuffer.clear()
+    lightsBuffer.clear()
+
+    # Avisa de los objetos de OpenGL que quedaron sin liberar, o que se liberaron dos veces
+    gr.registry.checkLeaks()
 
     glfw.terminate()
\ No newline at end of file
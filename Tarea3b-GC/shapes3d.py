@@ -6,39 +6,76 @@ from OpenGL.GL import *
 from numpy.core.numeric import indices
 import grafica.basic_shapes as bs
 import grafica.easy_shaders as es
+import grafica.gpu_shape as gs
 import grafica.transformations as tr
 import grafica.scene_graph as sg
+import grafica.shape_cache as sc
 import openmesh as om
 import random
 import copy
 
+# Las figuras de un mismo pipeline se guardan juntas en los buffers de un BufferArena
+_arenas = {}
+
 # Convenience function to ease initialization
 def createGPUShape(pipeline, shape):
+    # Las figuras iguales de un mismo pipeline se suben una sola vez
+    return sc.cache.getShape(pipeline, shape, lambda: _uploadShape(pipeline, shape))
+
+def _uploadShape(pipeline, shape):
+    # Sin el stride de la figura o del pipeline, se sube sola y sin stride
+    stride = gs.inferStride(shape.vertices, pipeline)
+    if stride is None:
+        gpuShape = es.GPUShape().initBuffers()
+        pipeline.setupVAO(gpuShape)
+        gpuShape.fillBuffers(shape.vertices, shape.indices, GL_STATIC_DRAW, stride=None)
+        return gpuShape
+
+    key = (pipeline, stride)
+    if key not in _arenas:
+        _arenas[key] = gs.BufferArena(pipeline, stride)
+    return _arenas[key].add(shape.vertices, shape.indices)
+
+def clearArenas():
+    # Libera los buffers compartidos por las figuras de createGPUShape
+    for arena in _arenas.values():
+        arena.clear()
+    _arenas.clear()
+
+def _loadTexture(path, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmap):
+    # Cada imagen con los mismos parametros se carga una sola vez
+    def load():
+        texture = es.textureSimpleSetup(path, sWrapMode, tWrapMode, minFilterMode, maxFilterMode)
+        if mipmap:
+            glGenerateMipmap(GL_TEXTURE_2D)
+        return texture
+
+    return sc.cache.getTexture((path, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmap), load)
+
+def _uploadTextureShape(shape, pipeline, textureKey):
     gpuShape = es.GPUShape().initBuffers()
     pipeline.setupVAO(gpuShape)
     gpuShape.fillBuffers(shape.vertices, shape.indices, GL_STATIC_DRAW)
+    gpuShape.texture = _loadTexture(*textureKey)
     return gpuShape
 
 # Convenience function to ease initialization
 def createTextureGPUShape(shape, pipeline, path):
     # Funcion Conveniente para facilitar la inicializacion de un GPUShape con texturas
-    gpuShape = es.GPUShape().initBuffers()
-    pipeline.setupVAO(gpuShape)
-    gpuShape.fillBuffers(shape.vertices, shape.indices, GL_STATIC_DRAW)
-    gpuShape.texture = es.textureSimpleSetup(
-        path, GL_CLAMP_TO_EDGE, GL_CLAMP_TO_EDGE, GL_NEAREST, GL_NEAREST)
-    return gpuShape
+    textureKey = (path, GL_CLAMP_TO_EDGE, GL_CLAMP_TO_EDGE, GL_NEAREST, GL_NEAREST, False)
+    return sc.cache.getShape(pipeline, shape, lambda: _uploadTextureShape(shape, pipeline, textureKey), textureKey)
 
 # Convenience function to ease initialization
 def createTextureGPUShapeX(shape, pipeline,sWrapMode, tWrapMode, minFilterMode, maxFilterMode, path):
     # Funcion Conveniente para facilitar la inicializacion de un GPUShape con texturas
-    gpuShape = es.GPUShape().initBuffers()
-    pipeline.setupVAO(gpuShape)
-    gpuShape.fillBuffers(shape.vertices, shape.indices, GL_STATIC_DRAW)
-    gpuShape.texture = es.textureSimpleSetup(
-        path, sWrapMode, tWrapMode, minFilterMode, maxFilterMode)
-    glGenerateMipmap(GL_TEXTURE_2D)
-    return gpuShape
+    textureKey = (path, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, True)
+    return sc.cache.getShape(pipeline, shape, lambda: _uploadTextureShape(shape, pipeline, textureKey), textureKey)
+
+def generateTextureGPUShape(pipeline, path, generator, *args):
+    # Como createTextureGPUShape, pero la figura generator(*args) solo se construye si no esta en el cache
+    textureKey = (path, GL_CLAMP_TO_EDGE, GL_CLAMP_TO_EDGE, GL_NEAREST, GL_NEAREST, False)
+    return sc.cache.generate(pipeline, lambda shape: _uploadTextureShape(shape, pipeline, textureKey),
+                             generator, *args, texture=textureKey)
 
 # creates the scene where the dance takes place
 # returns sceneGraphNode
@@ -112,7 +149,7 @@ def createTextureQuad(nx, ny):
          0, 1, 2,
          2, 3, 0]
 
-    return bs.Shape(vertices, indices)
+    return bs.Shape(vertices, indices, stride=8)
 
 # creates the shape of a STAR, dont mind the name
 # returns a Shape
@@ -125,7 +162,7 @@ def hanger():
         0.7, 0, 0, 1, 1, 1        # 4
     ]
     indices = [1,0, 2, 3, 2, 0, 4, 3, 4, 1]
-    return bs.Shape(vertices, indices)
+    return bs.Shape(vertices, indices, stride=6)
 
 # creates a node with a cube and its transformations
 # returns a sceneGraphNode
@@ -195,60 +232,28 @@ def createBlackCircle(N):
     # The final triangle connects back to the second vertex
     indices += [0, N, 1]
 
-    return bs.Shape(vertices, indices)
+    return bs.Shape(vertices, indices, stride=6)
 
-# creates a shape of a sphere
-# returns a Shape 
-def createColorNormalSphere(N, red, g, b):
+# Esfera de radio 0.5, con phi alrededor del eje z y theta desde el polo norte
+def _spherePosition(phi, theta):
+    return 0.5 * np.sin(theta) * np.cos(phi), 0.5 * np.sin(theta) * np.sin(phi), 0.5 * np.cos(theta)
 
-    vertices = []
-    indices = []
-    dTheta = 2 * np.pi /N
-    dPhi = 2 * np.pi /N
-    r = 0.5
-    c = 0
+def _sphereNormal(phi, theta):
+    return np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)
 
-    for i in range(N - 1):
-        theta = i * dTheta
-        theta1 = (i + 1) * dTheta
-        for j in range(N):
-            phi = j*dPhi
-            phi1 = (j+1)*dPhi
-            v0 = [r*np.sin(theta)*np.cos(phi), r*np.sin(theta)*np.sin(phi), r*np.cos(theta)]
-            v1 = [r*np.sin(theta1)*np.cos(phi), r*np.sin(theta1)*np.sin(phi), r*np.cos(theta1)]
-            v2 = [r*np.sin(theta1)*np.cos(phi1), r*np.sin(theta1)*np.sin(phi1), r*np.cos(theta1)]
-            v3 = [r*np.sin(theta)*np.cos(phi1), r*np.sin(theta)*np.sin(phi1), r*np.cos(theta)]
-            n0 = [np.sin(theta)*np.cos(phi), np.sin(theta)*np.sin(phi), np.cos(theta)]
-            n1 = [np.sin(theta1)*np.cos(phi), np.sin(theta1)*np.sin(phi), np.cos(theta1)]
-            n2 = [np.sin(theta1)*np.cos(phi1), np.sin(theta1)*np.sin(phi1), np.cos(theta1)]
-            n3 = [np.sin(theta)*np.cos(phi1), np.sin(theta)*np.sin(phi1), np.cos(theta)]
+# Toro de radio 0.5 y seccion de radio 0.1, con phi alrededor del eje z y theta alrededor de la seccion
+def _torusPosition(phi, theta):
+    return (0.5 + 0.1 * np.cos(theta)) * np.cos(phi), (0.5 + 0.1 * np.cos(theta)) * np.sin(phi), 0.1 * np.sin(theta)
 
+def _torusNormal(phi, theta):
+    return np.cos(theta) * np.cos(phi), np.cos(theta) * np.sin(phi), np.sin(theta)
 
-            # Creamos los quad superiores
-            if i == 0:
-                vertices += [v0[0], v0[1], v0[2], red, g, b, n0[0], n0[1], n0[2]]
-                vertices += [v1[0], v1[1], v1[2], red, g, b, n1[0], n1[1], n1[2]]
-                vertices += [v2[0], v2[1], v2[2], red, g, b, n2[0], n2[1], n2[2]]
-                indices += [ c + 0, c + 1, c +2 ]
-                c += 3
-            # Creamos los quads inferiores
-            elif i == (N-2):
-                vertices += [v0[0], v0[1], v0[2], red, g, b, n0[0], n0[1], n0[2]]
-                vertices += [v1[0], v1[1], v1[2], red, g, b, n1[0], n1[1], n1[2]]
-                vertices += [v3[0], v3[1], v3[2], red, g, b, n3[0], n3[1], n3[2]]
-                indices += [ c + 0, c + 1, c +2 ]
-                c += 3
-            
-            # Creamos los quads intermedios
-            else: 
-                vertices += [v0[0], v0[1], v0[2], red, g, b, n0[0], n0[1], n0[2]]
-                vertices += [v1[0], v1[1], v1[2], red, g, b, n1[0], n1[1], n1[2]]
-                vertices += [v2[0], v2[1], v2[2], red, g, b, n2[0], n2[1], n2[2]]
-                vertices += [v3[0], v3[1], v3[2], red, g, b, n3[0], n3[1], n3[2]]
-                indices += [ c + 0, c + 1, c +2 ]
-                indices += [ c + 2, c + 3, c + 0 ]
-                c += 4
-    return bs.Shape(vertices, indices)
+# creates a shape of a sphere
+# returns a Shape 
+def createColorNormalSphere(N, red, g, b):
+    # N divisiones alrededor del eje, N/2 entre los polos
+    return bs.parametricSurface(_spherePosition, _sphereNormal, ((0, 2 * np.pi), (0, np.pi)),
+                                N, max(N // 2, 2), ["position", (red, g, b), "normal"])
 
 # creates the mesh of a Sphere
 # returns a Mesh
@@ -345,49 +350,34 @@ def get_vertexs_and_indexes(mesh, color):
 # creates a shape of sphere with textures
 # returns a Shape
 def createTextureNormalSphere(N, u_i, u_f, v_i, v_f):
-    vertices = []
-    indices = []
-    dTheta = 2 * np.pi /N
-    dPhi = 2 * np.pi /N
-    r = 0.5
-    c = 0
-
-    for i in range(N//2):
-        theta = i * dTheta
-        theta1 = (i + 1) * dTheta
-        for j in range(N):
-            phi = j*dPhi
-            phi1 = (j+1)*dPhi
-            v0 = [r*np.sin(theta)*np.cos(phi), r*np.sin(theta)*np.sin(phi), r*np.cos(theta)]
-            v1 = [r*np.sin(theta1)*np.cos(phi), r*np.sin(theta1)*np.sin(phi), r*np.cos(theta1)]
-            v2 = [r*np.sin(theta1)*np.cos(phi1), r*np.sin(theta1)*np.sin(phi1), r*np.cos(theta1)]
-            v3 = [r*np.sin(theta)*np.cos(phi1), r*np.sin(theta)*np.sin(phi1), r*np.cos(theta)]
-            n0 = [np.sin(theta)*np.cos(phi), np.sin(theta)*np.sin(phi), np.cos(theta)]
-            n1 = [np.sin(theta1)*np.cos(phi), np.sin(theta1)*np.sin(phi), np.cos(theta1)]
-            n2 = [np.sin(theta1)*np.cos(phi1), np.sin(theta1)*np.sin(phi1), np.cos(theta1)]
-            n3 = [np.sin(theta)*np.cos(phi1), np.sin(theta)*np.sin(phi1), np.cos(theta)]
-            
-            # Creamos los quads intermedios
-            vertices += [v0[0], v0[1], v0[2], u_i + phi/(2*np.pi)* (u_f - u_i), v_i + theta/np.pi * (v_f - v_i), n0[0], n0[1], n0[2]]
-            vertices += [v1[0], v1[1], v1[2], u_i + phi/(2*np.pi)* (u_f - u_i), v_i + theta1/np.pi* (v_f - v_i), n1[0], n1[1], n1[2]]
-            vertices += [v2[0], v2[1], v2[2], u_i + phi1/(2*np.pi)* (u_f - u_i), v_i + theta1/np.pi* (v_f - v_i), n2[0], n2[1], n2[2]]
-            vertices += [v3[0], v3[1], v3[2], u_i + phi1/(2*np.pi)* (u_f - u_i), v_i + theta/np.pi* (v_f - v_i), n3[0], n3[1], n3[2]]
-            indices += [ c + 0, c + 1, c +2 ]
-            indices += [ c + 2, c + 3, c + 0 ]
-            c += 4
-    return bs.Shape(vertices, indices)
+    # La textura se toma del rectangulo [u_i, u_f] x [v_i, v_f] de la imagen
+    texCoords = lambda phi, theta: (u_i + phi / (2 * np.pi) * (u_f - u_i), v_i + theta / np.pi * (v_f - v_i))
+    return bs.parametricSurface(_spherePosition, _sphereNormal, ((0, 2 * np.pi), (0, np.pi)),
+                                N, max(N // 2, 2), ["position", texCoords, "normal"])
+
+# Resoluciones de las bolas, de la mas fina a la mas gruesa, y el tamano en pantalla
+# (fraccion del alto) bajo el cual se pasa a la siguiente
+BALL_LOD_RESOLUTIONS = (50, 20, 10)
+BALL_LOD_SIZES = (0.15, 0.05)
+
+def createPoolBallLOD(pipeline, name, u0, u1, v0, v1):
+    # Una bola con sus niveles de detalle, cada uno generado con menos divisiones
+    levels = [generateTextureGPUShape(pipeline, "sprites/pool.png", createTextureNormalSphere, N, u0, u1, v0, v1)
+              for N in BALL_LOD_RESOLUTIONS]
+    return sg.LODNode(name + " lod", levels, BALL_LOD_SIZES)
 
 def createPoolBalls(pipeline):
-    gpuBall1 = createTextureGPUShape(createTextureNormalSphere(50, 0, 1/3, 0, 1/6), pipeline, "sprites/pool.png")
-    gpuBall2 = createTextureGPUShape(createTextureNormalSphere(50, 1/3, 2/3, 0, 1/6), pipeline, "sprites/pool.png")
-    gpuBall3 = createTextureGPUShape(createTextureNormalSphere(50, 2/3, 1, 0, 1/6), pipeline, "sprites/pool.png")
-    gpuBall4 = createTextureGPUShape(createTextureNormalSphere(50, 0, 1/3, 1/6, 2/6), pipeline, "sprites/pool.png")
-    gpuBall5 = createTextureGPUShape(createTextureNormalSphere(50, 1/3, 2/3, 1/6, 2/6), pipeline, "sprites/pool.png")
-    gpuBall6 = createTextureGPUShape(createTextureNormalSphere(50, 2/3, 1, 1/6, 2/6), pipeline, "sprites/pool.png")
-    gpuBall7 = createTextureGPUShape(createTextureNormalSphere(50, 0, 1/3, 2/6, 3/6), pipeline, "sprites/pool.png")
-    gpuBall8 = createTextureGPUShape(createTextureNormalSphere(50, 1/3, 2/3, 2/6, 3/6), pipeline, "sprites/pool.png")
-    gpuBall9 = createTextureGPUShape(createTextureNormalSphere(50, 2/3, 1, 2/6, 3/6), pipeline, "sprites/pool.png")
-    gpuBall10 = createTextureGPUShape(createTextureNormalSphere(50, 0, 1/3, 3/6, 4/6), pipeline, "sprites/pool.png")
+    # Las 10 bolas comparten la imagen, que se carga una sola vez
+    gpuBall1 = createPoolBallLOD(pipeline, "ball1", 0, 1/3, 0, 1/6)
+    gpuBall2 = createPoolBallLOD(pipeline, "ball2", 1/3, 2/3, 0, 1/6)
+    gpuBall3 = createPoolBallLOD(pipeline, "ball3", 2/3, 1, 0, 1/6)
+    gpuBall4 = createPoolBallLOD(pipeline, "ball4", 0, 1/3, 1/6, 2/6)
+    gpuBall5 = createPoolBallLOD(pipeline, "ball5", 1/3, 2/3, 1/6, 2/6)
+    gpuBall6 = createPoolBallLOD(pipeline, "ball6", 2/3, 1, 1/6, 2/6)
+    gpuBall7 = createPoolBallLOD(pipeline, "ball7", 0, 1/3, 2/6, 3/6)
+    gpuBall8 = createPoolBallLOD(pipeline, "ball8", 1/3, 2/3, 2/6, 3/6)
+    gpuBall9 = createPoolBallLOD(pipeline, "ball9", 2/3, 1, 2/6, 3/6)
+    gpuBall10 = createPoolBallLOD(pipeline, "ball10", 0, 1/3, 3/6, 4/6)
 
     shadow1Node = sg.SceneGraphNode("shadow1")
     shadow1Node.transform = tr.matmul([tr.translate(0,0,-0.6), tr.uniformScale(2)])
@@ -512,72 +502,15 @@ def createShadows(pipeline):
 # creates the shape of a torus
 # returns a Shape
 def createColorTorus(N):
-    vertices = []
-    indices = []
-    dPhi = 2 * np.pi/N
-    dTheta = 2 * np.pi/N
-    c= 0
-    for i in range(N):
-        theta = i * dTheta
-        theta1 = (i + 1) * dTheta
-        for j in range(N):
-            phi = j*dPhi
-            phi1 = (j+1)*dPhi
-
-            v0 = [(0.5 + 0.1*np.cos(theta))*np.cos(phi), (0.5 + 0.1*np.cos(theta))*np.sin(phi), 0.1 * np.sin(theta)]
-            v1 = [(0.5 + 0.1*np.cos(theta1))*np.cos(phi), (0.5 + 0.1*np.cos(theta1))*np.sin(phi), 0.1 * np.sin(theta1)]
-            v2 = [(0.5 + 0.1*np.cos(theta1))*np.cos(phi1), (0.5 + 0.1*np.cos(theta1))*np.sin(phi1), 0.1 * np.sin(theta1)]
-            v3 = [(0.5 + 0.1*np.cos(theta))*np.cos(phi1), (0.5 + 0.1*np.cos(theta))*np.sin(phi1), 0.1 * np.sin(theta)]
-
-            n0 = [(0.5 + np.cos(theta))*np.cos(phi), (0.5 + np.cos(theta))*np.sin(phi),  np.sin(theta)]
-            n1 = [(0.5 + np.cos(theta1))*np.cos(phi), (0.5 + np.cos(theta1))*np.sin(phi), np.sin(theta1)]
-            n2 = [(0.5 + np.cos(theta1))*np.cos(phi1), (0.5 + np.cos(theta1))*np.sin(phi1),  np.sin(theta1)]
-            n3 = [(0.5 + np.cos(theta))*np.cos(phi1), (0.5 + np.cos(theta))*np.sin(phi1),   np.sin(theta)]
-
-            vertices += [v0[0], v0[1], v0[2], 0.3, 0.3, 0.3, n0[0], n0[1], n0[2]]
-            vertices += [v1[0], v1[1], v1[2], 0.3, 0.3, 0.3, n1[0], n1[1], n1[2]]
-            vertices += [v2[0], v2[1], v2[2], 0.3, 0.3, 0.3, n2[0], n2[1], n2[2]]
-            vertices += [v3[0], v3[1], v3[2], 0.3, 0.3, 0.3, n3[0], n3[1], n3[2]]
-            indices += [ c + 0, c + 1, c +2 ]
-            indices += [ c + 2, c + 3, c + 0 ]
-            c += 4
-    
-    return bs.Shape(vertices, indices)
+    return bs.parametricSurface(_torusPosition, _torusNormal, ((0, 2 * np.pi), (0, 2 * np.pi)),
+                                N, N, ["position", (0.3, 0.3, 0.3), "normal"])
 
 # creates the shape of a torus with textures
 # returns a Shape
 def createTextureTorus(N):
-    vertices = []
-    indices = []
-    dPhi = 2 * np.pi/N
-    dTheta = 2 * np.pi/N
-    c= 0
-    for i in range(N):
-        theta = i * dTheta
-        theta1 = (i + 1) * dTheta
-        for j in range(N):
-            phi = j*dPhi
-            phi1 = (j+1)*dPhi
-
-            v0 = [(0.5 + 0.1*np.cos(theta))*np.cos(phi), (0.5 + 0.1*np.cos(theta))*np.sin(phi), 0.1 * np.sin(theta)]
-            v1 = [(0.5 + 0.1*np.cos(theta1))*np.cos(phi), (0.5 + 0.1*np.cos(theta1))*np.sin(phi), 0.1 * np.sin(theta1)]
-            v2 = [(0.5 + 0.1*np.cos(theta1))*np.cos(phi1), (0.5 + 0.1*np.cos(theta1))*np.sin(phi1), 0.1 * np.sin(theta1)]
-            v3 = [(0.5 + 0.1*np.cos(theta))*np.cos(phi1), (0.5 + 0.1*np.cos(theta))*np.sin(phi1), 0.1 * np.sin(theta)]
-
-            n0 = [(0.5 + np.cos(theta))*np.cos(phi), (0.5 + np.cos(theta))*np.sin(phi),  np.sin(theta)]
-            n1 = [(0.5 + np.cos(theta1))*np.cos(phi), (0.5 + np.cos(theta1))*np.sin(phi), np.sin(theta1)]
-            n2 = [(0.5 + np.cos(theta1))*np.cos(phi1), (0.5 + np.cos(theta1))*np.sin(phi1),  np.sin(theta1)]
-            n3 = [(0.5 + np.cos(theta))*np.cos(phi1), (0.5 + np.cos(theta))*np.sin(phi1),   np.sin(theta)]
-
-            vertices += [v0[0], v0[1], v0[2], 0, 0, n0[0], n0[1], n0[2]]
-            vertices += [v1[0], v1[1], v1[2], 0, 1, n1[0], n1[1], n1[2]]
-            vertices += [v2[0], v2[1], v2[2], 1, 1, n2[0], n2[1], n2[2]]
-            vertices += [v3[0], v3[1], v3[2], 0, 1, n3[0], n3[1], n3[2]]
-            indices += [ c + 0, c + 1, c +2 ]
-            indices += [ c + 2, c + 3, c + 0 ]
-            c += 4
-    
-    return bs.Shape(vertices, indices)
+    # La imagen cubre el toro una vez
+    return bs.parametricSurface(_torusPosition, _torusNormal, ((0, 2 * np.pi), (0, 2 * np.pi)),
+                                N, N, ["position", "uv", "normal"])
 
 def createColorNormalsBorder(r, g, b):
 
@@ -631,7 +564,7 @@ def createColorNormalsBorder(r, g, b):
          19,18,17,17,16,19, # Y+
          20,21,22,22,23,20] # Y-
 
-    return bs.Shape(vertices, indices)
+    return bs.Shape(vertices, indices, stride=9)
 
 
 def createTable(pipeline):
@@ -741,7 +674,7 @@ def createTextureNormalsCube(nx, ny):
          19,18,17,17,16,19, # Y+
          20,21,22,22,23,20] # Y-
 
-    return bs.Shape(vertices, indices)
+    return bs.Shape(vertices, indices, stride=8)
 
 # creates a node for the sphere mesh
 # returns a sceneGraphNode